@@ -1,9 +1,6 @@
-from .scf_base import SiriusBaseCalculation, make_sirius_json
+from .scf_base import SiriusBaseCalculation
 from aiida.plugins import DataFactory
 from aiida.common import datastructures
-import tempfile
-import json
-import yaml
 import six
 
 SiriusMDParameters = DataFactory('sirius.md')
@@ -38,35 +35,14 @@ class SiriusMDCalculation(SiriusBaseCalculation):
         codeinfo.stdout_name = self.metadata.options.output_filename
         codeinfo.withmpi = self.inputs.metadata.options.withmpi
 
-        # with config from input
-        structure = self.inputs.structure
-        kpoints = self.inputs.kpoints
-        magnetization = self.inputs.magnetization
-        # sirius_json = make_sirius_json(self.inputs.sirius_config.get_dict()['parameters'],
-        sirius_json = self.inputs.sirius_config.get_dict()
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as sirius_tmpfile:
-            # insert Pseudopotentials directly into json
-            sirius_json = self._read_pseudos(sirius_json)
-            # dump to file
-            json.dump(sirius_json, sirius_tmpfile)
-        sirius_config = SinglefileData(file=sirius_tmpfile.name)
-        sirius_config.store()
-        # prepare YAML input for NLCG
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yml', delete=False) as sirius_md_yaml:
-            out = yaml.dump({'parameters': self.inputs.sirius_md_params.get_dict()})
-            md_tmpfile_name = sirius_md_yaml.name
-            sirius_md_yaml.write(out)
-        sirius_md_config = SinglefileData(file=md_tmpfile_name)
-        sirius_md_config.store()
+        # with config from input, the unit cell is taken from sirius_config
+        self._write_sirius_json(folder, self.inputs.sirius_config.get_dict())
+        # prepare YAML input for MD
+        self._write_yaml(folder, 'input.yml', {'parameters': self.inputs.sirius_md_params.get_dict()})
 
         # Prepare a `CalcInfo` to be returned to the engine
-        calcinfo = datastructures.CalcInfo()
+        calcinfo = self._input_calcinfo(folder)
         calcinfo.codes_info = [codeinfo]
-        calcinfo.local_copy_list = [
-            (sirius_config.uuid, sirius_config.filename, 'sirius.json'),
-            (sirius_md_config.uuid, sirius_md_config.filename, 'input.yml')
-
-        ]
-        calcinfo.retrieve_list = [self.metadata.options.output_filename, 'md_results.json']
+        calcinfo.retrieve_list.extend([self.metadata.options.output_filename, 'md_results.json'])
 
         return calcinfo
@@ -1,12 +1,6 @@
-from .scf_base import (SiriusBaseCalculation,
-                       add_cell_kpoints_mag_to_sirius)
-from ..data.sirius_options import sirius_options
-from voluptuous import Schema
+from .scf_base import SiriusBaseCalculation
 from aiida.plugins import DataFactory
 from aiida.common import datastructures
-import tempfile
-import json
-import yaml
 import six
 
 NLCGParameters = DataFactory('sirius.py.nlcg')
@@ -43,37 +37,16 @@ class NLCGCalculation(SiriusBaseCalculation):
         # with config from input
         structure = self.inputs.structure
         kpoints = self.inputs.kpoints
-        magnetization = self.inputs.magnetization
 
         sirius_json = self.inputs.sirius_config.get_dict()
-        sirius_json = add_cell_kpoints_mag_to_sirius(sirius_json, structure,
-                                                     magnetization, kpoints)
-        # TODO check schema
-        Schema(sirius_options)(sirius_json)
-
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as sirius_tmpfile:
-            # insert Pseudopotentials directly into json
-            sirius_json = self._read_pseudos(sirius_json)
-            # dump to file
-            json.dump(sirius_json, sirius_tmpfile)
-        sirius_config = SinglefileData(file=sirius_tmpfile.name)
-        sirius_config.store()
+        # validated as written, with the k-points and resolved control entries
+        self._write_sirius_json(folder, sirius_json, structure=structure, kpoints=kpoints, validate=True)
         # prepare YAML input for NLCG
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as nlcg_yaml:
-            out = yaml.dump(self.inputs.nlcgparams.get_dict())
-            nlcg_tmpfile_name = nlcg_yaml.name
-            nlcg_yaml.write(out)
-        nlcg_config = SinglefileData(file=nlcg_tmpfile_name)
-        nlcg_config.store()
+        self._write_yaml(folder, 'nlcg.yaml', self.inputs.nlcgparams.get_dict())
 
         # Prepare a `CalcInfo` to be returned to the engine
-        calcinfo = datastructures.CalcInfo()
+        calcinfo = self._input_calcinfo(folder)
         calcinfo.codes_info = [codeinfo]
-        calcinfo.local_copy_list = [
-            (sirius_config.uuid, sirius_config.filename, 'sirius.json'),
-            (nlcg_config.uuid, nlcg_config.filename, 'nlcg.yaml')
-
-        ]
-        calcinfo.retrieve_list = [self.metadata.options.output_filename]
+        calcinfo.retrieve_list.append(self.metadata.options.output_filename)
 
         return calcinfo
@@ -0,0 +1,261 @@
+"""
+Content-addressed store of converted pseudopotentials on a remote computer.
+
+Converted pseudopotentials are kept in ``<directory>/v<converter version>/<key>.json``
+on the computer, the key is the md5 checksum of the UPF file (with the
+suffix ``.p<digits>`` for files written with reduced precision). A calculation
+uploads a pseudopotential only if the store does not have it yet, the job
+script then copies it into the store and fails if the copy fails. Otherwise
+the file is symlinked from the store into the working directory.
+
+The contents of the store are recorded as members of a group per computer
+and converter version (`UpfData` nodes), adding and removing members are
+single rows in the database, concurrent daemon workers never lose updates.
+The job script lists the files it stored and the linked files it did not
+find in ``RECORD_FILE``, which is retrieved. Once the calculation has
+finished the stored files are recorded and the missing ones are dropped
+(see `SiriusBaseCalculation.parse`).
+The store directory defaults to ``<computer workdir>/sirius_pseudos`` and can
+be changed with ``verdi data sirius remote-cache set-dir``.
+"""
+from __future__ import absolute_import
+
+import getpass
+import posixpath
+import re
+
+from six.moves import shlex_quote
+
+from ..upf_to_json import CONVERTER_VERSION
+
+#: computer property holding the store directory
+DIRECTORY_PROPERTY = 'sirius_remote_pseudo_dir'
+#: prefix of the labels of the groups recording the store contents
+GROUP_PREFIX = 'sirius_remote_pseudos'
+#: file marking the directories of a converter version created by the plugin
+MARKER_FILE = '.aiida_sirius_store'
+#: file written by the job script listing the stored and the missing linked pseudopotentials
+RECORD_FILE = 'sirius_pseudo_store.txt'
+
+_LABEL_RE = re.compile(r'/v(?P<version>\d+)(?:/p(?P<precision>\d+))?$')
+_VERSION_DIR_RE = re.compile(r'^v(?P<version>\d+)$')
+
+
+def entry_key(md5, precision=None):
+    """Key of the store entry of the pseudopotential `md5` written with `precision` digits."""
+    if precision is None:
+        return md5
+    return '{}.p{}'.format(md5, int(precision))
+
+
+def read_record(text):
+    """Keys of the stored and of the missing linked pseudopotentials in the content of ``RECORD_FILE``.
+
+    :returns: tuple of sets (stored, missing)
+    """
+    entries = {'stored': set(), 'missing': set()}
+    for line in text.splitlines():
+        status, _, key = line.strip().partition(' ')
+        if status in entries and key:
+            entries[status].add(key)
+    return entries['stored'], entries['missing']
+
+
+def _remote_username(computer, user):
+    """User name on `computer`, needed to resolve ``{username}`` in the working directory."""
+    if computer.get_transport_type() == 'local':
+        return getpass.getuser()
+    authinfo = computer.get_authinfo(user)
+    username = authinfo.get_auth_params().get('username')
+    if not username:
+        raise ValueError('cannot resolve the remote user name of computer {}, set the directory of the '
+                         'pseudopotential store with `verdi data sirius remote-cache set-dir`'.format(computer.label))
+    return username
+
+
+class RemotePseudoCache(object):
+    """Store of converted pseudopotentials on `computer`.
+
+    :param computer: `aiida.orm.Computer`
+    :param user: `aiida.orm.User` owning the calculations, used to resolve the default directory
+    :param version: converter version, part of the file path
+    :param precision: significant digits of the stored files, `None` for full precision
+    """
+
+    def __init__(self, computer, user=None, version=CONVERTER_VERSION, precision=None):
+        self.computer = computer
+        self.user = user
+        self.version = version
+        self.precision = precision
+
+    @property
+    def directory(self):
+        """Absolute path of the store on the computer."""
+        directory = self.computer.get_property(DIRECTORY_PROPERTY, None)
+        if directory is None:
+            workdir = self.computer.get_workdir()
+            if '{username}' in workdir:
+                workdir = workdir.format(username=_remote_username(self.computer, self.user))
+            directory = posixpath.join(workdir, 'sirius_pseudos')
+        return directory
+
+    @property
+    def version_dir(self):
+        """Directory holding the entries of the converter version."""
+        return posixpath.join(self.directory, 'v{}'.format(self.version))
+
+    def stale_version_dirs(self, transport):
+        """Directories of older converter versions in the store, the ones `prune` removes.
+
+        Only directories named ``v<version>`` holding the marker file written
+        by `upload_command` are returned, anything else in the store directory
+        was not created by the plugin. The current (and any newer) converter
+        version is never returned.
+
+        :param transport: open transport to the computer
+        :returns: list of (version, absolute path)
+        """
+        if not transport.isdir(self.directory):
+            return []
+        stale = []
+        for name in sorted(transport.listdir(self.directory)):
+            match = _VERSION_DIR_RE.match(name)
+            if match is None or int(match.group('version')) >= self.version:
+                continue
+            path = posixpath.join(self.directory, name)
+            if transport.isfile(posixpath.join(path, MARKER_FILE)):
+                stale.append((int(match.group('version')), path))
+        return stale
+
+    def key(self, md5):
+        """Key of the entry of the pseudopotential `md5`, see `entry_key`."""
+        return entry_key(md5, self.precision)
+
+    @staticmethod
+    def filename(key):
+        return key + '.json'
+
+    def path(self, key):
+        """Remote path of the entry `key`."""
+        return posixpath.join(self.version_dir, self.filename(key))
+
+    def group_label(self, version=None, precision=None):
+        """Label of the group recording the entries of `version` and `precision`."""
+        label = '{}/{}/v{}'.format(GROUP_PREFIX, self.computer.uuid, self.version if version is None else version)
+        if precision is not None:
+            label += '/p{}'.format(int(precision))
+        return label
+
+    def _groups(self, version=None):
+        """Tuples (group, version, precision) of the recorded entries, all versions if `version` is `None`."""
+        from aiida.orm import Group, QueryBuilder
+
+        builder = QueryBuilder().append(
+            Group, filters={'label': {'like': '{}/{}/v%'.format(GROUP_PREFIX, self.computer.uuid)}})
+        groups = []
+        for group, in builder.iterall():
+            match = _LABEL_RE.search(group.label)
+            if match is None:
+                continue
+            precision = match.group('precision')
+            group_version = int(match.group('version'))
+            if version is None or group_version == version:
+                groups.append((group, group_version, None if precision is None else int(precision)))
+        return groups
+
+    def _group(self):
+        """Group recording the entries of this version and precision, created if needed."""
+        from aiida.orm import Group
+
+        label = self.group_label(precision=self.precision)
+        try:
+            group, _ = Group.objects.get_or_create(label=label)
+        except Exception:  # pylint: disable=broad-except
+            # created concurrently by another worker
+            group = Group.objects.get(label=label)
+        return group
+
+    @staticmethod
+    def _members(group):
+        """md5 checksums of the `UpfData` nodes of `group`, {md5: [pk, ...]}."""
+        from aiida.orm import Group, QueryBuilder, UpfData
+
+        builder = QueryBuilder().append(Group, filters={'id': group.pk}, tag='group')
+        builder.append(UpfData, with_group='group', project=['id', 'attributes.md5'])
+        members = {}
+        for pk, md5 in builder.iterall():
+            members.setdefault(md5, []).append(pk)
+        return members
+
+    def entries(self, version=None):
+        """Keys of the recorded entries of `version` (default: the converter version), all precisions."""
+        version = self.version if version is None else version
+        return set(entry_key(md5, precision) for group, _, precision in self._groups(version)
+                   for md5 in self._members(group))
+
+    def versions(self):
+        """Converter versions with recorded entries."""
+        return sorted(set(version for group, version, _ in self._groups() if not group.is_empty))
+
+    def __contains__(self, md5):
+        return self.key(md5) in self.entries()
+
+    def add(self, upfs):
+        """Record the `UpfData` nodes `upfs` as present in the store (of this precision)."""
+        group = self._group()
+        present = self._members(group)
+        nodes = [upf for upf in upfs if upf.md5sum not in present]
+        if nodes:
+            group.add_nodes(nodes)
+
+    def forget(self, keys=None, version=None):
+        """Remove the entries `keys` (default: all) of `version` from the records."""
+        from aiida.orm import Group, load_node
+
+        version = self.version if version is None else version
+        for group, _, precision in self._groups(version):
+            if keys is None:
+                Group.objects.delete(group.pk)
+                continue
+            members = self._members(group)
+            pks = [pk for md5, pks in members.items() if entry_key(md5, precision) in keys for pk in pks]
+            if pks:
+                group.remove_nodes([load_node(pk) for pk in pks])
+
+    def clear(self):
+        """Remove the records of all versions (e.g. when the directory changes)."""
+        from aiida.orm import Group
+
+        for group, _, _ in self._groups():
+            Group.objects.delete(group.pk)
+
+    def upload_command(self, filenames):
+        """Shell command copying the uploaded `filenames` (<key>.json) from the working directory into the store.
+
+        Files are copied to a temporary name and renamed, concurrent jobs never
+        see partial files. Stored files are listed in ``RECORD_FILE``, the job
+        script exits if a file can not be stored. The directory is marked as
+        created by the plugin, see `stale_version_dirs`.
+        """
+        if not filenames:
+            return ''
+        directory = shlex_quote(self.version_dir)
+        return ('mkdir -p {dir} && touch {dir}/{marker} || exit 1\n'
+                'for f in {files}; do\n'
+                '    cp "$f" {dir}/."$f".$$ && mv -f {dir}/."$f".$$ {dir}/"$f" && '
+                'echo "stored ${{f%.json}}" >> {record} || '
+                '{{ rm -f {dir}/."$f".$$; echo "failed to store $f in {dir}" >&2; exit 1; }}\n'
+                'done'.format(dir=directory, marker=MARKER_FILE, record=RECORD_FILE,
+                              files=' '.join(shlex_quote(name) for name in filenames)))
+
+    @staticmethod
+    def check_command(filenames):
+        """Shell command listing the linked `filenames` (<key>.json) missing in the working directory.
+
+        The keys of the missing files are written to ``RECORD_FILE``, their records are dropped after parsing.
+        """
+        if not filenames:
+            return ''
+        return ('for f in {files}; do\n'
+                '    [ -e "$f" ] || echo "missing ${{f%.json}}" >> {record}\n'
+                'done'.format(record=RECORD_FILE, files=' '.join(shlex_quote(name) for name in filenames)))
@@ -5,20 +5,27 @@ Register calculations via the "aiida.calculations" entry point in setup.json.
 """
 from __future__ import absolute_import
 
+import gzip
+import io
 import json
-import tempfile
-from copy import deepcopy
+import os
+import threading
+from collections import OrderedDict
 
 import numpy as np
 import six
+import yaml
 
 from aiida.common import datastructures
+from aiida.common.files import md5_file
 # from aiida.common.constants import bohr_to_ang
 from aiida.engine import CalcJob
-from aiida.orm import StructureData, UpfData
+from aiida.orm import StructureData, UpfData, QueryBuilder
 from aiida.plugins import DataFactory
 
-from ..upf_to_json import upf_to_json
+from ..data.sirius_options import get_sirius_schema
+from ..upf_to_json import upf_data_to_json, dump_pseudo, dump_pseudo_string
+from .remote_pseudos import RECORD_FILE, RemotePseudoCache, entry_key, read_record
 
 SiriusParameters = DataFactory('sirius.scf')
 SinglefileData = DataFactory('singlefile')
@@ -28,108 +35,374 @@ Dict = DataFactory('dict')
 # CODATA 2018
 bohr_to_ang = 0.529177210903
 
+SIRIUS_JSON = 'sirius.json'
+#: environment variable setting the size (MiB) of the fragment cache of the input renderer
+RENDERER_CACHE_ENV = 'AIIDA_SIRIUS_RENDERER_CACHE_MB'
+#: default size (MiB) of the fragment cache of the input renderer
+RENDERER_CACHE_MB = 32
 
-def read_structure(structure, magnetization):
-    """
-    Convert obj of type `StructureData` to sirius input format (e.g. a dictionary)
-    Return:
-    - cell
-    - atomic coordinates
-    """
-    cell = structure.cell
-    # cell in atomic units
-    cell = np.array(cell) / bohr_to_ang
-    # convert back to list of list
-    cell = [list(x) for x in cell]
-    sites = structure.sites
-    atom_types = set([x.kind_name for x in sites])
-    atomic_coordinates = {}
-    for atom_type in atom_types:
-        ltypes = list(filter(lambda x: x.kind_name == atom_type, sites))
-        lpos = np.array([x.position for x in ltypes])
-        try:
-            lmag = np.array(magnetization[atom_type])
-        except KeyError:
-            lmag = np.zeros_like(lpos)
-        lpos_with_mag = np.concatenate((lpos, lmag), axis=1)
-        atomic_coordinates[atom_type] = [list(x) for x in lpos_with_mag]
-    return cell, atomic_coordinates
-
-
-def make_sirius_json(parameters, structure, kpoints, magnetization):
-    """
-    DEPRECATED
-    Keyword Arguments:
-    structure -- structure
-    pseudos   -- dictionary of UpfData
-    """
-    raise Exception('deprecated')
-    sirius_cell, sirius_pos = read_structure(structure, magnetization.get_dict())
-    sirius_json = {'parameters': deepcopy(parameters)}
-    sirius_json['unit_cell']['lattice_vectors'] = sirius_cell
-    sirius_json['unit_cell']['atom_types'] = list(sirius_pos.keys())
-    sirius_json['unit_cell']['atom_coordinate_units'] = 'A'
-    sirius_json['unit_cell']['atoms'] = sirius_pos
+
+def kpoints_to_sirius(kpoints):
+    """Return the entries of the 'parameters' section describing `kpoints` (ngridk/shiftk or vk)."""
     if 'mesh' in kpoints.attributes:
-        sirius_json['parameters']['ngridk'] = kpoints.attributes['mesh']
-        sirius_json['parameters']['shiftk'] = kpoints.attributes['offset']
-    else:
-        print('setting kpoints as list(list)')
-        print(kpoints.get_kpoints())
-        sirius_json['parameters']['vk'] = [list(x) for x in kpoints.get_kpoints()]
+        return {'ngridk': kpoints.attributes['mesh'], 'shiftk': kpoints.attributes['offset']}
+    return {'vk': kpoints.get_array('kpoints').tolist()}
+
+
+def structure_to_sirius(structure, magnetization):
+    """
+    Return the 'unit_cell' section for `structure`, `atom_files` refer to `<kind>.json`.
+
+    Sites are grouped by kind in a single pass over the structure, hence the
+    cost is linear in the number of atoms.
 
-    return sirius_json
+    :param structure: aiida structure
+    :param magnetization: {ATOM: [x, y, z]} or {ATOM: [[x, y, z], ...]} (one vector per site of the kind),
+        note magnetization is given as a 3d vector
+    """
+    unit_cell = {}
+    # add lattice vectors (unit is bohr)
+    unit_cell['lattice_vectors'] = (np.array(structure.attributes['cell']) / bohr_to_ang).tolist()
+    unit_cell['lattice_vectors_scale'] = 1
+
+    sites = structure.attributes['sites']
+    kind_names = [site['kind_name'] for site in sites]
+    # kinds in order of first occurrence
+    elems = list(dict.fromkeys(kind_names))
+    kind_ids = {elem: i for i, elem in enumerate(elems)}
+
+    unit_cell['atom_types'] = elems
+    unit_cell['atom_files'] = {elem: elem + '.json' for elem in elems}
+    unit_cell['atom_coordinate_units'] = 'A'
+
+    # group sites by kind, keeping the order of the sites within a kind
+    kind_index = np.fromiter((kind_ids[name] for name in kind_names), dtype=int, count=len(kind_names))
+    order = np.argsort(kind_index, kind='stable')
+    counts = np.bincount(kind_index, minlength=len(elems))
+    positions = np.array([site['position'] for site in sites], dtype=float).reshape(-1, 3)[order]
+
+    # magnetization of all sites, (x, y, z) per kind is broadcast to all its sites
+    magnetization = dict(magnetization)
+    magnetic = [elem in magnetization for elem in elems]
+    if any(magnetic):
+        moments = np.concatenate([
+            np.broadcast_to(np.array(magnetization[elem], dtype=float), (count, 3)) if is_magnetic else
+            np.zeros((count, 3)) for elem, count, is_magnetic in zip(elems, counts, magnetic)
+        ])
+        positions = np.hstack((positions, moments))
+
+    unit_cell['atoms'] = {}
+    for elem, block, is_magnetic in zip(elems, np.split(positions, np.cumsum(counts)[:-1]), magnetic):
+        unit_cell['atoms'][elem] = (block if is_magnetic else block[:, :3]).tolist()
+
+    return unit_cell
 
 
 def add_cell_kpoints_mag_to_sirius(sirius_params, structure, magnetization, kpoints):
     """
     Add atoms, lattice vectors, kpoints and magnetization to sirius_params.
 
+    `sirius_params` is not modified, the returned dictionary shares all
+    entries except 'parameters' and 'unit_cell' with it.
+
     :param sirius_params: sirius json
     :param structure: aiida structure
-    :param magnetization: {ATOM: [x, y, z]},
-        note magnetization is given as a 3d vector
+    :param magnetization: {ATOM: [x, y, z]}, see `structure_to_sirius`
     :param kpoints: aiida kpoints
     """
-    sout = deepcopy(sirius_params)
+    sout = dict(sirius_params)
+    sout['parameters'] = dict(sirius_params['parameters'])
+    sout['parameters'].update(kpoints_to_sirius(kpoints))
+    sout['unit_cell'] = structure_to_sirius(structure, magnetization)
+    return sout
 
-    sout['unit_cell'] = {}
-    # add lattice vectors (unit is bohr)
-    sout['unit_cell']['lattice_vectors'] = [
-        list(x) for x in np.array(structure.attributes['cell']) / bohr_to_ang
-    ]
-    sout['unit_cell']['lattice_vectors_scale'] = 1
 
-    elems = set([site['kind_name'] for site in structure.attributes['sites']])
+def pseudo_key(upf, precision=None):
+    """Name (without '.json') of the separate file of the pseudopotential `upf` written with `precision` digits."""
+    return entry_key(upf.md5sum, precision)
 
-    sout['unit_cell']['atom_types'] = list(elems)
-    sout['unit_cell']['atom_files'] = {elem: elem + '.json' for elem in elems}
-    sout['unit_cell']['atom_coordinate_units'] = 'A'
 
-    if 'mesh' in kpoints.attributes:
-        sout['parameters']['ngridk'] = kpoints.attributes['mesh']
-        sout['parameters']['shiftk'] = kpoints.attributes['offset']
-    else:
-        sout['parameters']['vk'] = [list(x) for x in kpoints.get_array('kpoints')]
-
-    sout['unit_cell']['atoms'] = {}
-    for atom_type in elems:
-        angstrom_coords = []
-        for site in filter(lambda x: x['kind_name'] == atom_type,
-                           structure.attributes['sites']):
-            angstrom_coords.append(site['position'])
-
-        if atom_type in dict(magnetization):
-            coords_magnetization = np.hstack((np.array(angstrom_coords),
-                                              np.array(magnetization[atom_type])))
+def _json_members(obj):
+    """Members of a json object without the enclosing braces."""
+    return json.dumps(obj)[1:-1]
+
+
+class _CaptureWriter(object):
+    """Forward everything written to `handle` and keep a copy of up to `limit` characters."""
+
+    def __init__(self, handle, limit):
+        self.handle = handle
+        self.limit = limit
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self.handle.write(text)
+        if self._parts is not None:
+            self._size += len(text)
+            self._parts.append(text)
+            if self._size > self.limit:
+                self._parts = None
+
+    def getvalue(self):
+        """Everything written, `None` if more than `limit` characters."""
+        return None if self._parts is None else ''.join(self._parts)
+
+
+class SiriusInputRenderer(object):
+    """Render sirius.json from the inputs of a calculation, reusing serialized fragments.
+
+    The unit cell (structure and magnetization), the k-points and the
+    pseudopotentials are serialized once and kept in an LRU cache keyed by
+    the node hashes (md5 and file name for pseudopotentials). Calculations on the same
+    structure with different parameters, e.g. a sweep of `pw_cutoff`, only
+    serialize the small parameter sections again.
+
+    sirius.json is written section by section to the output handle, the
+    complete file never exists in memory. Pseudopotentials are streamed from
+    the converted dictionaries and only kept as fragments if they are small.
+
+    :param max_bytes: size of the cached fragments, least recently used ones are dropped
+    :param max_pseudo_bytes: largest pseudopotential fragment that is cached
+    """
+
+    def __init__(self, max_bytes=RENDERER_CACHE_MB * 1024**2, max_pseudo_bytes=8 * 1024**2):
+        self.max_bytes = max_bytes
+        self.max_pseudo_bytes = max_pseudo_bytes
+        self._fragments = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._fragments:
+                self._fragments.move_to_end(key)
+                return self._fragments[key]
+        return None
+
+    def _store(self, key, fragment):
+        if len(fragment[0]) > self.max_bytes:
+            return
+        with self._lock:
+            if key not in self._fragments:
+                self._fragments[key] = fragment
+                self._size += len(fragment[0])
+            while self._size > self.max_bytes and self._fragments:
+                _, (text, _) = self._fragments.popitem(last=False)
+                self._size -= len(text)
+
+    def _fragment(self, key, render):
+        """Return the fragment `key`, `render()` returns (text, metadata) on a miss.
+
+        Fragments with the key `None` are rendered but not kept.
+        """
+        if key is None:
+            return render()
+        fragment = self._lookup(key)
+        if fragment is None:
+            fragment = render()
+            self._store(key, fragment)
+        return fragment
+
+    def _write_fragment(self, handle, key, write):
+        """Write the fragment `key` to `handle`, `write(handle)` streams it on a miss.
+
+        Streamed fragments are kept only up to `max_pseudo_bytes`, larger ones
+        are never held in memory as a whole.
+        """
+        fragment = self._lookup(key)
+        if fragment is not None:
+            handle.write(fragment[0])
+            return
+        capture = _CaptureWriter(handle, self.max_pseudo_bytes)
+        write(capture)
+        text = capture.getvalue()
+        if text is not None:
+            self._store(key, (text, None))
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._size = 0
+
+    def kpoints_fragment(self, kpoints):
+        """Members of 'parameters' for `kpoints` and their names.
+
+        Unstored k-points (e.g. reduced ones) have no hash, they are not cached.
+        """
+        def render():
+            entries = kpoints_to_sirius(kpoints)
+            return _json_members(entries), tuple(entries)
+
+        return self._fragment(('kpoints', kpoints.get_hash()) if kpoints.is_stored else None, render)
+
+    def structure_fragment(self, structure, magnetization):
+        """Members of 'unit_cell' except 'atom_files' and the atom types."""
+        def render():
+            unit_cell = structure_to_sirius(structure, magnetization)
+            get_sirius_schema(('unit_cell',))({'unit_cell': unit_cell})
+            atom_types = unit_cell['atom_types']
+            del unit_cell['atom_files']
+            return _json_members(unit_cell), atom_types
+
+        return self._fragment(('structure', structure.get_hash(), magnetization.get_hash()), render)
+
+    def write_pseudo(self, handle, upf, separate, precision=None):
+        """Write the pseudopotential `upf` as json string (embedded) or as json file (`separate`) to `handle`.
+
+        The converted pseudopotential is pulled from the pseudopotential cache
+        and written entry by entry, escaped on the fly when embedded.
+
+        :param precision: significant digits of the floats, `None` for full precision (see `dump_pseudo`)
+        """
+        if separate:
+            self._write_fragment(handle, ('pseudo_file', upf.md5sum, upf.filename, precision),
+                                 lambda out: dump_pseudo(upf_data_to_json(upf), out, precision=precision))
         else:
-            coords_magnetization = angstrom_coords
+            self._write_fragment(handle, ('pseudo', upf.md5sum, upf.filename, precision),
+                                 lambda out: dump_pseudo_string(upf_data_to_json(upf), out, precision=precision))
+
+    def render_to(self, handle, sirius_config, structure=None, magnetization=None, kpoints=None, pseudos=None,
+                  folder=None, separate_pseudo_files=False, remote_files=(), pseudo_precision=None):
+        """Write sirius.json to `handle`.
+
+        :param sirius_config: dictionary with the sections of sirius.json, 'unit_cell'
+            is replaced if a structure is given and k-points override entries of 'parameters'
+        :param structure: `StructureData`, `magnetization` (`Dict`) is required with it
+        :param kpoints: `KpointsData`
+        :param pseudos: mapping of kind names to `UpfData`
+        :param folder: calculation folder, `<md5>.json` files are written to it for `separate_pseudo_files`
+        :param separate_pseudo_files: refer to pseudopotentials by file name instead of embedding them
+        :param remote_files: pseudopotential files provided on the remote computer, they are not written to `folder`
+        :param pseudo_precision: significant digits of the pseudopotential floats, `None` for full precision
+        """
+        if separate_pseudo_files and folder is None:
+            raise ValueError('separate_pseudo_files requires the calculation folder')
+        pseudos = pseudos or {}
+        sections = list(sirius_config)
+        for section in ('parameters', 'unit_cell'):
+            if section not in sections:
+                sections.append(section)
+
+        handle.write('{')
+        for i, section in enumerate(sections):
+            if i > 0:
+                handle.write(',')
+            handle.write(json.dumps(section) + ':')
+            if section == 'parameters':
+                parameters = sirius_config.get('parameters', {})
+                members = []
+                if kpoints is not None:
+                    kpoints_members, names = self.kpoints_fragment(kpoints)
+                    parameters = {key: value for key, value in parameters.items() if key not in names}
+                    members.append(kpoints_members)
+                members.insert(0, _json_members(parameters))
+                handle.write('{' + ','.join(member for member in members if member) + '}')
+            elif section == 'unit_cell':
+                self._write_unit_cell(handle, sirius_config, structure, magnetization, pseudos, folder,
+                                      separate_pseudo_files, remote_files, pseudo_precision)
+            else:
+                handle.write(json.dumps(sirius_config[section]))
+        handle.write('}')
+
+    def _write_unit_cell(self, handle, sirius_config, structure, magnetization, pseudos, folder, separate,
+                         remote_files, precision):
+        if structure is not None:
+            members, atom_types = self.structure_fragment(structure, magnetization)
+            atom_files = OrderedDict((elem, elem + '.json') for elem in atom_types)
+        else:
+            unit_cell = dict(sirius_config.get('unit_cell', {}))
+            atom_files = OrderedDict(unit_cell.pop('atom_files', {}))
+            members = _json_members(unit_cell)
+        # file names or `UpfData`
+        atom_files.update(pseudos)
+
+        handle.write('{')
+        if members:
+            handle.write(members + ',')
+        handle.write('"atom_files":{')
+        for i, (label, value) in enumerate(atom_files.items()):
+            if i > 0:
+                handle.write(',')
+            handle.write(json.dumps(label) + ':')
+            if isinstance(value, six.string_types):
+                handle.write(json.dumps(value))
+            elif separate:
+                filename = pseudo_key(value, precision) + '.json'
+                if filename not in remote_files and not folder.isfile(filename):
+                    with folder.open(filename, 'w') as pseudo_handle:
+                        self.write_pseudo(pseudo_handle, value, separate=True, precision=precision)
+                handle.write(json.dumps(filename))
+            else:
+                self.write_pseudo(handle, value, separate=False, precision=precision)
+        handle.write('}}')
+
+    def render(self, sirius_config, **kwargs):
+        """Return sirius.json as string, see `render_to`."""
+        handle = io.StringIO()
+        self.render_to(handle, sirius_config, **kwargs)
+        return handle.getvalue()
+
+
+_INPUT_RENDERER = None
+
+
+def get_input_renderer():
+    """Return the process wide `SiriusInputRenderer`.
+
+    Its fragment cache holds ``$AIIDA_SIRIUS_RENDERER_CACHE_MB`` MiB (default 32).
+    """
+    global _INPUT_RENDERER  # pylint: disable=global-statement
+    if _INPUT_RENDERER is None:
+        max_mb = float(os.environ.get(RENDERER_CACHE_ENV) or RENDERER_CACHE_MB)
+        _INPUT_RENDERER = SiriusInputRenderer(max_bytes=int(max_mb * 1024**2))
+    return _INPUT_RENDERER
 
-        sout['unit_cell']['atoms'][atom_type] = [
-            list(x) for x in coords_magnetization
-        ]
 
-    return sout
+class InputFolder(object):
+    """Write input files into a calculation folder, optionally gzip compressed.
+
+    Compressed files are written as `<filename>.gz`, `decompress_command`
+    returns the shell command inflating them on the remote computer. Files
+    already present on the remote computer are added with `link`.
+
+    :param folder: `aiida.common.folders.Folder`
+    :param compress: write gzip compressed files
+    """
+
+    def __init__(self, folder, compress=False):
+        self.folder = folder
+        self.compress = compress
+        self.compressed = []
+        #: list of (remote path, filename)
+        self.remote_files = []
+        #: shell commands run after decompressing
+        self.commands = []
+
+    def filename(self, filename):
+        """Name of the file written for `filename`."""
+        return filename + '.gz' if self.compress else filename
+
+    def isfile(self, filename):
+        return self.folder.isfile(self.filename(filename))
+
+    def open(self, filename, mode='w'):
+        """Open `filename` for writing (text mode)."""
+        if not self.compress:
+            return self.folder.open(filename, mode)
+        self.compressed.append(self.filename(filename))
+        return gzip.open(self.folder.get_abs_path(self.filename(filename), check_existence=False), mode + 't',
+                         compresslevel=6, encoding='utf8')
+
+    def link(self, remote_path, filename):
+        """Provide the remote file `remote_path` as `filename`."""
+        self.remote_files.append((remote_path, filename))
+
+    def decompress_command(self):
+        """Shell command inflating the compressed files, empty if there are none."""
+        if not self.compressed:
+            return ''
+        return 'gunzip -f ' + ' '.join(self.compressed)
 
 
 class SiriusBaseCalculation(CalcJob):
@@ -145,6 +418,30 @@ class SiriusBaseCalculation(CalcJob):
         # yapf: disable
         super(SiriusBaseCalculation, cls).define(spec)
         spec.input('metadata.options.resources', valid_type=dict, default={'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+        spec.input('metadata.options.separate_pseudo_files', valid_type=bool, default=False,
+                   help='Write each distinct pseudopotential to its own <md5>.json file instead of embedding it in sirius.json.')
+        spec.input('metadata.options.pseudo_precision', valid_type=int, required=False,
+                   help='Significant digits of the floats of the pseudopotentials written to the inputs '
+                   '(default: full precision, the written values read back identically).')
+        spec.input('metadata.options.compress_inputs', valid_type=bool, default=False,
+                   help='Upload the input files gzip compressed, they are inflated by the job script.')
+        spec.input('metadata.options.remote_pseudo_cache', valid_type=bool, default=False,
+                   help='Keep the converted pseudopotentials in a store on the computer, upload only missing ones '
+                   '(implies `separate_pseudo_files`).')
+        spec.input('metadata.options.remote_pseudo_copy', valid_type=bool, default=False,
+                   help='Copy pseudopotentials from the remote store instead of symlinking them.')
+        spec.input('metadata.options.auto_resources', valid_type=dict, required=False,
+                   help='Choose `resources` from the estimated problem size, keys: `max_machines` (default 1), '
+                   '`mpiprocs_per_machine` (default of the computer), `memory_per_machine` (bytes, optional). '
+                   'The decision is stored as attribute `resource_plan`.')
+        spec.input('metadata.options.reduce_kpoints', valid_type=bool, default=False,
+                   help='Write an explicit list of k-points forming a complete mesh as `ngridk`/`shiftk` with '
+                   '`use_symmetry`, SIRIUS integrates over the irreducible k-points with their weights. '
+                   'Other lists, and lists of parameters with `use_symmetry: false`, are written unchanged '
+                   '(`vk` has uniform weights).')
+        spec.input('metadata.options.store_sirius_json', valid_type=bool, default=False,
+                   help='Store the rendered sirius.json as SinglefileData (deduplicated by md5), '
+                   'its uuid is set as extra `sirius_json` of the calculation (gzip compressed with `compress_inputs`).')
         spec.input('structure', valid_type=StructureData, help='The input structure')
         spec.input('kpoints', valid_type=KpointsData, help='kpoints')
         spec.input('sirius_config', valid_type=SiriusParameters, help='sirius parameters')
@@ -152,14 +449,260 @@ class SiriusBaseCalculation(CalcJob):
         spec.input_namespace('pseudos', valid_type=UpfData, dynamic=True,
                              help='A mapping of `UpfData` nodes onto the kind name to which they should apply.')
 
-    def _read_pseudos(self, sirius_json):
-        # parse pseudos
-        for atom_label in self.inputs.pseudos:
-            upf = self.inputs.pseudos[atom_label]
-            with upf.open() as fh:
-                upf_json = upf_to_json(fh.read(), fname=upf.filename)
-            sirius_json['unit_cell']['atom_files'][atom_label] = json.dumps(upf_json)
-        return sirius_json
+    def _setup_metadata(self):
+        """Store the options, with `auto_resources` replace `resources` by the planned ones."""
+        super(SiriusBaseCalculation, self)._setup_metadata()
+        auto_resources = self.inputs.metadata.options.get('auto_resources', None)
+        if auto_resources is not None:
+            plan = self._plan_resources(auto_resources)
+            self.node.set_option('resources', plan['resources'])
+            self.node.set_attribute('resource_plan', dict(plan))
+
+    def _estimate(self):
+        """Estimated problem size, see `helpers.estimate.estimate_calculation_cost`."""
+        if getattr(self, '_cost_estimate', None) is None:
+            from ..helpers.estimate import estimate_calculation_cost
+            self._cost_estimate = estimate_calculation_cost(  # pylint: disable=attribute-defined-outside-init
+                self.inputs.structure, self.inputs.kpoints, self.inputs.pseudos, self.inputs.sirius_config.get_dict())
+        return self._cost_estimate
+
+    def _num_ranks(self):
+        """Number of MPI ranks of the job."""
+        if not self.node.get_option('withmpi'):
+            return 1
+        resources = self.node.get_option('resources')
+        if 'tot_num_mpiprocs' in resources:
+            return resources['tot_num_mpiprocs']
+        mpiprocs_per_machine = resources.get('num_mpiprocs_per_machine')
+        if mpiprocs_per_machine is None:
+            mpiprocs_per_machine = self.inputs.code.computer.get_default_mpiprocs_per_machine() or 1
+        return resources.get('num_machines', 1) * mpiprocs_per_machine
+
+    def _plan_resources(self, auto_resources):
+        """Plan the resources of this calculation, see `helpers.planner.plan_resources`."""
+        from ..helpers.planner import plan_resources
+
+        parameters = self.inputs.sirius_config.get_dict()
+        estimate = self._estimate()
+        mpiprocs_per_machine = auto_resources.get('mpiprocs_per_machine',
+                                                  self.inputs.code.computer.get_default_mpiprocs_per_machine())
+        if mpiprocs_per_machine is None:
+            raise ValueError('auto_resources requires `mpiprocs_per_machine`, the computer has no default')
+        return plan_resources(
+            estimate, mpiprocs_per_machine,
+            max_machines=auto_resources.get('max_machines', 1),
+            memory_per_machine=auto_resources.get('memory_per_machine', None),
+            subspace_size=parameters.get('iterative_solver', {}).get('subspace_size', 4),
+            max_history=parameters.get('mixer', {}).get('max_history', 8))
+
+    def _resolve_auto_control(self, sirius_config):
+        """Return `sirius_config` with the 'auto' entries of the 'control' section resolved.
+
+        See `helpers.planner.resolve_control`, the resolved entries are set as extra `resolved_control`.
+        """
+        from ..helpers.planner import resolve_control
+
+        if 'auto' not in sirius_config.get('control', {}).values():
+            return sirius_config
+        resolved = resolve_control(sirius_config, self._estimate(), self._num_ranks())
+        self.node.set_extra('resolved_control', resolved)
+        return dict(sirius_config, control=dict(sirius_config['control'], **resolved))
+
+    def _reduce_kpoints(self, kpoints, sirius_config):
+        """Replace the explicit list `kpoints` by the mesh it forms, reduced by symmetry in SIRIUS.
+
+        SIRIUS gives all k-points of `vk` the same weight, a reduced list can
+        not be passed with its weights. A complete mesh is written as
+        `ngridk`/`shiftk` and `use_symmetry` is set, SIRIUS then reduces it
+        with the symmetry of the (magnetic) structure. Other lists, lists
+        with non-uniform weights and lists of parameters with `use_symmetry`
+        switched off are kept. The mesh is set as extra `reduced_kpoints`.
+
+        :returns: tuple (kpoints, sirius_config)
+        """
+        from ..helpers.kpoints import mesh_from_kpoint_list
+
+        if not sirius_config.get('parameters', {}).get('use_symmetry', True):
+            self.logger.warning('reduce_kpoints: use_symmetry is switched off in the parameters, '
+                                'the k-points are not reduced')
+            return kpoints, sirius_config
+        if 'weights' in kpoints.get_arraynames() and np.ptp(kpoints.get_array('weights')) > 0:
+            self.logger.warning('reduce_kpoints: the k-points have non-uniform weights, they are not reduced')
+            return kpoints, sirius_config
+        points = kpoints.get_kpoints()
+        mesh = mesh_from_kpoint_list(points)
+        if mesh is None:
+            self.logger.warning('reduce_kpoints: the k-points do not form a complete mesh, they are not reduced')
+            return kpoints, sirius_config
+        reduced = KpointsData()
+        reduced.set_kpoints_mesh(*mesh)
+        self.node.set_extra('reduced_kpoints', {'num_kpoints': len(points), 'mesh': mesh[0], 'offset': mesh[1]})
+        parameters = dict(sirius_config.get('parameters', {}), use_symmetry=True)
+        return reduced, dict(sirius_config, parameters=parameters)
+
+    def _input_folder(self, folder):
+        """Return the `InputFolder` used to write the input files into `folder`."""
+        writer = getattr(self, '_input_writer', None)
+        if writer is None or writer.folder is not folder:
+            writer = InputFolder(folder, compress=self.inputs.metadata.options.compress_inputs)
+            self._input_writer = writer  # pylint: disable=attribute-defined-outside-init
+        return writer
+
+    def _write_sirius_json(self, folder, sirius_config, structure=None, kpoints=None, validate=False):
+        """Render `sirius.json` into `folder` with the shared `SiriusInputRenderer`.
+
+        The pseudopotentials of the input namespace `pseudos` are added to
+        `atom_files`, either embedded as json strings or, with the option
+        `separate_pseudo_files`, as `<md5>.json` files in `folder`. Entries
+        'auto' of the 'control' section are resolved.
+
+        :param sirius_config: sections of sirius.json
+        :param structure: if given, replaces 'unit_cell' of `sirius_config` (with the input `magnetization`)
+        :param kpoints: if given, added to 'parameters' of `sirius_config`
+        :param validate: validate the final sections against `sirius_options`, see `_validate_sirius_json`
+        """
+        options = self.inputs.metadata.options
+        sirius_config = self._resolve_auto_control(sirius_config)
+        if options.reduce_kpoints and kpoints is not None and 'mesh' not in kpoints.attributes:
+            kpoints, sirius_config = self._reduce_kpoints(kpoints, sirius_config)
+        if validate:
+            self._validate_sirius_json(sirius_config, structure, kpoints)
+        inputs = self._input_folder(folder)
+        remote_files = self._link_remote_pseudos(inputs) if options.remote_pseudo_cache else ()
+        with inputs.open(SIRIUS_JSON, 'w') as handle:
+            get_input_renderer().render_to(
+                handle, sirius_config, structure=structure, magnetization=self.inputs.magnetization,
+                kpoints=kpoints, pseudos=self.inputs.pseudos, folder=inputs,
+                separate_pseudo_files=options.separate_pseudo_files or options.remote_pseudo_cache,
+                remote_files=remote_files, pseudo_precision=options.get('pseudo_precision', None))
+        if options.store_sirius_json:
+            self._store_rendered_input(folder, inputs.filename(SIRIUS_JSON))
+
+    @staticmethod
+    def _validate_sirius_json(sirius_config, structure=None, kpoints=None):
+        """Validate sirius.json as written, i.e. with the resolved 'control' and the k-point entries.
+
+        The 'unit_cell' generated from `structure` is validated by the renderer.
+
+        :raises voluptuous.Invalid: if the sections do not match `sirius_options`
+        """
+        sections = dict(sirius_config)
+        if kpoints is not None:
+            sections['parameters'] = dict(sections.get('parameters', {}), **kpoints_to_sirius(kpoints))
+        if structure is not None:
+            sections.pop('unit_cell', None)
+        get_sirius_schema()(sections)
+
+    def _remote_pseudo_cache(self):
+        return RemotePseudoCache(self.node.computer, self.node.user,
+                                 precision=self.inputs.metadata.options.get('pseudo_precision', None))
+
+    def _link_remote_pseudos(self, inputs):
+        """Link the pseudopotentials found in the remote store, schedule the others for the store.
+
+        The keys of the linked and uploaded pseudopotentials are set as extras
+        `remote_pseudo_links` and `remote_pseudo_uploads`. The job script
+        checks the links and reports the stored files, the records of the
+        store are updated once the calculation has finished (see `parse`).
+
+        :returns: file names of the linked pseudopotentials
+        """
+        cache = self._remote_pseudo_cache()
+        recorded = cache.entries()
+        links, uploads = [], []
+        for key in sorted(set(cache.key(upf.md5sum) for upf in self.inputs.pseudos.values())):
+            if key in recorded:
+                inputs.link(cache.path(key), cache.filename(key))
+                links.append(key)
+            else:
+                uploads.append(key)
+        if links:
+            inputs.commands.append(cache.check_command([cache.filename(key) for key in links]))
+            self.node.set_extra('remote_pseudo_links', links)
+        if uploads:
+            inputs.commands.append(cache.upload_command([cache.filename(key) for key in uploads]))
+            self.node.set_extra('remote_pseudo_uploads', uploads)
+        return [cache.filename(key) for key in links]
+
+    def _write_yaml(self, folder, filename, data):
+        """Write `data` as yaml file `filename` in `folder`."""
+        with self._input_folder(folder).open(filename, 'w') as handle:
+            yaml.dump(data, handle)
+
+    def _store_rendered_input(self, folder, filename):
+        """Store a file of `folder` as `SinglefileData`, reusing a stored node with identical content."""
+        path = folder.get_abs_path(filename)
+        md5 = md5_file(path)
+        builder = QueryBuilder().append(SinglefileData, filters={'extras.md5': md5})
+        existing = builder.first()
+        if existing is None:
+            node = SinglefileData(file=path)
+            node.store()
+            node.set_extra('md5', md5)
+        else:
+            node = existing[0]
+        if filename.endswith('.gz'):
+            filename = filename[:-len('.gz')]
+        self.node.set_extra(filename.replace('.', '_'), node.uuid)
+        return node
+
+    def _input_calcinfo(self, folder):
+        """Return a `CalcInfo` for the input files written to `folder`.
+
+        Rendered json inputs (sirius.json, pseudopotentials) are reproducible
+        from the inputs, they are not copied into the repository of the
+        calculation (see the option `store_sirius_json`). Compressed inputs are
+        inflated by the job script. Pseudopotentials of the remote store are
+        symlinked (or copied) into the working directory, the report of the job
+        script on the store is retrieved. Calculations add their outputs to
+        `retrieve_list`.
+        """
+        calcinfo = datastructures.CalcInfo()
+        calcinfo.local_copy_list = []
+        calcinfo.retrieve_list = [RECORD_FILE] if self.inputs.metadata.options.remote_pseudo_cache else []
+        calcinfo.provenance_exclude_list = [
+            name for name in folder.get_content_list()
+            if name.endswith('.json') or name.endswith('.json.gz')
+        ]
+        inputs = self._input_folder(folder)
+        calcinfo.prepend_text = '\n'.join(
+            command for command in [inputs.decompress_command()] + inputs.commands if command)
+        remote_list = [(self.node.computer.uuid, remote_path, filename)
+                       for remote_path, filename in inputs.remote_files]
+        if self.inputs.metadata.options.remote_pseudo_copy:
+            calcinfo.remote_copy_list = remote_list
+        else:
+            calcinfo.remote_symlink_list = remote_list
+        return calcinfo
+
+    def parse(self, *args, **kwargs):
+        """Parse the outputs and update the records of the remote pseudopotential store."""
+        exit_code = super(SiriusBaseCalculation, self).parse(*args, **kwargs)
+        self._update_remote_pseudos()
+        return exit_code
+
+    def _update_remote_pseudos(self):
+        """Update the records of the remote pseudopotential store from the report of the job script.
+
+        The job script lists the files it stored and the linked files it did
+        not find (e.g. deleted by hand) in ``RECORD_FILE``. Stored files are
+        recorded, missing ones are dropped and uploaded again by the next
+        calculation. The files are handled before SIRIUS starts, hence this
+        does not depend on the exit code.
+        """
+        if not self.inputs.metadata.options.remote_pseudo_cache:
+            return
+        retrieved = self.node.get_retrieved_node()
+        if retrieved is None or RECORD_FILE not in retrieved.list_object_names():
+            return
+        stored, missing = read_record(retrieved.get_object_content(RECORD_FILE))
+        cache = self._remote_pseudo_cache()
+        upfs = [upf for upf in self.inputs.pseudos.values() if cache.key(upf.md5sum) in stored]
+        if upfs:
+            cache.add(upfs)
+        if missing:
+            self.logger.warning('pseudopotentials missing in the remote store: {}'.format(', '.join(sorted(missing))))
+            cache.forget(missing)
 
 
 class SiriusSCFCalculation(SiriusBaseCalculation):
@@ -201,25 +744,11 @@ class SiriusSCFCalculation(SiriusBaseCalculation):
         # with config from input
         structure = self.inputs.structure
         kpoints = self.inputs.kpoints
-        magnetization = self.inputs.magnetization
-        sirius_json = make_sirius_json(self.inputs.sirius_config.get_dict()['parameters'],
-                                       structure, kpoints, magnetization)
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as sirius_tmpfile:
-            sirius_json = self._read_pseudos(sirius_json)
-            sirius_tmpfile_name = sirius_tmpfile.name
-            # merge with settings given from outside
-            sirius_json = {**sirius_json, **self.inputs.sirius_config.get_dict()}
-            # dump to file
-            json.dump(sirius_json, sirius_tmpfile)
-        sirius_config = SinglefileData(file=sirius_tmpfile_name)
-        sirius_config.store()
+        self._write_sirius_json(folder, self.inputs.sirius_config.get_dict(), structure=structure, kpoints=kpoints)
 
         # Prepare a `CalcInfo` to be returned to the engine
-        calcinfo = datastructures.CalcInfo()
+        calcinfo = self._input_calcinfo(folder)
         calcinfo.codes_info = [codeinfo]
-        calcinfo.local_copy_list = [
-            (sirius_config.uuid, sirius_config.filename, 'sirius.json')
-        ]
-        calcinfo.retrieve_list = [self.metadata.options.output_filename, 'output.json']
+        calcinfo.retrieve_list.extend([self.metadata.options.output_filename, 'output.json'])
 
         return calcinfo
@@ -9,8 +9,11 @@
 ###########################################################################
 """`verdi data dict` command."""
 
+import click
+
 from aiida.cmdline.commands.cmd_data import verdi_data
 from aiida.cmdline.params import arguments, options, types
+from aiida.cmdline.utils import decorators
 
 
 @verdi_data.group('sirius')
@@ -27,3 +30,183 @@ def siriusscf_show(data, fmt):
 
     for node in data:
         echo_dictionary(node.get_dict(), fmt)
+
+
+@siriusscf.command('precompile')
+@click.argument('directory', required=False, type=click.Path(exists=True, file_okay=False))
+@options.GROUP(help='Convert all UpfData nodes in this group.')
+@click.option('-n', '--processes', type=int, default=None, help='Number of worker processes (default: number of cpus).')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default=None,
+              help='Pseudopotential store (default: $AIIDA_SIRIUS_PSEUDO_CACHE or ~/.cache/aiida-sirius/pseudos).')
+@click.option('-f', '--force', is_flag=True, help='Convert again, even if already in the store.')
+@decorators.with_dbenv()
+def siriusscf_precompile(directory, group, processes, cache_dir, force):
+    """Convert a directory or group of UPF files to SIRIUS json ahead of submission.
+
+    The converted files are stored by md5, Sirius calculations using the same
+    pseudopotentials then skip the conversion.
+    """
+    import glob
+    import os
+    from aiida.cmdline.utils import echo
+    from aiida.orm import UpfData
+    from aiida_sirius.upf_to_json import precompile_pseudos
+
+    if (directory is None) == (group is None):
+        echo.echo_critical('specify either a DIRECTORY or a --group')
+
+    if directory is not None:
+        sources = sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                         if os.path.splitext(path)[1].lower() == '.upf')
+    else:
+        sources = []
+        for node in group.nodes:
+            if isinstance(node, UpfData):
+                with node.open(mode='rb') as handle:
+                    sources.append((handle.read(), node.filename))
+
+    failed = 0
+    for fname, md5, status in precompile_pseudos(sources, cache_dir=cache_dir, processes=processes, force=force):
+        if status.startswith('failed'):
+            failed += 1
+            echo.echo_warning('{} ({}): {}'.format(fname, md5, status))
+        else:
+            echo.echo('{} ({}): {}'.format(fname, md5, status))
+    if failed:
+        echo.echo_critical('{} of {} files could not be converted'.format(failed, len(sources)))
+    echo.echo_success('{} files in the pseudopotential store'.format(len(sources)))
+
+
+@siriusscf.group('remote-cache')
+def siriusscf_remote_cache():
+    """Inspect and prune the store of converted pseudopotentials on a computer."""
+
+
+@siriusscf_remote_cache.command('list')
+@arguments.COMPUTER()
+@click.option('--verify', is_flag=True, help='Check the files on the computer and drop missing ones from the records.')
+@decorators.with_dbenv()
+def remote_cache_list(computer, verify):
+    """List the pseudopotentials in the store on COMPUTER."""
+    from aiida.cmdline.utils import echo
+    from aiida.orm import User
+    from aiida_sirius.calculations.remote_pseudos import RemotePseudoCache
+
+    cache = RemotePseudoCache(computer, User.objects.get_default())
+    echo.echo('directory: {}'.format(cache.directory))
+    missing = set()
+    if verify:
+        with computer.get_authinfo(cache.user).get_transport() as transport:
+            missing = set(key for key in cache.entries() if not transport.isfile(cache.path(key)))
+        if missing:
+            cache.forget(missing)
+    for version in cache.versions():
+        stale = '' if version >= cache.version else ' (stale, remove with prune)'
+        entries = sorted(cache.entries(version))
+        echo.echo('converter version {}: {} files{}'.format(version, len(entries), stale))
+        for key in entries:
+            echo.echo('    {}'.format(cache.filename(key)))
+    if missing:
+        echo.echo_warning('{} recorded files were missing: {}'.format(len(missing), ', '.join(sorted(missing))))
+
+
+@siriusscf_remote_cache.command('prune')
+@arguments.COMPUTER()
+@decorators.with_dbenv()
+def remote_cache_prune(computer):
+    """Remove the pseudopotentials of older converter versions from the store on COMPUTER.
+
+    Only the directories v<version> created by the plugin are removed, the
+    files of the current converter version are kept.
+    """
+    from aiida.cmdline.utils import echo
+    from aiida.orm import User
+    from aiida_sirius.calculations.remote_pseudos import RemotePseudoCache
+
+    cache = RemotePseudoCache(computer, User.objects.get_default())
+    with computer.get_authinfo(cache.user).get_transport() as transport:
+        for _, path in cache.stale_version_dirs(transport):
+            transport.rmtree(path)
+            echo.echo('removed {}'.format(path))
+    for version in cache.versions():
+        if version < cache.version:
+            cache.forget(version=version)
+    echo.echo_success('pruned the pseudopotential store on {}'.format(computer.label))
+
+
+@siriusscf_remote_cache.command('set-dir')
+@arguments.COMPUTER()
+@click.argument('directory', type=str)
+@decorators.with_dbenv()
+def remote_cache_set_dir(computer, directory):
+    """Set the (absolute) DIRECTORY of the pseudopotential store on COMPUTER.
+
+    The records of the previous directory are dropped.
+    """
+    import posixpath
+    from aiida.cmdline.utils import echo
+    from aiida_sirius.calculations.remote_pseudos import DIRECTORY_PROPERTY, RemotePseudoCache
+
+    if not posixpath.isabs(directory):
+        echo.echo_critical('the directory must be an absolute path')
+    computer.set_property(DIRECTORY_PROPERTY, directory)
+    RemotePseudoCache(computer).clear()
+    echo.echo_success('pseudopotential store of {}: {}'.format(computer.label, directory))
+
+
+@siriusscf.command('estimate')
+@click.argument('structure', type=types.DataParamType(sub_classes=('aiida.data:structure',)))
+@click.option('-k', '--kpoints', type=types.DataParamType(sub_classes=('aiida.data:array.kpoints',)), default=None,
+              help='KpointsData with a mesh or an explicit list.')
+@click.option('--mesh', type=int, nargs=3, default=None, help='k-point mesh, instead of --kpoints.')
+@click.option('-p', '--parameters', type=types.DataParamType(sub_classes=('aiida.data:sirius.scf',)), default=None,
+              help='SiriusParameters node with the cutoffs and the number of bands.')
+@click.option('--pw-cutoff', type=float, default=None, help='Density cutoff in a.u.^-1 (overrides --parameters).')
+@click.option('--gk-cutoff', type=float, default=None, help='Wave function cutoff in a.u.^-1 (overrides --parameters).')
+@click.option('--num-fv-states', type=int, default=None, help='Number of bands (overrides --parameters).')
+@options.GROUP(help='Group of UpfData nodes, matched to the kinds by element, for the valence charges.')
+@click.option('--zval', multiple=True, metavar='KIND=Z', help='Valence charge of a kind (repeatable).')
+@click.option('-n', '--ranks', type=int, default=1, help='Number of MPI ranks.')
+@decorators.with_dbenv()
+def siriusscf_estimate(structure, kpoints, mesh, parameters, pw_cutoff, gk_cutoff, num_fv_states, group, zval, ranks):
+    """Estimate the number of plane waves, the FFT grid, the bands and the memory per rank for STRUCTURE."""
+    from aiida.cmdline.utils import echo
+    from aiida.orm import KpointsData, UpfData
+    from aiida_sirius.helpers.estimate import estimate_calculation_cost, valence_from_pseudos
+
+    if (kpoints is None) == (mesh is None):
+        echo.echo_critical('specify either --kpoints or --mesh')
+    if mesh is not None:
+        kpoints = KpointsData()
+        kpoints.set_kpoints_mesh(list(mesh))
+
+    config = parameters.get_dict() if parameters is not None else {}
+    section = dict(config.get('parameters', {}))
+    for key, value in (('pw_cutoff', pw_cutoff), ('gk_cutoff', gk_cutoff), ('num_fv_states', num_fv_states)):
+        if value is not None:
+            section[key] = value
+    config['parameters'] = section
+
+    valence = {}
+    if group is not None:
+        by_element = {node.element: node for node in group.nodes if isinstance(node, UpfData)}
+        pseudos = {kind.name: by_element[kind.symbol] for kind in structure.kinds if kind.symbol in by_element}
+        valence.update(valence_from_pseudos(pseudos))
+    for item in zval:
+        kind, _, value = item.partition('=')
+        try:
+            valence[kind] = float(value)
+        except ValueError:
+            echo.echo_critical('invalid --zval {}, expected KIND=Z'.format(item))
+
+    try:
+        estimate = estimate_calculation_cost(structure, kpoints, {}, config, num_ranks=ranks, valence=valence)
+    except ValueError as exception:
+        echo.echo_critical(str(exception))
+
+    memory = estimate.pop('memory_per_rank')
+    for key, value in estimate.items():
+        echo.echo('{:<24} {}'.format(key, value))
+    echo.echo('memory per rank:')
+    for key, value in memory.items():
+        echo.echo('    {:<20} {:10.1f} MB'.format(key, value / 1024.**2))
@@ -10,7 +10,7 @@ Register data types via the "aiida.data" entry point in setup.json.
 from __future__ import absolute_import
 from voluptuous import Schema
 from aiida.orm import Dict
-from .sirius_options import sirius_options
+from .sirius_options import sirius_options, get_sirius_schema
 
 
 class SiriusParameters(Dict):
@@ -48,8 +48,9 @@ class SiriusParameters(Dict):
         # return SiriusParameters.schema(parameters_dict)
         # only validate mixer, control, iterative_solver since parameters, unit_cell are added afterwards
         validate_entries = set(parameters_dict.keys()).intersection(['control', 'mixer', 'iterative_solver'])
+        validate_entries = tuple(sorted(validate_entries))
         params_to_validate = {x: parameters_dict[x] for x in validate_entries}
-        validated = Schema({x: sirius_options[x] for x in validate_entries})(params_to_validate)
+        validated = get_sirius_schema(validate_entries)(params_to_validate)
         return {**validated, **parameters_dict}
 
     def __str__(self):
@@ -1,20 +1,78 @@
-from voluptuous import Optional, All, Length, Any, Required, Coerce, Range
+from functools import lru_cache
+
+import numpy as np
+from voluptuous import Optional, All, Length, Any, Required, Coerce, Range, Schema, Invalid
+
+
+class NumericArray(object):
+    """Validator for (nested) lists of numbers of a given shape, checked with numpy at once.
+
+    Large blocks (atomic positions, k-points) are validated without looking at
+    every number in python. Input that is not a regular array of numbers is
+    handed to the element-wise `fallback` schema, which produces the usual
+    voluptuous error messages.
+
+    :param shape: tuple with the length of every dimension, `None` for any
+        length or a tuple of allowed lengths
+    :param fallback: element-wise validator for irregular input
+    :param coerce: return the values converted to float (like `Coerce(float)`)
+    """
+
+    def __init__(self, shape, fallback, coerce=False):
+        self.shape = shape
+        self.fallback = Schema(fallback)
+        self.coerce = coerce
+
+    def _shape_matches(self, shape):
+        if len(shape) != len(self.shape):
+            return False
+        for length, expected in zip(shape, self.shape):
+            if expected is None:
+                continue
+            if isinstance(expected, tuple):
+                if length not in expected:
+                    return False
+            elif length != expected:
+                return False
+        return True
+
+    def __call__(self, value):
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            # ragged nested lists
+            return self.fallback(value)
+        if array.dtype.kind not in 'biuf' or not self._shape_matches(array.shape):
+            return self.fallback(value)
+        if not np.isfinite(array).all():
+            raise Invalid('expected finite numbers')
+        if self.coerce:
+            return array.astype(float).tolist()
+        return value
+
+    def __repr__(self):
+        return 'NumericArray({!r})'.format(self.shape)
+
 
 # A subset of sirius.scf's command line options
 sirius_options = {
     "control": {
+        # "auto" entries are resolved at submission, see `helpers.planner.resolve_control`
         Optional("processing_unit", default="cpu"): Any("cpu", "gpu"),
-        Optional("fft_mode", default="serial"): Any("serial", "parallel"),
+        Optional("fft_mode", default="serial"): Any("serial", "parallel", "auto"),
         Optional("rmt_max", default=2.2): Coerce(float),
         Optional("verbosity", default=1): Any(0, 1, 2),
         Optional("num_band_to_print", default=10): int,
-        Optional("memory_usage", default="high"): Any("low", "medium", "high"),
+        Optional("memory_usage", default="high"): Any("low", "medium", "high", "auto"),
         Optional("std_evp_solver_name", default="lapack"): Any(
-            "lapack", "elpa", "scalapack", "magma"
+            "lapack", "elpa", "scalapack", "magma", "auto"
         ),
         Optional("gen_evp_solver_name", default="lapack"): Any(
-            "lapack", "elpa", "scalapack", "magma"
+            "lapack", "elpa", "scalapack", "magma", "auto"
         ),
+        # BLACS grid of a k-point group, the number of k-point groups is the number of ranks / grid size
+        Optional("mpi_grid_dims"): Any("auto", All([All(int, Range(min=1))], Length(min=2, max=2))),
+        Optional("cyclic_block_size"): Any("auto", All(int, Range(min=1))),
     },
     "nlcg": {
         Optional("processing_unit", default=""): Any("", "cpu", "gpu"),
@@ -37,14 +95,14 @@ sirius_options = {
         Optional("valence_relativity", default="zora"): Any("zora", "none"),
         Optional("num_fv_states", default=-1): int,
         Optional("smearing_width", default=0.01): Any(float, int),
-        Optional("smearing", default="guassian"): Any("gaussian", "cold", "fermi_dirac", "gaussian_spline"),
+        Optional("smearing", default="gaussian"): Any("gaussian", "cold", "fermi_dirac", "gaussian_spline"),
         Optional("pw_cutoff", default=20): Coerce(float),
         Optional("gk_cutoff", default=6): Coerce(float),
         Optional("nbf"): Coerce(float),
         Optional("gamma_point", default=False): bool,
         Optional("num_mag_dims", default=0): Any(0, 1),
         Optional("ngridk"): All([int], Length(min=3, max=3)),
-        Optional("vk"): All([All([Any(float, int)], Length(min=3, max=3))]),
+        Optional("vk"): NumericArray((None, 3), All([All([Any(float, int)], Length(min=3, max=3))])),
         Optional("shiftk"): All([Any(float, int)], Length(min=3, max=3)),
         Optional("num_dft_iter", default=100): int,
         Optional("energy_tol", default=1e-6): Coerce(float),
@@ -61,8 +119,8 @@ sirius_options = {
         Optional("beta", default=0.7): Coerce(float),
     },
     "unit_cell": {
-        Required("lattice_vectors"): All(
-            [All([Coerce(float)], Length(min=3, max=3))], Length(min=3, max=3)
+        Required("lattice_vectors"): NumericArray(
+            (3, 3), All([All([Coerce(float)], Length(min=3, max=3))], Length(min=3, max=3)), coerce=True
         ),
         Optional("lattice_vectors_scale"): Any(float, int),
         Required("atom_types"): All([str]),
@@ -70,12 +128,15 @@ sirius_options = {
         Optional("atom_coordinate_units"): Any("au", "A"),
         Required("atoms"): Any(
             {
-                str: [
-                    Any(
-                        All([Any(float, int)], Length(min=3, max=3)),
-                        All([Any(float, int)], Length(min=6, max=6)),
-                    )
-                ]
+                str: NumericArray(
+                    (None, (3, 6)),
+                    [
+                        Any(
+                            All([Any(float, int)], Length(min=3, max=3)),
+                            All([Any(float, int)], Length(min=6, max=6)),
+                        )
+                    ],
+                )
             }
         ),
     },
@@ -92,3 +153,14 @@ sirius_options = {
         Optional("converge_by_energy", default=0): Any(0, 1),
     },
 }
+
+
+@lru_cache(maxsize=None)
+def get_sirius_schema(sections=None):
+    """Compiled schema of `sirius_options`, built once per process.
+
+    :param sections: tuple of top level sections to validate, `None` for all
+    """
+    if sections is None:
+        return Schema(sirius_options)
+    return Schema({section: sirius_options[section] for section in sections})
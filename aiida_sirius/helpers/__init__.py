@@ -15,6 +15,7 @@ import tempfile
 from .pseudos import get_pseudos_from_structure_and_path
 from .from_sirius import from_sirius_json, sirius_to_aiida_structure
 from .kpoints  import irreducible_kpoints
+from .estimate import estimate_cost, estimate_calculation_cost
 
 LOCALHOST_NAME = 'localhost-test'
 
@@ -0,0 +1,245 @@
+"""
+Estimate the size and memory footprint of a SIRIUS run before submission.
+
+All quantities follow the pseudopotential plane-wave setup of SIRIUS:
+cutoffs are given in a.u.^-1 (|G| of the plane waves), the density and
+potential are expanded up to `pw_cutoff`, the wave functions up to
+`gk_cutoff`. The memory model is an estimate of the dominant arrays
+(wave functions, the Davidson work space, dense subspace matrices, the
+real-space and reciprocal-space fields and the mixer history), it does not
+account for library workspaces or MPI buffers.
+"""
+from __future__ import absolute_import
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+# CODATA 2018
+bohr_to_ang = 0.529177210903
+
+#: bytes of a complex double
+COMPLEX_BYTES = 16
+#: bytes of a double
+REAL_BYTES = 8
+#: number of G-vectors counted at once
+_CHUNK_SIZE = 2**21
+
+
+def lattice_vectors(structure):
+    """Lattice vectors of `structure` (rows) in bohr."""
+    return np.array(structure.attributes['cell']) / bohr_to_ang
+
+
+def reciprocal_vectors(lattice):
+    """Reciprocal lattice vectors (rows, including the factor 2 pi) of the `lattice` (rows)."""
+    return 2 * np.pi * np.linalg.inv(lattice).T
+
+
+def good_fft_size(size):
+    """Smallest integer >= `size` with prime factors 2, 3, 5 and 7 only."""
+    size = int(size)
+    while True:
+        remainder = size
+        for factor in (2, 3, 5, 7):
+            while remainder % factor == 0:
+                remainder //= factor
+        if remainder == 1:
+            return size
+        size += 1
+
+
+def fft_grid(lattice, cutoff):
+    """Dimensions of the FFT box holding all G-vectors with |G| <= `cutoff` (`pw_cutoff`).
+
+    Along `a_i` the Miller indices reach cutoff |a_i| / (2 pi), the box size
+    2 * limit + 1 is rounded up to a size with small prime factors.
+    """
+    return [good_fft_size(2 * limit + 1) for limit in _miller_limits(lattice, cutoff)]
+
+
+def _miller_limits(lattice, cutoff):
+    """Largest Miller index per direction of a vector G with |G| <= `cutoff`."""
+    return np.ceil(cutoff * np.linalg.norm(lattice, axis=1) / (2 * np.pi)).astype(int)
+
+
+def count_gvectors(reciprocal, cutoff, kpoint=(0, 0, 0)):
+    """Number of vectors G + k with |G + k| <= `cutoff`.
+
+    :param reciprocal: reciprocal lattice vectors (rows) in a.u.^-1
+    :param kpoint: k-point in fractional coordinates
+    """
+    kcart = np.dot(np.asarray(kpoint, dtype=float), reciprocal)
+    lattice = 2 * np.pi * np.linalg.inv(reciprocal).T
+    limits = _miller_limits(lattice, cutoff + np.linalg.norm(kcart))
+    axes = [np.arange(-limit, limit + 1) for limit in limits]
+    # G = m_1 b_1 + m_2 b_2 + m_3 b_3: the contributions along each axis are summed by broadcasting
+    # over planes of the first index, the box is never held in memory as a whole
+    g23 = (axes[1][:, None, None] * reciprocal[1] + axes[2][None, :, None] * reciprocal[2]).reshape(-1, 3) + kcart
+    step = max(1, _CHUNK_SIZE // len(g23))
+    cutoff2 = cutoff**2
+    count = 0
+    for start in range(0, len(axes[0]), step):
+        g1 = axes[0][start:start + step, None] * reciprocal[0]
+        norm2 = np.sum((g1[:, None, :] + g23[None, :, :])**2, axis=-1)
+        count += int(np.count_nonzero(norm2 <= cutoff2))
+    return count
+
+
+def kpoint_list(kpoints):
+    """Fractional coordinates of the k-points of a `KpointsData` (mesh or explicit list)."""
+    if 'mesh' in kpoints.attributes:
+        mesh = np.array(kpoints.attributes['mesh'])
+        offset = np.array(kpoints.attributes.get('offset', [0, 0, 0]), dtype=float)
+        grid = np.indices(mesh).reshape(3, -1).T
+        return (grid + offset) / mesh
+    return np.asarray(kpoints.get_array('kpoints'), dtype=float)
+
+
+def num_valence_electrons(structure, valence):
+    """Number of valence electrons of `structure`, `valence` maps kind names to valence charges."""
+    total = 0.0
+    for site in structure.attributes['sites']:
+        try:
+            total += valence[site['kind_name']]
+        except KeyError:
+            raise ValueError('no valence charge for kind {}'.format(site['kind_name']))
+    return total
+
+
+def default_num_fv_states(num_electrons):
+    """Number of first-variational states chosen by SIRIUS if `num_fv_states` is not set."""
+    return int(1e-8 + num_electrons / 2.0) + max(10, int(0.1 * num_electrons))
+
+
+def valence_from_pseudos(pseudos):
+    """Valence charges {kind: z_valence} read from the headers of `UpfData` nodes."""
+    from ..upf_to_json import probe_upf_data
+    return {kind: float(probe_upf_data(upf)['z_valence']) for kind, upf in pseudos.items()}
+
+
+def memory_per_rank(estimate, num_kpoint_groups, ranks_per_kpoint_group, subspace_size=4, max_history=8):
+    """Memory of the dominant arrays per MPI rank, in bytes.
+
+    :param estimate: problem size as returned by `estimate_cost`
+    :param num_kpoint_groups: number of k-point groups, the k-points are distributed over the groups
+    :param ranks_per_kpoint_group: ranks of a group, sharing the plane waves of its k-points
+    :returns: `OrderedDict` {array: bytes} including the 'total'
+    """
+    kpoints_per_group = int(math.ceil(float(estimate['num_kpoints']) / num_kpoint_groups))
+    # wave functions of all k-points of the group
+    block = (estimate['num_spins'] * estimate['num_bands'] * estimate['num_gkvec_max'] * COMPLEX_BYTES
+             // ranks_per_kpoint_group)
+    wave_functions = kpoints_per_group * block
+    # Davidson work space of one k-point: H|psi>, S|psi>, residuals and the basis with H and S applied
+    davidson = (3 + 3 * subspace_size) * block
+    # subspace Hamiltonian, overlap and eigenvectors (not distributed for lapack)
+    subspace_matrices = 3 * (subspace_size * estimate['num_fv_states'])**2 * COMPLEX_BYTES
+    # density, potential and magnetization on the FFT grid and in plane waves
+    num_components = estimate['num_mag_dims'] + 1
+    fft_size = int(np.prod(estimate['fft_grid']))
+    fields = (6 * num_components * fft_size * REAL_BYTES // ranks_per_kpoint_group
+              + 6 * num_components * estimate['num_gvec'] * COMPLEX_BYTES)
+    mixer = 2 * max_history * num_components * estimate['num_gvec'] * COMPLEX_BYTES
+
+    memory = OrderedDict([
+        ('wave_functions', int(wave_functions)),
+        ('davidson', int(davidson)),
+        ('subspace_matrices', int(subspace_matrices)),
+        ('fields', int(fields)),
+        ('mixer', int(mixer)),
+    ])
+    memory['total'] = sum(memory.values())
+    return memory
+
+
+def estimate_cost(structure, kpoints, valence, pw_cutoff=20.0, gk_cutoff=6.0, num_fv_states=-1, num_mag_dims=0,
+                  gamma_point=False, num_ranks=1, subspace_size=4, max_history=8, kvecs=None):
+    """Estimate the problem size and the memory per MPI rank of a SIRIUS ground state run.
+
+    K-points are distributed over the ranks first (one k-point group per
+    k-point as long as there are enough ranks), the remaining ranks of a
+    group share the plane waves of its k-points.
+
+    :param structure: `StructureData`
+    :param kpoints: `KpointsData` with a mesh or an explicit list
+    :param valence: valence charges {kind: z}, see `valence_from_pseudos`
+    :param pw_cutoff: plane-wave cutoff of the density and potential (a.u.^-1)
+    :param gk_cutoff: cutoff of the G+k vectors of the wave functions (a.u.^-1)
+    :param num_fv_states: number of bands, SIRIUS default if negative
+    :param num_mag_dims: number of magnetic dimensions (0, 1 or 3)
+    :param gamma_point: Gamma-point only run (real wave functions, half of the G-vectors)
+    :param num_ranks: number of MPI ranks
+    :param subspace_size: Davidson subspace size (`iterative_solver.subspace_size`)
+    :param max_history: mixer history length (`mixer.max_history`)
+    :param kvecs: fractional coordinates of the k-points treated (e.g. the irreducible ones of a mesh),
+        defaults to all of `kpoints`
+    :returns: `OrderedDict` of the estimated quantities, sizes in bytes
+    """
+    lattice = lattice_vectors(structure)
+    reciprocal = reciprocal_vectors(lattice)
+
+    if gamma_point:
+        kvecs = np.zeros((1, 3))
+    elif kvecs is None:
+        kvecs = kpoint_list(kpoints)
+    num_gkvec = np.array([count_gvectors(reciprocal, gk_cutoff, k) for k in kvecs])
+    if gamma_point:
+        num_gkvec = (num_gkvec + 1) // 2
+    num_kpoints = len(kvecs)
+
+    num_electrons = num_valence_electrons(structure, valence)
+    if num_fv_states < 0:
+        num_fv_states = default_num_fv_states(num_electrons)
+    num_kgroups = min(num_ranks, num_kpoints)
+
+    estimate = OrderedDict([
+        ('volume', abs(np.linalg.det(lattice))),
+        ('num_atoms', len(structure.attributes['sites'])),
+        ('num_valence_electrons', num_electrons),
+        ('num_gvec', count_gvectors(reciprocal, pw_cutoff)),
+        ('fft_grid', fft_grid(lattice, pw_cutoff)),
+        ('num_kpoints', num_kpoints),
+        ('num_gkvec_min', int(num_gkvec.min())),
+        ('num_gkvec_max', int(num_gkvec.max())),
+        ('num_gkvec_avg', float(num_gkvec.mean())),
+        ('num_fv_states', num_fv_states),
+        ('num_bands', num_fv_states * (2 if num_mag_dims == 3 else 1)),
+        ('num_mag_dims', num_mag_dims),
+        ('num_spins', 2 if num_mag_dims > 0 else 1),
+        ('num_ranks', num_ranks),
+        ('num_kpoint_groups', num_kgroups),
+        ('ranks_per_kpoint_group', max(1, num_ranks // num_kgroups)),
+    ])
+    estimate['memory_per_rank'] = memory_per_rank(estimate, num_kgroups, estimate['ranks_per_kpoint_group'],
+                                                  subspace_size=subspace_size, max_history=max_history)
+    return estimate
+
+
+def estimate_calculation_cost(structure, kpoints, pseudos, parameters, num_ranks=1, valence=None):
+    """`estimate_cost` for the inputs of a Sirius calculation.
+
+    :param pseudos: mapping of kind names to `UpfData`, for the valence charges
+    :param parameters: sirius.json dictionary (sections 'parameters', 'iterative_solver' and 'mixer' are used),
+        with 'use_symmetry' only the irreducible k-points of a mesh are treated
+    :param valence: valence charges {kind: z}, take precedence over `pseudos`
+    """
+    charges = valence_from_pseudos(pseudos)
+    charges.update(valence or {})
+    section = parameters.get('parameters', {})
+    kvecs = None
+    if section.get('use_symmetry', False) and 'mesh' in kpoints.attributes:
+        from .kpoints import irreducible_mesh_points
+        kvecs = irreducible_mesh_points(structure, kpoints)
+    return estimate_cost(
+        structure, kpoints, charges,
+        pw_cutoff=section.get('pw_cutoff', 20.0),
+        gk_cutoff=section.get('gk_cutoff', 6.0),
+        num_fv_states=section.get('num_fv_states', -1),
+        num_mag_dims=section.get('num_mag_dims', 0),
+        gamma_point=section.get('gamma_point', False),
+        num_ranks=num_ranks,
+        subspace_size=parameters.get('iterative_solver', {}).get('subspace_size', 4),
+        max_history=parameters.get('mixer', {}).get('max_history', 8),
+        kvecs=kvecs)
@@ -1,9 +1,13 @@
-import spglib
 import numpy as np
 
-def irreducible_kpoints(structure, kpoints):
+from .symmetry import SYMPREC, get_ir_reciprocal_mesh
+
+def irreducible_kpoints(structure, kpoints, symprec=SYMPREC):
     """use spglib to compute number of irreducible k-points.
 
+    The symmetry analysis is cached, see `helpers.symmetry`. A mesh offset of
+    half a grid spacing is passed to spglib as shift.
+
     Keyword arguments:
     structure -- aiida structure object
     kpoints -- aiida kpoint object
@@ -12,20 +16,57 @@ def irreducible_kpoints(structure, kpoints):
     mapping -- spglib mapping
     grid    -- spglib grid
     """
-    pymatgen_st = structure.get_pymatgen()
+    offset = np.asarray(kpoints.attributes.get('offset', [0, 0, 0]), dtype=float)
+    mapping, grid = get_ir_reciprocal_mesh(structure, kpoints.attributes['mesh'],
+                                           is_shift=np.rint(2 * offset).astype(int) % 2, symprec=symprec)
 
-    # build indicator array
-    # list of atom symbols (string)
-    atom_symbols = np.array([str(site.specie) for site in pymatgen_st.sites])
+    return len(np.unique(mapping)), mapping, grid
 
-    # convert to indicators array
-    indicators = np.zeros(len(atom_symbols))
-    for i, symbol in enumerate(set(atom_symbols)):
-        indicators[atom_symbols == symbol] = i
 
-    rpos = [site.frac_coords for site in pymatgen_st.sites]
-    cell = (pymatgen_st.lattice.matrix, rpos, indicators)
-    mapping, grid = spglib.get_ir_reciprocal_mesh(kpoints.attributes['mesh'],
-                                                  cell, is_shift=kpoints.attributes['offset'])
+def irreducible_mesh_points(structure, kpoints, symprec=SYMPREC):
+    """Fractional coordinates of the irreducible k-points of the mesh `kpoints`, see `irreducible_kpoints`."""
+    _, mapping, grid = irreducible_kpoints(structure, kpoints, symprec=symprec)
+    offset = np.asarray(kpoints.attributes.get('offset', [0, 0, 0]), dtype=float)
+    shift = np.rint(2 * offset) % 2 / 2.
+    return (grid[np.unique(mapping)] + shift) / np.asarray(kpoints.attributes['mesh'])
 
-    return len(np.unique(mapping)), mapping, grid
+
+def mesh_from_kpoint_list(kpoints, tolerance=1e-6):
+    """Recognize an explicit list of k-points as a complete Monkhorst-Pack mesh.
+
+    The points may be given in any order and shifted by reciprocal lattice
+    vectors. Only offsets of 0 or half a grid spacing are recognized (the
+    shifts SIRIUS supports).
+
+    Keyword arguments:
+    kpoints -- array (N, 3) of k-points in fractional coordinates of the reciprocal lattice
+    Returns:
+    (mesh, offset) in the convention of `KpointsData.set_kpoints_mesh`, or None
+    """
+    kpoints = np.asarray(kpoints, dtype=float).reshape(-1, 3)
+    if len(kpoints) == 0:
+        return None
+    # fractional parts in [-tolerance, 1 - tolerance)
+    reduced = kpoints - np.floor(kpoints + tolerance)
+    mesh, offset = [], []
+    for values in reduced.T:
+        values = np.sort(values)
+        distinct = values[np.concatenate([[True], np.diff(values) > tolerance])]
+        size = len(distinct)
+        shift = distinct[0] * size
+        if not np.allclose(np.diff(distinct), 1. / size, atol=tolerance) or \
+                min(abs(shift), abs(shift - 0.5)) > size * tolerance:
+            return None
+        mesh.append(size)
+        offset.append(0.5 if abs(shift - 0.5) <= size * tolerance else 0.)
+    if len(kpoints) != int(np.prod(mesh)):
+        return None
+    indices = reduced * mesh - offset
+    if not np.allclose(indices, np.rint(indices), atol=max(mesh) * tolerance):
+        return None
+    # every point of the mesh exactly once
+    indices = np.rint(indices).astype(int) % mesh
+    flat = (indices[:, 0] * mesh[1] + indices[:, 1]) * mesh[2] + indices[:, 2]
+    if len(np.unique(flat)) != len(kpoints):
+        return None
+    return mesh, offset
@@ -0,0 +1,141 @@
+"""
+Cost-reducing rewrites of the inputs of a Sirius calculation.
+
+`optimize_inputs` runs before the calculation is submitted:
+
+ - reduce the structure to its primitive cell (for unshifted meshes or the Gamma point),
+ - rescale the k-point mesh to the k-point density of the original cell,
+ - turn on `use_symmetry` if the structure has symmetry operations,
+ - turn on `gamma_point` for a Gamma-only k-point set.
+
+Every rewrite is a calcfunction, the provenance links the optimized inputs
+to the original ones. CalcJobs can not call calcfunctions, hence the pass is
+applied to the inputs (or builder) and not inside `prepare_for_submission`.
+"""
+from __future__ import absolute_import
+
+import math
+
+import numpy as np
+
+from aiida.engine import calcfunction
+from aiida.orm import Float
+from aiida.plugins import DataFactory
+
+from .symmetry import SYMPREC, num_symmetry_operations, primitive_cell, structure_from_spglib_cell
+
+SiriusParameters = DataFactory('sirius.scf')
+KpointsData = DataFactory('array.kpoints')
+
+#: relative tolerance when rounding the rescaled mesh up
+MESH_TOLERANCE = 1e-3
+
+
+def _with_parameters(sirius_config, **entries):
+    config = sirius_config.get_dict()
+    config['parameters'] = dict(config.get('parameters', {}), **entries)
+    return SiriusParameters(dict=config)
+
+
+@calcfunction
+def primitive_structure(structure, symprec):
+    """Primitive cell of `structure` (spglib, not idealized)."""
+    primitive, kinds = primitive_cell(structure, symprec=symprec.value)
+    return structure_from_spglib_cell(primitive, kinds, structure)
+
+
+@calcfunction
+def rescale_kpoints_mesh(kpoints, structure, primitive):
+    """Mesh for `primitive` at least as dense as `kpoints` for `structure` in every direction.
+
+    Only unshifted meshes are rescaled: a shift is relative to the reciprocal
+    basis of `structure` and has in general no equivalent for the reciprocal
+    basis of `primitive`.
+    """
+    mesh, offset = kpoints.get_kpoints_mesh()
+    if np.any(offset):
+        raise ValueError('only unshifted meshes can be rescaled, the offset is {}'.format(list(offset)))
+    reciprocal = np.linalg.norm(np.linalg.inv(np.array(structure.cell)), axis=0)
+    spacing = min(reciprocal / np.array(mesh))
+    primitive_reciprocal = np.linalg.norm(np.linalg.inv(np.array(primitive.cell)), axis=0)
+    rescaled = KpointsData()
+    rescaled.set_cell_from_structure(primitive)
+    rescaled.set_kpoints_mesh(
+        [max(1, int(math.ceil(length / spacing - MESH_TOLERANCE))) for length in primitive_reciprocal])
+    return rescaled
+
+
+@calcfunction
+def enable_symmetry(sirius_config):
+    """Set `parameters.use_symmetry`."""
+    return _with_parameters(sirius_config, use_symmetry=True)
+
+
+@calcfunction
+def enable_gamma_point(sirius_config):
+    """Set `parameters.gamma_point` (real wave functions)."""
+    return _with_parameters(sirius_config, gamma_point=True)
+
+
+def is_gamma_only(kpoints):
+    """Whether `kpoints` is the Gamma point only."""
+    if 'mesh' in kpoints.attributes:
+        mesh, offset = kpoints.get_kpoints_mesh()
+        return list(mesh) == [1, 1, 1] and not np.any(offset)
+    points = kpoints.get_kpoints()
+    return len(points) == 1 and not np.any(points)
+
+
+def is_unshifted_mesh(kpoints):
+    """Whether `kpoints` is a mesh without offset."""
+    if 'mesh' not in kpoints.attributes:
+        return False
+    _, offset = kpoints.get_kpoints_mesh()
+    return not np.any(offset)
+
+
+def _has_site_magnetization(magnetization):
+    """Whether `magnetization` (`Dict`) gives moments per site instead of per kind."""
+    return any(np.ndim(value) > 1 for value in magnetization.get_dict().values())
+
+
+def optimize_inputs(structure, kpoints, sirius_config, magnetization=None, symprec=SYMPREC):
+    """Apply the cost-reducing rewrites to the inputs of a Sirius calculation.
+
+    The primitive cell is not used with per-site magnetic moments (they refer
+    to the sites of `structure`) and only for k-points which have an
+    equivalent for the primitive cell: unshifted meshes (rescaled) and the
+    Gamma point. Shifted meshes and explicit lists refer to the reciprocal
+    basis of `structure`, the structure is kept for them.
+
+    :param structure: `StructureData`
+    :param kpoints: `KpointsData`
+    :param sirius_config: `SiriusParameters`
+    :param magnetization: `Dict` of the calculation
+    :param symprec: spglib tolerance (angstrom)
+    :returns: tuple (inputs, rewrites), `inputs` is a dictionary with the
+        (possibly new) 'structure', 'kpoints' and 'sirius_config', `rewrites`
+        the names of the applied rewrites
+    """
+    rewrites = []
+    per_site = magnetization is not None and _has_site_magnetization(magnetization)
+    unshifted_mesh = is_unshifted_mesh(kpoints)
+    if not per_site and (unshifted_mesh or is_gamma_only(kpoints)):
+        primitive = primitive_cell(structure, symprec=symprec)
+        if primitive is not None and len(primitive[0][2]) < len(structure.sites):
+            reduced = primitive_structure(structure, Float(symprec))
+            rewrites.append('primitive_structure')
+            if unshifted_mesh:
+                kpoints = rescale_kpoints_mesh(kpoints, structure, reduced)
+                rewrites.append('rescale_kpoints_mesh')
+            structure = reduced
+
+    parameters = sirius_config.get_dict().get('parameters', {})
+    if not parameters.get('use_symmetry', False) and num_symmetry_operations(structure, symprec=symprec) > 1:
+        sirius_config = enable_symmetry(sirius_config)
+        rewrites.append('enable_symmetry')
+    if not parameters.get('gamma_point', False) and is_gamma_only(kpoints):
+        sirius_config = enable_gamma_point(sirius_config)
+        rewrites.append('enable_gamma_point')
+
+    return {'structure': structure, 'kpoints': kpoints, 'sirius_config': sirius_config}, rewrites
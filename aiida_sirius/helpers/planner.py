@@ -0,0 +1,227 @@
+"""
+Choose the MPI resources of a SIRIUS run from its estimated size.
+
+SIRIUS distributes the k-points over k-point groups and the plane waves
+(and bands) of a k-point over the ranks of its group. Parallelization over
+k-points is almost perfect as long as every group holds the same number of
+k-points, the parallelization within a group pays off only for enough
+plane waves per rank. The planner hence
+
+ 1. uses a number of k-point groups dividing the number of k-points,
+ 2. limits the ranks per group by the plane waves (and bands) per rank,
+ 3. packs the ranks onto whole machines of the given shape,
+ 4. rejects layouts exceeding the memory of a machine,
+
+and picks the layout with the most ranks, then the fewest machines.
+
+For a given number of ranks `plan_layout` chooses the SIRIUS parallelization
+(`control.mpi_grid_dims` and `control.cyclic_block_size`): the ranks of a
+k-point group form the 2D BLACS grid `mpi_grid_dims`, the number of k-point
+groups is the number of ranks divided by the grid size.
+
+`resolve_control` resolves all 'auto' entries of the 'control' section, the
+layout with `plan_layout` and the eigensolvers, FFT mode and memory mode with
+the rule table `CONTROL_RULES`.
+"""
+from __future__ import absolute_import
+
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from .estimate import memory_per_rank
+
+#: fewest G+k vectors per rank worth splitting a k-point over more ranks
+MIN_GKVEC_PER_RANK = 1000
+#: speedup of a k-point group with n ranks is n ** GROUP_SCALING_EXPONENT
+GROUP_SCALING_EXPONENT = 0.85
+#: relative slowdown per unit of aspect ratio (rows / columns - 1) of the BLACS grid
+GRID_ASPECT_PENALTY = 0.15
+#: candidate BLACS block sizes, largest first
+BLOCK_SIZES = (64, 32, 16, 8)
+
+GiB = 1024**3
+
+#: Rules for the 'auto' entries of 'control': {key: [(condition, value), ...]}, the value of the
+#: first condition true for the problem (see `resolve_control` for its entries) is used.
+#: Distributed eigensolvers only pay off for large subspace matrices, magma for a single GPU rank.
+CONTROL_RULES = OrderedDict([
+    ('std_evp_solver_name', [
+        (lambda p: p['ranks_per_kpoint_group'] == 1 and p['processing_unit'] == 'gpu' and p['matrix_size'] >= 1000,
+         'magma'),
+        (lambda p: p['ranks_per_kpoint_group'] == 1 or p['matrix_size'] < 1000, 'lapack'),
+        (lambda p: True, 'scalapack'),
+    ]),
+    ('gen_evp_solver_name', [
+        (lambda p: p['ranks_per_kpoint_group'] == 1 and p['processing_unit'] == 'gpu' and p['matrix_size'] >= 1000,
+         'magma'),
+        (lambda p: p['ranks_per_kpoint_group'] == 1 or p['matrix_size'] < 1000, 'lapack'),
+        (lambda p: True, 'scalapack'),
+    ]),
+    # distribute the FFT over the ranks of a k-point group only for large grids
+    ('fft_mode', [
+        (lambda p: p['ranks_per_kpoint_group'] > 1 and p['fft_size'] >= 96**3, 'parallel'),
+        (lambda p: True, 'serial'),
+    ]),
+    ('memory_usage', [
+        (lambda p: p['memory_per_rank'] > 8 * GiB, 'low'),
+        (lambda p: p['memory_per_rank'] > 2 * GiB, 'medium'),
+        (lambda p: True, 'high'),
+    ]),
+])
+
+
+def divisors(number):
+    """Divisors of `number` in ascending order."""
+    small = [i for i in range(1, int(math.sqrt(number)) + 1) if number % i == 0]
+    return sorted(set(small + [number // i for i in small]))
+
+
+def plan_resources(estimate, mpiprocs_per_machine, max_machines=1, memory_per_machine=None,
+                   min_gkvec_per_rank=MIN_GKVEC_PER_RANK, subspace_size=4, max_history=8):
+    """Return the resources for a run of size `estimate`.
+
+    :param estimate: problem size as returned by `estimate_cost`
+    :param mpiprocs_per_machine: number of cores (MPI ranks) of a machine
+    :param max_machines: largest number of machines to use
+    :param memory_per_machine: memory of a machine in bytes, `None` to skip the check
+    :param min_gkvec_per_rank: fewest G+k vectors per rank of a k-point group
+    :returns: `OrderedDict` with 'resources' (for `metadata.options.resources`), the
+        k-point distribution and the estimated memory per rank
+    :raises ValueError: if no layout fits into the memory of `max_machines` machines
+    """
+    num_kpoints = estimate['num_kpoints']
+    max_ranks_per_group = max(1, min(estimate['num_bands'], estimate['num_gkvec_max'] // min_gkvec_per_rank))
+    best = None
+    for num_groups in divisors(num_kpoints):
+        for ranks_per_group in range(1, max_ranks_per_group + 1):
+            num_ranks = num_groups * ranks_per_group
+            num_machines = int(math.ceil(float(num_ranks) / mpiprocs_per_machine))
+            if num_machines > max_machines or num_ranks % num_machines != 0:
+                continue
+            memory = memory_per_rank(estimate, num_groups, ranks_per_group,
+                                     subspace_size=subspace_size, max_history=max_history)
+            ranks_per_machine = num_ranks // num_machines
+            if memory_per_machine is not None and memory['total'] * ranks_per_machine > memory_per_machine:
+                continue
+            # most ranks, then fewest machines, then most k-point groups
+            key = (num_ranks, -num_machines, num_groups)
+            if best is None or key > best[0]:
+                best = (key, num_machines, ranks_per_machine, num_groups, ranks_per_group, memory)
+    if best is None:
+        raise ValueError('the estimated memory exceeds {} machine(s) with {} bytes'.format(
+            max_machines, memory_per_machine))
+
+    _, num_machines, ranks_per_machine, num_groups, ranks_per_group, memory = best
+    return OrderedDict([
+        ('resources', {'num_machines': num_machines, 'num_mpiprocs_per_machine': ranks_per_machine}),
+        ('num_kpoints', num_kpoints),
+        ('num_kpoint_groups', num_groups),
+        ('ranks_per_kpoint_group', ranks_per_group),
+        ('memory_per_rank', memory['total']),
+    ])
+
+
+def squarest_grid(num_ranks):
+    """2D grid [rows, columns] of `num_ranks` ranks closest to a square, rows >= columns."""
+    columns = max(i for i in divisors(num_ranks) if i * i <= num_ranks)
+    return [num_ranks // columns, columns]
+
+
+def block_size(num_bands, grid):
+    """Largest block size of `BLOCK_SIZES` giving every rank of `grid` at least two blocks of bands."""
+    for size in BLOCK_SIZES:
+        if num_bands >= 2 * size * max(grid):
+            return size
+    return BLOCK_SIZES[-1]
+
+
+def plan_layout(num_ranks, num_bands, num_kpoints):
+    """Return the SIRIUS parallelization layout for `num_ranks` ranks.
+
+    The run time is modelled as the number of k-points of the busiest group
+    divided by the speedup of a group: n ranks (at most one per band) scale as
+    n ** `GROUP_SCALING_EXPONENT` and each unit of aspect ratio of the BLACS
+    grid costs `GRID_ASPECT_PENALTY`. Among equally fast layouts the one with most k-point
+    groups is chosen (k-point parallelization needs no communication).
+
+    :param num_ranks: total number of MPI ranks
+    :param num_bands: number of bands
+    :param num_kpoints: number of (irreducible) k-points
+    :returns: `OrderedDict` with 'mpi_grid_dims' and 'cyclic_block_size' (keys of 'control'),
+        'num_kpoint_groups' and 'ranks_per_kpoint_group'
+    """
+    best = None
+    for num_groups in divisors(num_ranks):
+        if num_groups > num_kpoints:
+            break
+        ranks_per_group = num_ranks // num_groups
+        grid = squarest_grid(ranks_per_group)
+        efficiency = 1. / (1 + GRID_ASPECT_PENALTY * (float(grid[0]) / grid[1] - 1))
+        speedup = min(ranks_per_group, num_bands)**GROUP_SCALING_EXPONENT * efficiency
+        cost = int(math.ceil(float(num_kpoints) / num_groups)) / speedup
+        key = (round(cost, 12), -num_groups)
+        if best is None or key < best[0]:
+            best = (key, num_groups, ranks_per_group, grid)
+
+    _, num_groups, ranks_per_group, grid = best
+    return OrderedDict([
+        ('mpi_grid_dims', grid),
+        ('cyclic_block_size', block_size(num_bands, grid)),
+        ('num_kpoint_groups', num_groups),
+        ('ranks_per_kpoint_group', ranks_per_group),
+    ])
+
+
+def resolve_control(sirius_config, estimate, num_ranks):
+    """Resolve the 'auto' entries of the 'control' section of `sirius_config`.
+
+    `mpi_grid_dims` and `cyclic_block_size` are taken from `plan_layout`, the
+    other entries from `CONTROL_RULES`. The conditions of the rules get a
+    dictionary with the entries of `estimate` and
+
+     - 'ranks_per_kpoint_group', 'num_kpoint_groups': of the (planned) layout
+     - 'matrix_size': dimension of the Davidson subspace matrices
+     - 'fft_size': number of points of the FFT grid
+     - 'memory_per_rank': estimated memory per rank in bytes
+     - 'processing_unit': 'cpu' or 'gpu'
+
+    :param sirius_config: sirius.json dictionary
+    :param estimate: problem size as returned by `estimate_cost`
+    :param num_ranks: number of MPI ranks of the job
+    :returns: dictionary of the resolved entries
+    """
+    control = sirius_config.get('control', {})
+    auto = [key for key, value in control.items() if value == 'auto']
+    if not auto:
+        return {}
+    layout = plan_layout(num_ranks, estimate['num_bands'], estimate['num_kpoints'])
+    if control.get('mpi_grid_dims', 'auto') != 'auto':
+        # explicit grid
+        ranks_per_group = control['mpi_grid_dims'][0] * control['mpi_grid_dims'][1]
+        layout['ranks_per_kpoint_group'] = ranks_per_group
+        layout['num_kpoint_groups'] = max(1, num_ranks // ranks_per_group)
+        layout['cyclic_block_size'] = block_size(estimate['num_bands'], control['mpi_grid_dims'])
+
+    subspace_size = sirius_config.get('iterative_solver', {}).get('subspace_size', 4)
+    max_history = sirius_config.get('mixer', {}).get('max_history', 8)
+    problem = dict(estimate)
+    problem.update(
+        ranks_per_kpoint_group=layout['ranks_per_kpoint_group'],
+        num_kpoint_groups=layout['num_kpoint_groups'],
+        matrix_size=subspace_size * estimate['num_fv_states'],
+        fft_size=int(np.prod(estimate['fft_grid'])),
+        memory_per_rank=memory_per_rank(estimate, layout['num_kpoint_groups'], layout['ranks_per_kpoint_group'],
+                                        subspace_size=subspace_size, max_history=max_history)['total'],
+        processing_unit=control.get('processing_unit', 'cpu'))
+
+    resolved = {}
+    for key in auto:
+        if key in layout:
+            resolved[key] = layout[key]
+        elif key in CONTROL_RULES:
+            resolved[key] = next(value for condition, value in CONTROL_RULES[key] if condition(problem))
+        else:
+            raise ValueError("no rule to resolve control.{} = 'auto'".format(key))
+    return resolved
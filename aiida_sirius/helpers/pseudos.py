@@ -3,6 +3,8 @@ import os
 
 from aiida.orm.nodes.data import UpfData
 
+from ..upf_to_json import probe_upf
+
 
 def get_pseudos_from_structure_and_path(structure, path='./'):
     """
@@ -21,23 +23,30 @@ def get_pseudos_from_structure_and_path(structure, path='./'):
     pseudo_files = ( set(glob.glob(os.path.join(path, '*UPF')))
                    | set(glob.glob(os.path.join(path, '*upf')))
                    | set(glob.glob(os.path.join(path, '*Upf'))))
+    # only read the headers, UpfData nodes are created for the files actually needed
     pseudos = {}
     for pp_file in pseudo_files:
-        upf = UpfData(file=os.path.abspath(pp_file))
-        if upf.element in pseudos:
+        with open(pp_file, 'rb') as handle:
+            element = probe_upf(handle)['element']
+        if element in pseudos:
             raise MultipleObjectsError(
                 "More than one UPF for element {} found in "
-                "{}".format(upf.element, path))
+                "{}".format(element, path))
 
-        pseudos[upf.element] = upf
+        pseudos[element] = os.path.abspath(pp_file)
 
+    # one node per file, kinds of the same element share it
+    nodes = {}
     pseudo_list = {}
     for kind in structure.kinds:
         symbol = kind.symbol
         try:
-            pseudo_list[kind.name] = pseudos[kind.name]
+            pp_file = pseudos[symbol]
         except KeyError:
             raise NotExistent("No UPF for element {} found in path {}".format(
                 symbol, path))
+        if pp_file not in nodes:
+            nodes[pp_file] = UpfData(file=pp_file)
+        pseudo_list[kind.name] = nodes[pp_file]
 
     return pseudo_list
@@ -0,0 +1,170 @@
+"""
+Symmetry analysis of `StructureData` with spglib.
+
+The spglib cell is built directly from the attributes of the structure, the
+atom types are the kinds of the structure (kinds of the same element with
+different magnetization or pseudopotential are distinguished).
+
+The symmetry operations and irreducible k-point meshes are kept in a
+process-wide LRU cache keyed by the md5 checksum of the spglib cell, repeated
+analyses of the same structure (e.g. when planning and submitting) are free.
+Cached arrays are read-only.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import spglib
+
+#: default tolerance of spglib (in angstrom)
+SYMPREC = 1e-5
+
+
+class _LRUCache(object):
+    """Thread-safe dictionary keeping the `max_entries` most recently used entries."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_SYMMETRY_CACHE = _LRUCache()
+_MESH_CACHE = _LRUCache()
+
+
+def clear_cache():
+    """Drop all cached symmetry analyses."""
+    _SYMMETRY_CACHE.clear()
+    _MESH_CACHE.clear()
+
+
+def _readonly(array):
+    array = np.asarray(array)
+    array.setflags(write=False)
+    return array
+
+
+def get_spglib_cell(structure):
+    """Return the spglib cell (lattice, fractional positions, numbers) of `structure` and the kind names.
+
+    The kind name of number `i` is `kinds[i]`, kinds are numbered in order of
+    their first site.
+
+    :param structure: `StructureData`
+    :returns: tuple (cell, kinds)
+    """
+    lattice = np.array(structure.attributes['cell'], dtype=float)
+    sites = structure.attributes['sites']
+    kind_names = [site['kind_name'] for site in sites]
+    kinds = list(dict.fromkeys(kind_names))
+    index = {kind: i for i, kind in enumerate(kinds)}
+    numbers = np.array([index[kind] for kind in kind_names], dtype='intc')
+    positions = np.array([site['position'] for site in sites], dtype=float).reshape(-1, 3)
+    fractional = np.linalg.solve(lattice.T, positions.T).T
+    return (lattice, fractional, numbers), kinds
+
+
+def structure_from_spglib_cell(cell, kinds, template):
+    """Return a `StructureData` of the spglib `cell`, with the kinds (and pbc) of `template`.
+
+    :param kinds: kind names of the numbers of `cell`, see `get_spglib_cell`
+    """
+    from aiida.orm import StructureData
+    from aiida.orm.nodes.data.structure import Site
+
+    lattice, fractional, numbers = cell
+    structure = StructureData(cell=np.asarray(lattice).tolist(), pbc=template.pbc)
+    for kind in kinds:
+        structure.append_kind(template.get_kind(kind))
+    for position, number in zip(np.dot(fractional, lattice), numbers):
+        structure.append_site(Site(kind_name=kinds[number], position=position.tolist()))
+    return structure
+
+
+def cell_hash(cell):
+    """md5 checksum of a spglib cell, the cache key of the symmetry analysis."""
+    md5 = hashlib.md5()
+    for array, dtype in zip(cell, ('float64', 'float64', 'intc')):
+        md5.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+    return md5.hexdigest()
+
+
+def get_symmetry(structure, symprec=SYMPREC):
+    """Space group operations of `structure` (cached).
+
+    :returns: dictionary with 'rotations' (fractional, direct lattice), 'translations',
+        'number' and 'international' (space group), only the identity if spglib fails
+    """
+    cell, _ = get_spglib_cell(structure)
+
+    def compute():
+        dataset = spglib.get_symmetry_dataset(cell, symprec=symprec)
+        if dataset is None:
+            return {'rotations': _readonly(np.eye(3, dtype='intc')[None]), 'translations': _readonly(np.zeros((1, 3))),
+                    'number': 1, 'international': 'P1'}
+        # spglib >= 2.5 returns a dataclass, older versions a dictionary
+        field = dataset.get if isinstance(dataset, dict) else lambda name: getattr(dataset, name)
+        return {
+            'rotations': _readonly(field('rotations')),
+            'translations': _readonly(field('translations')),
+            'number': int(field('number')),
+            'international': field('international'),
+        }
+
+    return _SYMMETRY_CACHE.get_or_compute((cell_hash(cell), symprec), compute)
+
+
+def num_symmetry_operations(structure, symprec=SYMPREC):
+    """Number of space group operations of `structure` (1 if there is only the identity)."""
+    return len(get_symmetry(structure, symprec=symprec)['rotations'])
+
+
+def get_ir_reciprocal_mesh(structure, mesh, is_shift=(0, 0, 0), symprec=SYMPREC):
+    """Irreducible k-points of a mesh (cached), see `spglib.get_ir_reciprocal_mesh`.
+
+    :param is_shift: half grid shift (0 or 1) per direction
+    :returns: tuple (mapping, grid), `mapping[i]` is the index of the irreducible point of grid point `i`
+    """
+    cell, _ = get_spglib_cell(structure)
+    mesh = tuple(int(n) for n in mesh)
+    is_shift = tuple(int(shift) for shift in is_shift)
+
+    def compute():
+        mapping, grid = spglib.get_ir_reciprocal_mesh(mesh, cell, is_shift=is_shift, symprec=symprec)
+        return _readonly(mapping), _readonly(grid)
+
+    return _MESH_CACHE.get_or_compute((cell_hash(cell), mesh, is_shift, symprec), compute)
+
+
+def primitive_cell(structure, symprec=SYMPREC):
+    """Return the spglib primitive cell of `structure` and the kind names, see `get_spglib_cell`.
+
+    The lattice is not idealized (no rotation or symmetrization of the
+    positions). Returns `None` if spglib fails.
+    """
+    cell, kinds = get_spglib_cell(structure)
+    primitive = spglib.standardize_cell(cell, to_primitive=True, no_idealize=True, symprec=symprec)
+    if primitive is None:
+        return None
+    return primitive, kinds
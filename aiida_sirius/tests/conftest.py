@@ -0,0 +1,121 @@
+"""
+Fixtures shared by the tests of the plugin.
+
+The fake nodes provide just what the code under test reads and need no
+database. Fixtures creating stored nodes require the test profile.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import io
+
+import numpy as np
+import pytest
+
+
+class FakeUpf(object):
+    """Stand-in for `UpfData` with the file content in memory."""
+
+    def __init__(self, content, filename):
+        self.content = content.encode('utf8')
+        self.filename = filename
+        self.md5sum = hashlib.md5(self.content).hexdigest()
+
+    def open(self, mode='r'):
+        if 'b' in mode:
+            return io.BytesIO(self.content)
+        return io.StringIO(self.content.decode('utf8'))
+
+
+@pytest.fixture
+def make_upf():
+    """Factory of fake pseudopotentials: `make_upf(UPF file content, filename)`."""
+    return FakeUpf
+
+
+class FakeNode(object):
+    """Stand-in for `StructureData` and `KpointsData` with `attributes` and arrays only."""
+
+    def __init__(self, attributes=None, arrays=None):
+        self.attributes = attributes or {}
+        self._arrays = arrays or {}
+
+    def get_arraynames(self):
+        return list(self._arrays)
+
+    def get_array(self, name):
+        return np.array(self._arrays[name])
+
+    def get_kpoints(self):
+        return self.get_array('kpoints')
+
+
+@pytest.fixture
+def make_structure():
+    """Factory of fake structures: `make_structure(cell, [(kind name, cartesian position), ...])`."""
+
+    def factory(cell, sites):
+        return FakeNode({
+            'cell': np.asarray(cell, dtype=float).tolist(),
+            'sites': [{'kind_name': kind, 'position': list(position)} for kind, position in sites],
+        })
+
+    return factory
+
+
+@pytest.fixture
+def make_kpoints():
+    """Factory of fake k-points: `make_kpoints(mesh=[...], offset=[...])` or `make_kpoints(kpoints=[[...], ...])`."""
+
+    def factory(mesh=None, offset=(0, 0, 0), kpoints=None):
+        if kpoints is not None:
+            return FakeNode(arrays={'kpoints': np.asarray(kpoints, dtype=float)})
+        return FakeNode({'mesh': list(mesh), 'offset': list(offset)})
+
+    return factory
+
+
+@pytest.fixture
+def silicon(make_structure):
+    """Silicon in the primitive fcc cell."""
+    alat = 5.43
+    cell = [[0, alat / 2, alat / 2], [alat / 2, 0, alat / 2], [alat / 2, alat / 2, 0]]
+    return make_structure(cell, [('Si', [0, 0, 0]), ('Si', [alat / 4] * 3)])
+
+
+@pytest.fixture
+def pseudo_cache(tmpdir, monkeypatch):
+    """Process wide pseudopotential cache in a temporary directory."""
+    from aiida_sirius.upf_to_json import cache
+
+    pseudo_cache = cache.PseudoCache(cache_dir=str(tmpdir.mkdir('pseudo_cache')))
+    monkeypatch.setattr(cache, '_PSEUDO_CACHE', pseudo_cache)
+    return pseudo_cache
+
+
+@pytest.fixture
+def localhost(tmpdir):
+    """Stored localhost computer with the `local` transport and the `direct` scheduler."""
+    from aiida.orm import Computer
+
+    computer = Computer(
+        name='localhost-sirius',
+        description='localhost computer set up by the aiida-sirius tests',
+        hostname='localhost',
+        workdir=str(tmpdir.mkdir('workdir')),
+        transport_type='local',
+        scheduler_type='direct')
+    computer.set_default_mpiprocs_per_machine(4)
+    computer.store()
+    computer.configure()
+    return computer
+
+
+@pytest.fixture
+def sirius_code(localhost):
+    """Stored `sirius.scf` code on `localhost`, the executable is never run."""
+    from aiida.orm import Code
+
+    code = Code(input_plugin_name='sirius.scf', remote_computer_exec=[localhost, '/usr/bin/sirius.scf'])
+    code.label = 'sirius.scf'
+    return code.store()
@@ -0,0 +1,208 @@
+"""
+Synthetic UPF files for tests and benchmarks.
+
+The generated files are structurally valid UPF v1/v2 files (random numbers),
+large meshes and many projectors can be used to measure the scaling of the
+converters in `aiida_sirius.upf_to_json`.
+"""
+from __future__ import absolute_import
+
+import random
+
+#: supported pseudopotential variants
+PSEUDO_TYPES = ('NC', 'US', 'PAW', 'SO')
+
+
+def _block(rng, num, indent='  '):
+    """Return `num` random numbers in the fixed-width layout used by QE."""
+    values = ['{:20.13E}'.format(rng.uniform(-1, 1)) for _ in range(num)]
+    lines = [indent + ' '.join(values[i:i + 4]) for i in range(0, num, 4)]
+    return '\n'.join(lines)
+
+
+def _angular_momenta(num_proj):
+    return [(i // 2) % 3 for i in range(num_proj)]
+
+
+def synthetic_upf2(mesh_size=1000, num_proj=4, num_wfc=2, pseudo_type='US', seed=0):
+    """Generate a UPF v2 file.
+
+    :param mesh_size: number of radial points
+    :param num_proj: number of beta projectors
+    :param num_wfc: number of atomic wave functions
+    :param pseudo_type: one of `PSEUDO_TYPES`, 'SO' is a fully relativistic ultrasoft file
+    :param seed: seed for the random numbers
+    :returns: string
+    """
+    assert pseudo_type in PSEUDO_TYPES
+    rng = random.Random(seed)
+    ultrasoft = pseudo_type in ('US', 'PAW', 'SO')
+    spin_orbit = pseudo_type == 'SO'
+    paw = pseudo_type == 'PAW'
+    lll = _angular_momenta(num_proj)
+
+    def tf(flag):
+        return 'T' if flag else 'F'
+
+    out = []
+    out.append('<UPF version="2.0.1">')
+    out.append('  <PP_INFO>\n    Generated by synthetic_upf\n    &input\n      zed=26.0\n    /\n  </PP_INFO>')
+    out.append('  <PP_HEADER generated="synthetic" element="Fe" pseudo_type="{pt}" relativistic="{rel}" '
+               'is_ultrasoft="{us}" is_paw="{paw}" core_correction="T" functional="PBE" z_valence="16.0" '
+               'l_max="2" mesh_size="{mesh}" number_of_wfc="{nwfc}" number_of_proj="{nproj}" '
+               'has_so="{so}"/>'.format(pt='PAW' if paw else ('US' if ultrasoft else 'NC'),
+                                         rel='full' if spin_orbit else 'scalar',
+                                         us=tf(ultrasoft), paw=tf(paw), mesh=mesh_size,
+                                         nwfc=num_wfc, nproj=num_proj, so=tf(spin_orbit)))
+    out.append('  <PP_MESH dx="0.0125" mesh="{0}" xmin="-7.0" rmax="100.0" zmesh="26.0">'.format(mesh_size))
+    out.append('    <PP_R type="real" size="{0}" columns="4">\n{1}\n    </PP_R>'.format(mesh_size, _block(rng, mesh_size)))
+    out.append('    <PP_RAB type="real" size="{0}" columns="4">\n{1}\n    </PP_RAB>'.format(mesh_size, _block(rng, mesh_size)))
+    out.append('  </PP_MESH>')
+    out.append('  <PP_NLCC type="real" size="{0}" columns="4">\n{1}\n  </PP_NLCC>'.format(mesh_size, _block(rng, mesh_size)))
+    out.append('  <PP_LOCAL type="real" size="{0}" columns="4">\n{1}\n  </PP_LOCAL>'.format(mesh_size, _block(rng, mesh_size)))
+    out.append('  <PP_NONLOCAL>')
+    cutoff_index = max(1, (mesh_size * 3) // 4)
+    for i in range(num_proj):
+        out.append('    <PP_BETA.{i} type="real" size="{mesh}" columns="4" index="{i}" label="{i}S" '
+                   'angular_momentum="{l}" cutoff_radius_index="{ci}" cutoff_radius="2.0" '
+                   'ultrasoft_cutoff_radius="2.2">\n{data}\n    </PP_BETA.{i}>'.format(
+                       i=i + 1, mesh=mesh_size, l=lll[i], ci=cutoff_index, data=_block(rng, mesh_size)))
+    out.append('    <PP_DIJ type="real" size="{0}" columns="4">\n{1}\n    </PP_DIJ>'.format(
+        num_proj**2, _block(rng, num_proj**2)))
+    if ultrasoft:
+        out.append('    <PP_AUGMENTATION q_with_l="T" nqf="0" nqlc="5" shape="PSQ" cutoff_r="0.0" '
+                   'cutoff_r_index="{0}" augmentation_epsilon="1e-12" l_max_aug="4">'.format(cutoff_index))
+        out.append('      <PP_Q type="real" size="{0}" columns="4">\n{1}\n      </PP_Q>'.format(
+            num_proj**2, _block(rng, num_proj**2)))
+        if paw:
+            nmult = num_proj**2 * 5
+            out.append('      <PP_MULTIPOLES type="real" size="{0}" columns="4">\n{1}\n      </PP_MULTIPOLES>'.format(
+                nmult, _block(rng, nmult)))
+        for i in range(num_proj):
+            for j in range(i, num_proj):
+                li, lj = lll[i], lll[j]
+                for l in range(abs(li - lj), li + lj + 1):
+                    if (li + lj + l) % 2 == 0:
+                        out.append('      <PP_QIJL.{i}.{j}.{l} type="real" size="{mesh}" columns="4" '
+                                   'first_index="{i}" second_index="{j}" composite_index="1" '
+                                   'angular_momentum="{l}">\n{data}\n      </PP_QIJL.{i}.{j}.{l}>'.format(
+                                       i=i + 1, j=j + 1, l=l, mesh=mesh_size, data=_block(rng, mesh_size)))
+        out.append('    </PP_AUGMENTATION>')
+    out.append('  </PP_NONLOCAL>')
+    out.append('  <PP_PSWFC>')
+    for i in range(num_wfc):
+        out.append('    <PP_CHI.{i} type="real" size="{mesh}" columns="4" index="{i}" label="{i}S" l="{l}" '
+                   'occupation="1.0" n="{i}" pseudo_energy="-0.5">\n{data}\n    </PP_CHI.{i}>'.format(
+                       i=i + 1, mesh=mesh_size, l=i % 3, data=_block(rng, mesh_size)))
+    out.append('  </PP_PSWFC>')
+    if paw:
+        out.append('  <PP_FULL_WFC number_of_wfc="{0}">'.format(num_proj))
+        for tag in ('PP_AEWFC', 'PP_PSWFC'):
+            for i in range(num_proj):
+                out.append('    <{tag}.{i} type="real" size="{mesh}" columns="4" index="{i}" label="{i}S" '
+                           'l="{l}">\n{data}\n    </{tag}.{i}>'.format(
+                               tag=tag, i=i + 1, mesh=mesh_size, l=lll[i], data=_block(rng, mesh_size)))
+        out.append('  </PP_FULL_WFC>')
+    out.append('  <PP_RHOATOM type="real" size="{0}" columns="4">\n{1}\n  </PP_RHOATOM>'.format(
+        mesh_size, _block(rng, mesh_size)))
+    if spin_orbit:
+        out.append('  <PP_SPIN_ORB>')
+        for i in range(num_wfc):
+            out.append('    <PP_RELWFC.{i} index="{i}" els="{i}S" nn="1" lchi="{l}" jchi="{j}" oc="1.0"/>'.format(
+                i=i + 1, l=i % 3, j=(i % 3) + 0.5))
+        for i in range(num_proj):
+            out.append('    <PP_RELBETA.{i} index="{i}" lll="{l}" jjj="{j}"/>'.format(i=i + 1, l=lll[i], j=lll[i] + 0.5))
+        out.append('  </PP_SPIN_ORB>')
+    if paw:
+        out.append('  <PP_PAW paw_data_format="2" core_energy="-1234.5">')
+        out.append('    <PP_OCCUPATIONS type="real" size="{0}" columns="4">\n{1}\n    </PP_OCCUPATIONS>'.format(
+            num_proj, _block(rng, num_proj)))
+        out.append('    <PP_AE_NLCC type="real" size="{0}" columns="4">\n{1}\n    </PP_AE_NLCC>'.format(
+            mesh_size, _block(rng, mesh_size)))
+        out.append('    <PP_AE_VLOC type="real" size="{0}" columns="4">\n{1}\n    </PP_AE_VLOC>'.format(
+            mesh_size, _block(rng, mesh_size)))
+        out.append('  </PP_PAW>')
+    out.append('</UPF>')
+    return '\n'.join(out) + '\n'
+
+
+def synthetic_upf1(mesh_size=1000, num_proj=4, num_wfc=2, pseudo_type='US', num_q_coef=4, seed=0):
+    """Generate a UPF v1 file.
+
+    :param pseudo_type: 'NC' or 'US'
+    :param num_q_coef: number of Q(r) pseudization coefficients of ultrasoft files
+    See `synthetic_upf2` for the other arguments.
+    """
+    assert pseudo_type in ('NC', 'US')
+    rng = random.Random(seed)
+    lll = _angular_momenta(num_proj)
+    l_max = 2
+
+    out = []
+    out.append('<PP_INFO>\n  Generated by synthetic_upf\n  &input\n    zed=26.0\n  /\n</PP_INFO>')
+    out.append('<PP_HEADER>')
+    out.append('   0                   Version Number')
+    out.append('  Fe                   Element')
+    out.append('   {0}                  {1}'.format(pseudo_type, 'Ultrasoft pseudopotential' if pseudo_type == 'US'
+                                                   else 'Norm - Conserving pseudopotential'))
+    out.append('    T                  Nonlinear Core Correction')
+    out.append(' SLA  PW   PBX  PBC    PBE  Exchange-Correlation functional')
+    out.append('   16.00000000000      Z valence')
+    out.append('  -55.00000000000      Total energy')
+    out.append('    0.0000000    0.0000000 Suggested cutoff for wfc and rho')
+    out.append('    {0}                  Max angular momentum component'.format(l_max))
+    out.append('  {0:4d}                 Number of points in mesh'.format(mesh_size))
+    out.append('    {0}    {1}             Number of Wavefunctions, Number of Projectors'.format(num_wfc, num_proj))
+    out.append(' Wavefunctions         nl  l   occ')
+    for i in range(num_wfc):
+        out.append('                       {0}S  {1}  1.00'.format(i + 1, i % 3))
+    out.append('</PP_HEADER>')
+    out.append('<PP_MESH>')
+    # strictly increasing grid, needed for the Q(r) pseudization
+    grid = ['{:20.13E}'.format(0.01 * (i + 1)) for i in range(mesh_size)]
+    out.append('  <PP_R>\n' + '\n'.join('  ' + ' '.join(grid[i:i + 4]) for i in range(0, mesh_size, 4)) +
+               '\n  </PP_R>')
+    out.append('  <PP_RAB>\n{0}\n  </PP_RAB>'.format(_block(rng, mesh_size)))
+    out.append('</PP_MESH>')
+    out.append('<PP_NLCC>\n{0}\n</PP_NLCC>'.format(_block(rng, mesh_size)))
+    out.append('<PP_LOCAL>\n{0}\n</PP_LOCAL>'.format(_block(rng, mesh_size)))
+    out.append('<PP_NONLOCAL>')
+    kbeta = max(1, (mesh_size * 3) // 4)
+    for i in range(num_proj):
+        out.append('  <PP_BETA>')
+        out.append('    {0}    {1}             Beta    L'.format(i + 1, lll[i]))
+        out.append('  {0}'.format(kbeta))
+        out.append(_block(rng, kbeta))
+        out.append('    2.0    2.2             rcut, rcutus')
+        out.append('  </PP_BETA>')
+    out.append('  <PP_DIJ>')
+    out.append('    {0}                  Number of nonzero Dij'.format(num_proj))
+    for i in range(num_proj):
+        out.append('    {0}    {0}  {1:19.13E}'.format(i + 1, rng.uniform(-1, 1)))
+    out.append('  </PP_DIJ>')
+    if pseudo_type == 'US':
+        out.append('  <PP_QIJ>')
+        out.append('    {0}     Q(r) pseudized with {0} coefficients'.format(num_q_coef))
+        if num_q_coef:
+            out.append('  <PP_RINNER>')
+            for l in range(2 * l_max + 1):
+                out.append('    {0}   {1:.5f}'.format(l + 1, 0.01 * mesh_size / 3))
+            out.append('  </PP_RINNER>')
+        for i in range(num_proj):
+            for j in range(i, num_proj):
+                out.append('    {0}    {1}    {2}             i  j  (l(j))'.format(i + 1, j + 1, lll[j]))
+                out.append('  {0:19.13E}   Q_int'.format(rng.uniform(-1, 1)))
+                out.append(_block(rng, mesh_size))
+                if num_q_coef:
+                    out.append('    <PP_QFCOEF>')
+                    out.append(_block(rng, num_q_coef * (2 * l_max + 1)))
+                    out.append('    </PP_QFCOEF>')
+        out.append('  </PP_QIJ>')
+    out.append('</PP_NONLOCAL>')
+    out.append('<PP_PSWFC>')
+    for i in range(num_wfc):
+        out.append('{0}S    {1}  1.00          Wavefunction'.format(i + 1, i % 3))
+        out.append(_block(rng, mesh_size))
+    out.append('</PP_PSWFC>')
+    out.append('<PP_RHOATOM>\n{0}\n</PP_RHOATOM>'.format(_block(rng, mesh_size)))
+    return '\n'.join(out) + '\n'
@@ -0,0 +1,135 @@
+""" Tests for the cost estimator
+
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+import pytest
+
+from aiida_sirius.helpers.estimate import (bohr_to_ang, count_gvectors, estimate_calculation_cost, estimate_cost,
+                                           good_fft_size, kpoint_list)
+from aiida_sirius.helpers.kpoints import irreducible_mesh_points
+from aiida_sirius.helpers.planner import plan_layout, plan_resources, resolve_control
+
+
+@pytest.fixture
+def cubic(make_structure):
+    """Simple cubic cell of 8 atoms."""
+    return make_structure(10 * bohr_to_ang * np.eye(3), [('Si', [0, 0, 0])] * 8)
+
+
+@pytest.fixture
+def mesh(make_kpoints):
+    return make_kpoints([2, 2, 2])
+
+
+def test_good_fft_size():
+    assert good_fft_size(97) == 98
+    assert good_fft_size(64) == 64
+    assert good_fft_size(121) == 125
+
+
+def test_count_gvectors():
+    """Compare with the volume of the cutoff sphere and a brute force count."""
+    reciprocal = 2 * np.pi / 10 * np.eye(3)
+    cutoff = 8.0
+    expected = 1000 * 4 / 3. * np.pi * cutoff**3 / (2 * np.pi)**3
+    assert abs(count_gvectors(reciprocal, cutoff) - expected) / expected < 0.01
+
+    kpoint = (0.25, 0.5, 0)
+    miller = np.indices((41, 41, 41)).reshape(3, -1).T - 20
+    norm = np.linalg.norm(np.dot(miller + kpoint, reciprocal), axis=1)
+    assert count_gvectors(reciprocal, 5.0, kpoint) == np.count_nonzero(norm <= 5.0)
+
+
+def test_estimate_cost(cubic, mesh):
+    estimate = estimate_cost(cubic, mesh, {'Si': 4}, pw_cutoff=20, gk_cutoff=6, num_ranks=16)
+    assert estimate['num_kpoints'] == 8
+    assert estimate['num_kpoint_groups'] == 8
+    assert estimate['ranks_per_kpoint_group'] == 2
+    assert estimate['num_valence_electrons'] == 32
+    assert estimate['num_fv_states'] == 16 + 10
+    assert estimate['fft_grid'] == [70, 70, 70]
+    assert estimate['num_gkvec_min'] <= estimate['num_gkvec_max']
+    memory = estimate['memory_per_rank']
+    assert memory['total'] == sum(value for key, value in memory.items() if key != 'total')
+
+
+def test_estimate_irreducible_kpoints(make_structure, make_kpoints):
+    """With use_symmetry the G+k vectors are counted on the irreducible k-points of the mesh."""
+    structure = make_structure(10 * bohr_to_ang * np.eye(3), [('Si', [0, 0, 0])])
+    reciprocal = 2 * np.pi / 10 * np.eye(3)
+    for offset in ([0, 0, 0], [0.5, 0.5, 0.5]):
+        mesh = make_kpoints([4, 4, 4], offset)
+        points = irreducible_mesh_points(structure, mesh)
+        # the irreducible points are points of the mesh
+        assert all(np.isclose(kpoint_list(mesh), point).all(axis=1).any() for point in points)
+
+        parameters = {'parameters': {'pw_cutoff': 20, 'gk_cutoff': 6, 'use_symmetry': True}}
+        estimate = estimate_calculation_cost(structure, mesh, {}, parameters, valence={'Si': 4})
+        counts = [count_gvectors(reciprocal, 6, point) for point in points]
+        assert estimate['num_kpoints'] == len(points) < 64
+        assert estimate['num_gkvec_min'] == min(counts)
+        assert estimate['num_gkvec_max'] == max(counts)
+        assert estimate['num_gkvec_avg'] == pytest.approx(np.mean(counts))
+
+        parameters['parameters']['use_symmetry'] = False
+        assert estimate_calculation_cost(structure, mesh, {}, parameters, valence={'Si': 4})['num_kpoints'] == 64
+
+
+def test_plan_resources(cubic, mesh):
+    """Whole k-points per group, whole machines and the memory limit."""
+    estimate = estimate_cost(cubic, mesh, {'Si': 4}, pw_cutoff=20, gk_cutoff=6)
+    plan = plan_resources(estimate, mpiprocs_per_machine=12, max_machines=4)
+    resources = plan['resources']
+    num_ranks = resources['num_machines'] * resources['num_mpiprocs_per_machine']
+    assert num_ranks == plan['num_kpoint_groups'] * plan['ranks_per_kpoint_group']
+    assert estimate['num_kpoints'] % plan['num_kpoint_groups'] == 0
+    assert resources['num_mpiprocs_per_machine'] <= 12
+
+    single = plan_resources(estimate, mpiprocs_per_machine=12, max_machines=1)
+    assert single['resources']['num_machines'] == 1
+    with pytest.raises(ValueError):
+        plan_resources(estimate, mpiprocs_per_machine=12, memory_per_machine=1)
+
+
+def test_plan_layout():
+    """The grid fills the k-point groups, the groups divide the ranks."""
+    for num_ranks, num_bands, num_kpoints in [(1, 20, 8), (16, 26, 64), (48, 400, 10), (7, 50, 1)]:
+        layout = plan_layout(num_ranks, num_bands, num_kpoints)
+        rows, columns = layout['mpi_grid_dims']
+        assert rows >= columns
+        assert rows * columns * layout['num_kpoint_groups'] == num_ranks
+        assert layout['num_kpoint_groups'] <= num_kpoints
+    assert plan_layout(16, 26, 64)['num_kpoint_groups'] == 16
+    assert plan_layout(7, 50, 1)['mpi_grid_dims'] == [7, 1]
+
+
+def test_resolve_control(cubic, mesh):
+    """Only 'auto' entries are resolved, small problems stay serial."""
+    estimate = estimate_cost(cubic, mesh, {'Si': 4}, pw_cutoff=20, gk_cutoff=6)
+    config = {'control': {'std_evp_solver_name': 'auto', 'gen_evp_solver_name': 'elpa', 'fft_mode': 'auto',
+                          'memory_usage': 'auto', 'mpi_grid_dims': 'auto', 'cyclic_block_size': 'auto'}}
+    resolved = resolve_control(config, estimate, num_ranks=8)
+    assert 'gen_evp_solver_name' not in resolved
+    assert resolved['std_evp_solver_name'] == 'lapack'
+    assert resolved['fft_mode'] == 'serial'
+    assert resolved['memory_usage'] == 'high'
+    assert resolved['mpi_grid_dims'] == [1, 1]
+
+    estimate = dict(estimate, num_fv_states=2000, num_bands=2000, num_kpoints=1)
+    resolved = resolve_control(config, estimate, num_ranks=64)
+    assert resolved['std_evp_solver_name'] == 'scalapack'
+    assert resolved['mpi_grid_dims'] == [8, 8]
+    assert resolve_control({'control': {'fft_mode': 'serial'}}, estimate, num_ranks=64) == {}
+
+
+def test_resolve_control_mixer_history(cubic, mesh):
+    """The memory mode is resolved with the mixer history of the configuration."""
+    estimate = estimate_cost(cubic, mesh, {'Si': 4}, pw_cutoff=20, gk_cutoff=6)
+    estimate = dict(estimate, num_gvec=10**6)
+    config = {'control': {'memory_usage': 'auto'}}
+    assert resolve_control(config, estimate, num_ranks=1)['memory_usage'] == 'high'
+    config['mixer'] = {'max_history': 100}
+    assert resolve_control(config, estimate, num_ranks=1)['memory_usage'] == 'medium'
@@ -0,0 +1,58 @@
+""" Tests for the k-point helpers
+
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+from aiida_sirius.helpers.kpoints import irreducible_kpoints, mesh_from_kpoint_list
+from aiida_sirius.helpers.symmetry import clear_cache, get_symmetry
+
+
+def test_irreducible_kpoints(silicon, make_kpoints):
+    """Irreducible points of a (shifted) mesh, the mesh analysis is cached."""
+    clear_cache()
+    nr, mapping, grid = irreducible_kpoints(silicon, make_kpoints([8, 8, 8]))
+    assert nr == 29
+    assert len(mapping) == len(grid) == 8**3
+    assert irreducible_kpoints(silicon, make_kpoints([8, 8, 8]))[1] is mapping
+    # offset of half a grid spacing
+    nr_shifted, _, _ = irreducible_kpoints(silicon, make_kpoints([8, 8, 8], [0.5, 0.5, 0.5]))
+    assert nr_shifted == 60
+
+
+def _symmetric_function(structure, kpoints):
+    """Periodic function of k invariant under the space group (average over the orbit of k)."""
+    rotations = get_symmetry(structure)['rotations']
+    images = np.einsum('iba,jb->ija', rotations, np.asarray(kpoints, dtype=float))
+    phases = 2 * np.pi * np.dot(images, np.array([[1, 0, 0], [1, 2, 0], [0, 1, 1]]).T)
+    return np.exp(np.dot(np.cos(phases), [1., .5, .3])).mean(axis=0)
+
+
+def test_irreducible_weights_integrate(silicon, make_kpoints):
+    """A list recognized as mesh and reduced by spglib (as done by SIRIUS) integrates like the full mesh."""
+    structure = silicon
+    mesh = np.array([6, 6, 6])
+    kpoints = (np.indices(mesh).reshape(3, -1).T + 0.5) / mesh
+    reference = _symmetric_function(structure, kpoints).mean()
+
+    rng = np.random.default_rng(0)
+    shuffled = kpoints[rng.permutation(len(kpoints))] + rng.integers(-1, 2, size=kpoints.shape)
+    ngridk, offset = mesh_from_kpoint_list(shuffled)
+    assert ngridk == [6, 6, 6] and offset == [0.5, 0.5, 0.5]
+    _, mapping, grid = irreducible_kpoints(structure, make_kpoints(ngridk, offset))
+    irreducible, counts = np.unique(mapping, return_counts=True)
+    values = _symmetric_function(structure, (grid[irreducible] + 0.5) / mesh)
+    assert abs(np.dot(counts, values) / len(mapping) - reference) < 1e-12
+
+
+def test_mesh_from_kpoint_list():
+    """Only complete meshes (unshifted or shifted by half a spacing) are recognized."""
+    mesh = np.array([4, 3, 2])
+    grid = np.indices(mesh).reshape(3, -1).T
+    assert mesh_from_kpoint_list(grid / mesh) == ([4, 3, 2], [0, 0, 0])
+    assert mesh_from_kpoint_list((grid + [0.5, 0, 0]) / mesh - [1, 0, 0]) == ([4, 3, 2], [0.5, 0, 0])
+    assert mesh_from_kpoint_list(grid[:-1] / mesh) is None
+    assert mesh_from_kpoint_list(np.vstack([grid[:-1], grid[:1]]) / mesh) is None
+    assert mesh_from_kpoint_list((grid + 0.25) / mesh) is None
+    assert mesh_from_kpoint_list([[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]) is None
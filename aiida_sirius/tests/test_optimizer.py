@@ -0,0 +1,70 @@
+""" Tests for the input optimizer
+
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+
+def _silicon_conventional():
+    from aiida.orm import StructureData
+
+    alat = 5.43
+    fcc = np.array([[0, 0, 0], [0, .5, .5], [.5, 0, .5], [.5, .5, 0]])
+    structure = StructureData(cell=(alat * np.eye(3)).tolist())
+    for position in np.vstack([fcc, fcc + .25]) * alat:
+        structure.append_atom(position=position.tolist(), symbols='Si')
+    return structure
+
+
+def _parameters():
+    from aiida.plugins import DataFactory
+
+    return DataFactory('sirius.scf')(dict={'parameters': {'pw_cutoff': 20}})
+
+
+def test_optimize_inputs():
+    """Conventional silicon: primitive cell, denser mesh, symmetry."""
+    from aiida.orm import KpointsData
+    from aiida_sirius.helpers.optimizer import optimize_inputs
+
+    kpoints = KpointsData()
+    kpoints.set_kpoints_mesh([4, 4, 4])
+    inputs, rewrites = optimize_inputs(_silicon_conventional(), kpoints, _parameters())
+    assert rewrites == ['primitive_structure', 'rescale_kpoints_mesh', 'enable_symmetry']
+    assert len(inputs['structure'].sites) == 2
+    assert inputs['kpoints'].get_kpoints_mesh()[0] == [7, 7, 7]
+    assert inputs['sirius_config'].get_dict()['parameters']['use_symmetry']
+    # provenance
+    assert inputs['structure'].creator.process_label == 'primitive_structure'
+
+
+def test_optimize_inputs_gamma():
+    """A molecule in a box at the Gamma point: real wave functions."""
+    from aiida.orm import KpointsData, StructureData
+    from aiida_sirius.helpers.optimizer import optimize_inputs
+
+    structure = StructureData(cell=(10 * np.eye(3)).tolist())
+    structure.append_atom(position=[0, 0, 0], symbols='O')
+    structure.append_atom(position=[0, 0, 1.2], symbols='O')
+    kpoints = KpointsData()
+    kpoints.set_kpoints_mesh([1, 1, 1])
+    inputs, rewrites = optimize_inputs(structure, kpoints, _parameters())
+    assert rewrites == ['enable_symmetry', 'enable_gamma_point']
+    assert inputs['structure'] is structure
+    parameters = inputs['sirius_config'].get_dict()['parameters']
+    assert parameters['gamma_point'] and parameters['use_symmetry']
+
+
+def test_optimize_inputs_shifted_mesh():
+    """A shifted mesh has no equivalent for the primitive cell, the structure is kept."""
+    from aiida.orm import KpointsData
+    from aiida_sirius.helpers.optimizer import optimize_inputs
+
+    structure = _silicon_conventional()
+    kpoints = KpointsData()
+    kpoints.set_kpoints_mesh([4, 4, 4], offset=[0.5, 0.5, 0.5])
+    inputs, rewrites = optimize_inputs(structure, kpoints, _parameters())
+    assert rewrites == ['enable_symmetry']
+    assert inputs['structure'] is structure
+    assert inputs['kpoints'] is kpoints
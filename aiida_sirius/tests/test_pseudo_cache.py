@@ -0,0 +1,104 @@
+""" Tests for the pseudopotential conversion cache.
+
+"""
+from __future__ import absolute_import
+
+import os
+import time
+
+from aiida_sirius.tests.synthetic_upf import synthetic_upf2
+from aiida_sirius.upf_to_json import upf_to_json
+from aiida_sirius.upf_to_json.cache import PseudoCache, upf_data_to_json
+
+
+def _pp(element):
+    return {'pseudo_potential': {'header': {'element': element}, 'radial_grid': [0.0, 0.1]}}
+
+
+def test_memory_lru():
+    """Least recently used entries are dropped from the memory tier."""
+    cache = PseudoCache(cache_dir=None, max_entries=2)
+    cache.put('a', _pp('H'))
+    cache.put('b', _pp('He'))
+    assert cache.get('a') is not None
+    cache.put('c', _pp('Li'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_disk_tier(tmpdir):
+    """Entries written by one cache instance are visible to another one."""
+    writer = PseudoCache(cache_dir=str(tmpdir))
+    writer.put('a', _pp('H'))
+    assert os.path.isfile(writer.path('a'))
+
+    reader = PseudoCache(cache_dir=str(tmpdir))
+    assert reader.get('a') == _pp('H')
+    # different converter version does not see the entry
+    assert PseudoCache(cache_dir=str(tmpdir), version=-1).get('a') is None
+
+
+def test_disk_eviction(tmpdir):
+    """The on-disk tier is bounded by `max_disk_bytes`."""
+    cache = PseudoCache(cache_dir=str(tmpdir), max_disk_bytes=0)
+    cache.put('a', _pp('H'))
+    assert not os.path.exists(cache.path('a'))
+    # still available from memory
+    assert cache.get('a') == _pp('H')
+
+
+def test_upf_data_to_json(tmpdir, make_upf):
+    """`UpfData` nodes are converted once per md5, the file name is set per node."""
+    content = synthetic_upf2(51, 2, 1, 'US')
+    cache = PseudoCache(cache_dir=str(tmpdir))
+    upf = make_upf(content, 'Fe.upf')
+    assert upf_data_to_json(upf, cache) == upf_to_json(content, fname='Fe.upf')
+    assert cache.get(upf.md5sum) is not None
+
+    renamed = make_upf(content, 'Fe_renamed.upf')
+    header = upf_data_to_json(renamed, cache)['pseudo_potential']['header']
+    assert header['original_upf_file'] == 'Fe_renamed.upf'
+
+
+def test_disk_eviction_bound(tmpdir):
+    """Eviction runs only once the bound is exceeded and skips files being written."""
+    cache = PseudoCache(cache_dir=str(tmpdir))
+    cache.put('a', _pp('H'))
+    size = os.path.getsize(cache.path('a'))
+    cache.max_disk_bytes = 2 * size
+    cache.put('b', _pp('H'))
+    assert os.path.exists(cache.path('a')) and os.path.exists(cache.path('b'))
+
+    # temporary file of a concurrent writer and an abandoned one
+    writing = os.path.join(cache.version_dir, '.c1234.tmp')
+    abandoned = os.path.join(cache.version_dir, '.d1234.tmp')
+    for path in (writing, abandoned):
+        with open(path, 'w') as fh:
+            fh.write('{}')
+    os.utime(abandoned, (time.time() - 7200, time.time() - 7200))
+    os.utime(cache.path('a'), (time.time() - 60, time.time() - 60))
+
+    cache.put('c', _pp('H'))
+    assert os.path.exists(writing)
+    assert not os.path.exists(abandoned)
+    assert not os.path.exists(cache.path('a'))
+    assert os.path.exists(cache.path('c'))
+
+
+def test_precompile_one_reports_errors(tmpdir, monkeypatch):
+    """Any error of the conversion is reported per file instead of aborting the run."""
+    from aiida_sirius.upf_to_json import cache as cache_module
+
+    def broken(stream, fname):
+        raise IndexError('list index out of range')
+
+    monkeypatch.setattr(cache_module, 'upf_stream_to_json', broken)
+    fname, md5, status = cache_module._precompile_one(str(tmpdir), (b'<UPF version="2.0.1">', 'Fe.upf'), False)  # pylint: disable=protected-access
+    assert fname == 'Fe.upf'
+    assert md5 is not None
+    assert status == 'failed: IndexError: list index out of range'
+
+    fname, md5, status = cache_module._precompile_one(str(tmpdir), str(tmpdir.join('missing.upf')), False)  # pylint: disable=protected-access
+    assert fname == 'missing.upf' and md5 is None
+    assert status.startswith('failed')
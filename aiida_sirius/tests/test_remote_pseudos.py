@@ -0,0 +1,131 @@
+""" Tests for the remote store of converted pseudopotentials.
+
+"""
+from __future__ import absolute_import
+
+import os
+import subprocess
+
+from aiida_sirius.calculations.remote_pseudos import (DIRECTORY_PROPERTY, MARKER_FILE, RECORD_FILE, RemotePseudoCache,
+                                                      read_record)
+from aiida_sirius.tests.synthetic_upf import synthetic_upf2
+
+
+class FakeComputer(object):
+    """Computer with metadata in memory."""
+    uuid = '00000000-0000-0000-0000-000000000000'
+    label = 'fake'
+
+    def __init__(self, directory):
+        self.properties = {DIRECTORY_PROPERTY: directory}
+
+    def get_property(self, name, *default):
+        return self.properties.get(name, *default)
+
+
+def test_upload_command(tmpdir):
+    """Uploaded files are copied into the store, a failed copy fails the job script."""
+    store = tmpdir.join('store dir')
+    workdir = tmpdir.mkdir('work')
+    workdir.join('a.json').write('{}')
+    cache = RemotePseudoCache(FakeComputer(str(store)))
+
+    script = cache.upload_command(['a.json']) + '\necho done'
+    output = subprocess.check_output(script, shell=True, cwd=str(workdir))
+    assert output.strip() == b'done'
+    assert os.path.isfile(cache.path('a'))
+    assert os.path.isfile(os.path.join(cache.version_dir, MARKER_FILE))
+    assert read_record(workdir.join(RECORD_FILE).read()) == ({'a'}, set())
+
+    script = cache.upload_command(['a.json', 'missing.json']) + '\necho done'
+    process = subprocess.Popen(script, shell=True, cwd=str(workdir), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, _ = process.communicate()
+    assert process.returncode != 0
+    assert b'done' not in output
+    assert sorted(os.listdir(cache.version_dir)) == [MARKER_FILE, 'a.json']
+
+
+def test_check_command(tmpdir):
+    """Linked files missing in the working directory are reported."""
+    workdir = tmpdir.mkdir('work')
+    workdir.join('a.json').mksymlinkto(tmpdir.join('store_a.json'))
+    workdir.join('b.json').mksymlinkto(tmpdir.join('store_b.json'))
+    tmpdir.join('store_a.json').write('{}')
+    cache = RemotePseudoCache(FakeComputer(str(tmpdir.join('store'))))
+    assert cache.check_command([]) == ''
+    subprocess.check_call(cache.check_command(['a.json', 'b.json']), shell=True, cwd=str(workdir))
+    assert read_record(workdir.join(RECORD_FILE).read()) == (set(), {'b'})
+
+
+def test_stale_version_dirs(tmpdir):
+    """Only marked directories of older converter versions are pruned."""
+    from aiida.transports.plugins.local import LocalTransport
+
+    store = tmpdir.mkdir('store')
+    cache = RemotePseudoCache(FakeComputer(str(store)), version=3)
+    with LocalTransport() as transport:
+        assert cache.stale_version_dirs(transport) == []
+        for name in ('v1', 'v2', 'v3', 'v2.bak', 'vendor', 'v10'):
+            store.mkdir(name)
+        for name in ('v1', 'v3', 'v2.bak', 'v10'):
+            store.join(name, MARKER_FILE).write('')
+        # v10 belongs to a newer version of the plugin
+        assert cache.stale_version_dirs(transport) == [(1, str(store.join('v1')))]
+        # nothing is returned if the store directory does not exist
+        assert RemotePseudoCache(FakeComputer(str(tmpdir.join('missing')))).stale_version_dirs(transport) == []
+
+
+def test_records(localhost, tmpdir):
+    """The store contents are recorded per converter version and precision."""
+    from aiida.orm import UpfData
+
+    upfs = []
+    for i, pseudo_type in enumerate(('NC', 'US')):
+        path = tmpdir.join('Fe{}.upf'.format(i))
+        path.write(synthetic_upf2(11, 2, 1, pseudo_type))
+        upfs.append(UpfData(file=str(path)).store())
+    md5s = [upf.md5sum for upf in upfs]
+
+    cache = RemotePseudoCache(localhost)
+    assert md5s[0] not in cache
+    cache.add(upfs)
+    cache.add(upfs[:1])
+    assert cache.entries() == set(md5s)
+    assert md5s[0] in cache
+
+    rounded = RemotePseudoCache(localhost, precision=6)
+    assert md5s[0] not in rounded
+    rounded.add(upfs[:1])
+    assert md5s[0] in rounded
+    assert cache.entries() == set(md5s + [md5s[0] + '.p6'])
+
+    cache.forget([md5s[0], md5s[0] + '.p6'])
+    assert md5s[0] not in cache and md5s[0] not in rounded and md5s[1] in cache
+    assert cache.versions() == [cache.version]
+    cache.forget()
+    assert cache.entries() == set() and cache.versions() == []
+
+
+def test_prune(localhost, tmpdir):
+    """`verdi data sirius remote-cache prune` removes marked directories of older versions and their records."""
+    from click.testing import CliRunner
+    from aiida.orm import UpfData
+    from aiida_sirius.cmd.cmd_sirius_parameters import remote_cache_prune
+
+    store = tmpdir.mkdir('store')
+    localhost.set_property(DIRECTORY_PROPERTY, str(store))
+    current = RemotePseudoCache(localhost)
+    older = RemotePseudoCache(localhost, version=current.version - 1)
+    path = tmpdir.join('Fe.upf')
+    path.write(synthetic_upf2(11, 2, 1, 'NC'))
+    upf = UpfData(file=str(path)).store()
+    for cache in (current, older):
+        store.mkdir('v{}'.format(cache.version)).join(MARKER_FILE).write('')
+        cache.add([upf])
+    store.mkdir('v0.backup').join(MARKER_FILE).write('')
+
+    result = CliRunner().invoke(remote_cache_prune, [str(localhost.pk)])
+    assert result.exit_code == 0, result.output
+    assert sorted(path.basename for path in store.listdir()) == sorted(['v{}'.format(current.version), 'v0.backup'])
+    assert current.versions() == [current.version]
+
@@ -0,0 +1,318 @@
+""" Tests for the input generation of the Sirius calculations.
+
+"""
+from __future__ import absolute_import
+
+import gzip
+import itertools
+import json
+import subprocess
+
+import numpy as np
+import pytest
+from voluptuous import Invalid
+
+from aiida.common.folders import Folder
+
+from aiida_sirius.calculations.remote_pseudos import RECORD_FILE, RemotePseudoCache
+from aiida_sirius.calculations.scf_base import (InputFolder, SiriusBaseCalculation, SiriusInputRenderer,
+                                                add_cell_kpoints_mag_to_sirius, pseudo_key)
+from aiida_sirius.tests.synthetic_upf import synthetic_upf2
+from aiida_sirius.upf_to_json import upf_data_to_json
+
+
+def _read_json(folder, filename):
+    if filename.endswith('.gz'):
+        with gzip.open(folder.get_abs_path(filename), 'rt') as handle:
+            return json.load(handle)
+    with folder.open(filename) as handle:
+        return json.load(handle)
+
+
+def test_validate_sirius_json(make_kpoints):
+    """The k-point entries and resolved control values are validated as written."""
+    config = {'control': {'mpi_grid_dims': [2, 2]}, 'parameters': {'pw_cutoff': 20}}
+    SiriusBaseCalculation._validate_sirius_json(config, kpoints=make_kpoints(kpoints=[[0, 0, 0], [0.5, 0, 0]]))  # pylint: disable=protected-access
+
+    with pytest.raises(Invalid):
+        SiriusBaseCalculation._validate_sirius_json(config, kpoints=make_kpoints(kpoints=[[0, 0], [0.5, 0]]))  # pylint: disable=protected-access
+    with pytest.raises(Invalid):
+        SiriusBaseCalculation._validate_sirius_json({'control': {'mpi_grid_dims': 'auto', 'cyclic_block_size': 0}})  # pylint: disable=protected-access
+
+
+def test_input_folder(tmpdir):
+    """Compressed inputs are written as .gz files and inflated by `decompress_command`."""
+    inputs = InputFolder(Folder(str(tmpdir.mkdir('plain'))))
+    with inputs.open('sirius.json') as handle:
+        handle.write('{}')
+    assert inputs.folder.get_content_list() == ['sirius.json']
+    assert inputs.decompress_command() == ''
+
+    directory = tmpdir.mkdir('compressed')
+    inputs = InputFolder(Folder(str(directory)), compress=True)
+    with inputs.open('sirius.json') as handle:
+        handle.write('{}')
+    with inputs.open('a.json') as handle:
+        handle.write('[]')
+    assert inputs.isfile('sirius.json')
+    assert sorted(inputs.folder.get_content_list()) == ['a.json.gz', 'sirius.json.gz']
+    assert inputs.decompress_command() == 'gunzip -f sirius.json.gz a.json.gz'
+
+    subprocess.check_call(inputs.decompress_command(), shell=True, cwd=str(directory))
+    assert sorted(directory.listdir(), key=str) == [directory.join('a.json'), directory.join('sirius.json')]
+    assert directory.join('sirius.json').read() == '{}'
+
+
+@pytest.fixture
+def iron(pseudo_cache, tmpdir):  # pylint: disable=unused-argument
+    """Stored inputs for bcc iron, the kinds Fe1 and Fe2 share a pseudopotential."""
+    from aiida.orm import Dict, KpointsData, StructureData, UpfData
+
+    path = tmpdir.join('Fe.upf')
+    path.write(synthetic_upf2(101, 2, 1, 'US'))
+    upf = UpfData(file=str(path)).store()
+    alat = 2.87
+    structure = StructureData(cell=(alat * np.eye(3)).tolist())
+    structure.append_atom(position=(0, 0, 0), symbols='Fe', name='Fe1')
+    structure.append_atom(position=(alat / 2,) * 3, symbols='Fe', name='Fe2')
+    kpoints = KpointsData()
+    kpoints.set_kpoints_mesh([2, 2, 2])
+    return {
+        'structure': structure.store(),
+        'kpoints': kpoints.store(),
+        'magnetization': Dict(dict={'Fe1': [0, 0, 1]}).store(),
+        'pseudos': {'Fe1': upf, 'Fe2': upf},
+    }
+
+
+@pytest.fixture
+def prepare_scf(sirius_code, iron, tmpdir):
+    """Instantiate a `sirius.scf` calculation of `iron` and write its inputs.
+
+    `prepare_scf(kpoints=None, parameters=None, **options)` returns (process, calcinfo, folder),
+    `parameters` are added to the 'parameters' section.
+    """
+    from aiida.engine.utils import instantiate_process
+    from aiida.manage.manager import get_manager
+    from aiida.plugins import CalculationFactory, DataFactory
+
+    counter = itertools.count()
+
+    def prepare(kpoints=None, parameters=None, **options):
+        parameters = dict({'pw_cutoff': 20, 'gk_cutoff': 6}, **(parameters or {}))
+        inputs = dict(iron, code=sirius_code, metadata={'options': options},
+                      sirius_config=DataFactory('sirius.scf')(dict={'parameters': parameters}))
+        if kpoints is not None:
+            inputs['kpoints'] = kpoints
+        process = instantiate_process(get_manager().get_runner(), CalculationFactory('sirius.scf'), **inputs)
+        folder = Folder(str(tmpdir.mkdir('calc{}'.format(next(counter)))))
+        return process, process.prepare_for_submission(folder), folder
+
+    return prepare
+
+
+def test_renderer(iron):
+    """The rendered sirius.json matches `add_cell_kpoints_mag_to_sirius`, fragments are reused."""
+    config = {'control': {'verbosity': 1}, 'parameters': {'pw_cutoff': 20, 'ngridk': [1, 1, 1]}, 'mixer': {'beta': 0.5}}
+    renderer = SiriusInputRenderer()
+    text = renderer.render(config, **iron)
+    rendered = json.loads(text)
+
+    expected = add_cell_kpoints_mag_to_sirius(config, iron['structure'], iron['magnetization'], iron['kpoints'])
+    pseudo = upf_data_to_json(iron['pseudos']['Fe1'])
+    for label in ('Fe1', 'Fe2'):
+        assert json.loads(rendered['unit_cell']['atom_files'].pop(label)) == pseudo
+        expected['unit_cell']['atom_files'].pop(label)
+    assert rendered == expected
+    assert list(rendered) == list(expected)
+    assert rendered['parameters']['ngridk'] == [2, 2, 2]
+
+    # k-points, unit cell and the shared pseudopotential, a sweep of the parameters reuses them
+    assert len(renderer._fragments) == 3  # pylint: disable=protected-access
+    assert renderer.render(config, **iron) == text
+    sweep = json.loads(renderer.render(dict(config, parameters={'pw_cutoff': 30}), **iron))
+    assert sweep['parameters'] == {'pw_cutoff': 30, 'ngridk': [2, 2, 2], 'shiftk': [0, 0, 0]}
+    assert sweep['unit_cell'] == json.loads(text)['unit_cell']
+    assert len(renderer._fragments) == 3  # pylint: disable=protected-access
+
+    with pytest.raises(ValueError):
+        renderer.render(config, separate_pseudo_files=True, **iron)
+
+
+def test_renderer_streams_large_pseudos(iron):
+    """Pseudopotentials larger than `max_pseudo_bytes` are written but not kept as fragments."""
+    config = {'parameters': {'pw_cutoff': 20}}
+    cached = SiriusInputRenderer().render(config, **iron)
+    renderer = SiriusInputRenderer(max_pseudo_bytes=1024)
+    assert renderer.render(config, **iron) == cached
+    assert renderer.render(config, **iron) == cached
+    # only the k-points and the unit cell
+    assert len(renderer._fragments) == 2  # pylint: disable=protected-access
+
+
+def test_renderer_cache_limit(iron, monkeypatch):
+    """The cached fragments never exceed `max_bytes`, the limit is set by the environment."""
+    from aiida_sirius.calculations import scf_base
+
+    renderer = SiriusInputRenderer(max_bytes=4096)
+    for i in range(20):
+        renderer._fragment(('test', i), lambda: ('x' * 1000, None))  # pylint: disable=protected-access,cell-var-from-loop
+        assert renderer._size <= renderer.max_bytes  # pylint: disable=protected-access
+    assert list(renderer._fragments) == [('test', i) for i in range(16, 20)]  # pylint: disable=protected-access
+
+    # the pseudopotential is larger than the limit
+    config = {'parameters': {'pw_cutoff': 20}}
+    assert renderer.render(config, **iron) == SiriusInputRenderer().render(config, **iron)
+    assert renderer._size <= renderer.max_bytes  # pylint: disable=protected-access
+    assert renderer._size == sum(len(text) for text, _ in renderer._fragments.values())  # pylint: disable=protected-access
+
+    monkeypatch.setattr(scf_base, '_INPUT_RENDERER', None)
+    monkeypatch.setenv(scf_base.RENDERER_CACHE_ENV, '2')
+    assert scf_base.get_input_renderer().max_bytes == 2 * 1024**2
+
+
+def test_prepare_for_submission(prepare_scf):
+    """sirius.json is written into the folder and excluded from the provenance."""
+    process, calcinfo, folder = prepare_scf()
+    assert folder.get_content_list() == ['sirius.json']
+    assert calcinfo.local_copy_list == []
+    assert calcinfo.provenance_exclude_list == ['sirius.json']
+    assert calcinfo.retrieve_list == ['sirius.scf.out', 'output.json']
+    sirius_json = _read_json(folder, 'sirius.json')
+    assert sirius_json['parameters']['ngridk'] == [2, 2, 2]
+    pseudo = upf_data_to_json(process.inputs.pseudos['Fe1'])
+    assert [json.loads(sirius_json['unit_cell']['atom_files'][label]) for label in ('Fe1', 'Fe2')] == [pseudo] * 2
+    assert process.node.get_extra('sirius_json', None) is None
+
+
+def test_separate_pseudo_files(prepare_scf):
+    """Pseudopotentials shared by several kinds are written once to <md5>.json."""
+    process, calcinfo, folder = prepare_scf(separate_pseudo_files=True)
+    upf = process.inputs.pseudos['Fe1']
+    filename = upf.md5sum + '.json'
+    assert sorted(folder.get_content_list()) == sorted([filename, 'sirius.json'])
+    assert sorted(calcinfo.provenance_exclude_list) == sorted([filename, 'sirius.json'])
+    assert _read_json(folder, 'sirius.json')['unit_cell']['atom_files'] == {'Fe1': filename, 'Fe2': filename}
+    assert _read_json(folder, filename) == upf_data_to_json(upf)
+
+
+def test_compress_inputs(prepare_scf):
+    """Compressed inputs are excluded from the provenance and inflated by the job script."""
+    process, calcinfo, folder = prepare_scf(compress_inputs=True, separate_pseudo_files=True)
+    pseudo = process.inputs.pseudos['Fe1'].md5sum + '.json.gz'
+    assert sorted(folder.get_content_list()) == sorted([pseudo, 'sirius.json.gz'])
+    assert sorted(calcinfo.provenance_exclude_list) == sorted([pseudo, 'sirius.json.gz'])
+    assert calcinfo.prepend_text == 'gunzip -f sirius.json.gz {}'.format(pseudo)
+    assert _read_json(folder, 'sirius.json.gz')['parameters']['ngridk'] == [2, 2, 2]
+
+
+def _retrieve_record(process, record):
+    """Attach a retrieved folder with the store report `record` of the job script and update the records."""
+    from aiida.common.links import LinkType
+    from aiida.orm import FolderData
+
+    retrieved = FolderData()
+    with retrieved.open(RECORD_FILE, 'w') as handle:
+        handle.write(record)
+    retrieved.add_incoming(process.node, link_type=LinkType.CREATE, link_label='retrieved')
+    retrieved.store()
+    process._update_remote_pseudos()  # pylint: disable=protected-access
+
+
+def test_remote_pseudo_cache(prepare_scf):
+    """Missing pseudopotentials are uploaded into the store, recorded ones are linked."""
+    process, calcinfo, folder = prepare_scf(remote_pseudo_cache=True)
+    upf = process.inputs.pseudos['Fe1']
+    computer = process.node.computer
+    cache = RemotePseudoCache(computer)
+    filename = cache.filename(upf.md5sum)
+    assert folder.isfile(filename)
+    assert calcinfo.prepend_text == cache.upload_command([filename])
+    assert calcinfo.remote_symlink_list == []
+    assert calcinfo.retrieve_list == [RECORD_FILE, 'sirius.scf.out', 'output.json']
+    assert process.node.get_extra('remote_pseudo_uploads') == [upf.md5sum]
+
+    # recorded once the job script reported the upload
+    _retrieve_record(process, '')
+    assert upf.md5sum not in cache
+    process, _, _ = prepare_scf(remote_pseudo_cache=True)
+    _retrieve_record(process, 'stored {}\n'.format(upf.md5sum))
+    assert upf.md5sum in cache
+
+    process, calcinfo, folder = prepare_scf(remote_pseudo_cache=True)
+    remote = [(computer.uuid, cache.path(upf.md5sum), filename)]
+    assert not folder.isfile(filename)
+    assert calcinfo.prepend_text == cache.check_command([filename])
+    assert calcinfo.remote_symlink_list == remote
+    assert process.node.get_extra('remote_pseudo_links') == [upf.md5sum]
+    assert process.node.get_extra('remote_pseudo_uploads', None) is None
+    assert _read_json(folder, 'sirius.json')['unit_cell']['atom_files'] == {'Fe1': filename, 'Fe2': filename}
+
+    _, calcinfo, _ = prepare_scf(remote_pseudo_cache=True, remote_pseudo_copy=True)
+    assert calcinfo.remote_copy_list == remote
+
+    # linked files the job script did not find are dropped from the records
+    _retrieve_record(process, 'missing {}\n'.format(upf.md5sum))
+    assert upf.md5sum not in cache
+
+    # files of another precision are separate entries
+    process, calcinfo, folder = prepare_scf(remote_pseudo_cache=True, pseudo_precision=8)
+    assert folder.isfile(cache.filename(pseudo_key(upf, 8)))
+    assert calcinfo.remote_symlink_list == []
+
+
+def test_auto_resources(prepare_scf):
+    """`auto_resources` replaces the resources by the planned ones."""
+    from aiida_sirius.helpers.estimate import estimate_calculation_cost
+    from aiida_sirius.helpers.planner import plan_resources
+
+    process, _, _ = prepare_scf(auto_resources={'max_machines': 2})
+    inputs = process.inputs
+    estimate = estimate_calculation_cost(inputs.structure, inputs.kpoints, inputs.pseudos,
+                                         inputs.sirius_config.get_dict())
+    # mpiprocs_per_machine of the computer
+    expected = plan_resources(estimate, 4, max_machines=2)
+    assert process.node.get_option('resources') == dict(expected['resources'])
+    assert process.node.get_attribute('resource_plan')['resources'] == dict(expected['resources'])
+
+
+def test_reduce_kpoints(prepare_scf):
+    """Explicit lists forming a complete mesh are written as mesh, other lists and `use_symmetry: false` unchanged."""
+    from aiida.orm import KpointsData
+
+    mesh = KpointsData()
+    mesh.set_kpoints_mesh([2, 2, 2])
+    points = mesh.get_kpoints_mesh(print_list=True)
+
+    kpoints = KpointsData()
+    kpoints.set_kpoints(points)
+    process, _, folder = prepare_scf(kpoints=kpoints, reduce_kpoints=True)
+    parameters = _read_json(folder, 'sirius.json')['parameters']
+    assert parameters['ngridk'] == [2, 2, 2]
+    assert parameters['shiftk'] == [0, 0, 0]
+    assert parameters['use_symmetry']
+    assert 'vk' not in parameters
+    assert process.node.get_extra('reduced_kpoints') == {'num_kpoints': 8, 'mesh': [2, 2, 2], 'offset': [0, 0, 0]}
+
+    for subset, weights, options in [(points[:3], None, None), (points, [2.] + [1.] * 7, None),
+                                     (points, None, {'use_symmetry': False})]:
+        kpoints = KpointsData()
+        kpoints.set_kpoints(subset, weights=weights)
+        process, _, folder = prepare_scf(kpoints=kpoints, parameters=options, reduce_kpoints=True)
+        parameters = _read_json(folder, 'sirius.json')['parameters']
+        assert np.allclose(parameters['vk'], subset)
+        assert 'ngridk' not in parameters and parameters.get('use_symmetry', False) is False
+        assert process.node.get_extra('reduced_kpoints', None) is None
+
+
+def test_store_rendered_input(prepare_scf):
+    """With `store_sirius_json` identical files are stored once and referenced by the extra `sirius_json`."""
+    from aiida.orm import load_node
+
+    process, _, folder = prepare_scf(store_sirius_json=True)
+    uuid = process.node.get_extra('sirius_json')
+    with load_node(uuid).open() as handle:
+        assert json.load(handle) == _read_json(folder, 'sirius.json')
+
+    process, _, _ = prepare_scf(store_sirius_json=True)
+    assert process.node.get_extra('sirius_json') == uuid
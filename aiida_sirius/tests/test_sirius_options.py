@@ -0,0 +1,53 @@
+""" Tests for the validation of sirius.json.
+
+"""
+from __future__ import absolute_import
+
+import pytest
+from voluptuous import MultipleInvalid
+
+from aiida_sirius.data.sirius_options import get_sirius_schema
+
+
+def _unit_cell(atoms):
+    return {'unit_cell': {
+        'lattice_vectors': [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+        'atom_types': list(atoms),
+        'atom_files': {label: label + '.json' for label in atoms},
+        'atoms': atoms,
+    }}
+
+
+def test_schema_cached():
+    """The compiled schema is built once."""
+    assert get_sirius_schema() is get_sirius_schema()
+    assert get_sirius_schema(('mixer',)) is get_sirius_schema(('mixer',))
+
+
+def test_numeric_arrays():
+    """Regular coordinate blocks pass, lattice vectors are converted to float."""
+    schema = get_sirius_schema(('unit_cell',))
+    validated = schema(_unit_cell({'Fe': [[0, 0, 0, 0, 0, 1]] * 100, 'O': [[0.5, 0.5, 0.5], [1, 1, 1]]}))
+    assert validated['unit_cell']['lattice_vectors'][0] == [1.0, 0.0, 0.0]
+    assert isinstance(validated['unit_cell']['lattice_vectors'][0][0], float)
+    # one row of 3 and one of 6 coordinates goes through the element-wise schema
+    schema(_unit_cell({'Fe': [[0, 0, 0], [0, 0, 0, 0, 0, 1]]}))
+
+
+@pytest.mark.parametrize('coordinates', [[[0, 0]], [[0, 0, 'x']], [[0, 0, 0], [0, 0]], [[0, 0, float('nan')]]])
+def test_numeric_arrays_invalid(coordinates):
+    """Wrong shapes, non-numbers and non-finite values are rejected."""
+    with pytest.raises(MultipleInvalid):
+        get_sirius_schema(('unit_cell',))(_unit_cell({'Fe': coordinates}))
+
+
+@pytest.mark.parametrize('control', [{'mpi_grid_dims': 'auto'}, {'mpi_grid_dims': [4, 2], 'cyclic_block_size': 32},
+                                     {'cyclic_block_size': 'auto'}])
+def test_parallel_layout(control):
+    get_sirius_schema(('control',))({'control': control})
+
+
+@pytest.mark.parametrize('control', [{'mpi_grid_dims': [4]}, {'mpi_grid_dims': [0, 2]}, {'cyclic_block_size': 0}])
+def test_parallel_layout_invalid(control):
+    with pytest.raises(MultipleInvalid):
+        get_sirius_schema(('control',))({'control': control})
@@ -0,0 +1,35 @@
+""" Tests for the symmetry analysis
+
+"""
+from __future__ import absolute_import
+
+import numpy as np
+
+from aiida_sirius.helpers.symmetry import clear_cache, get_spglib_cell, get_symmetry, num_symmetry_operations
+
+
+def test_get_spglib_cell(make_structure):
+    """Conventional silicon: fractional positions, kinds numbered in order of their first site."""
+    alat = 5.43
+    fcc = np.array([[0, 0, 0], [0, .5, .5], [.5, 0, .5], [.5, .5, 0]])
+    positions = np.vstack([fcc, fcc + .25]) * alat
+    kinds = ['Si1', 'Si2'] * 4
+    structure = make_structure(alat * np.eye(3), zip(kinds, positions))
+    (lattice, fractional, numbers), names = get_spglib_cell(structure)
+    assert names == ['Si1', 'Si2']
+    assert np.allclose(np.dot(fractional, lattice), positions)
+    assert list(numbers) == [0, 1] * 4
+
+
+def test_get_symmetry(silicon, make_structure):
+    """Space group of silicon, the analysis is cached by the content of the structure."""
+    clear_cache()
+    symmetry = get_symmetry(silicon)
+    assert len(symmetry['rotations']) == 48
+    assert symmetry['number'] == 227
+    assert not symmetry['rotations'].flags.writeable
+    # a different node with the same cell
+    copy = make_structure(silicon.attributes['cell'],
+                          [(site['kind_name'], site['position']) for site in silicon.attributes['sites']])
+    assert get_symmetry(copy) is symmetry
+    assert num_symmetry_operations(silicon) == 48
@@ -0,0 +1,141 @@
+""" Tests for the UPF to SIRIUS json converter.
+
+"""
+from __future__ import absolute_import
+
+import io
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from aiida_sirius.tests.synthetic_upf import synthetic_upf1, synthetic_upf2, PSEUDO_TYPES
+from aiida_sirius.upf_to_json import (upf_to_json, upf_stream_to_json, probe_upf, dumps_pseudo, dump_pseudo_string,
+                                      LazyPseudo, UpfParseError)
+from aiida_sirius.upf_to_json.probe import _header_element
+from aiida_sirius.upf_to_json.upf2_to_json import UpfIndex, parse_upf2_from_string
+
+
+@pytest.mark.parametrize('pseudo_type', PSEUDO_TYPES)
+def test_upf2(pseudo_type):
+    """Convert synthetic UPF v2 files of all flavours."""
+    mesh_size, num_proj, num_wfc = 101, 4, 2
+    pp_dict = upf_to_json(synthetic_upf2(mesh_size, num_proj, num_wfc, pseudo_type), fname='Fe.upf')
+    pp = pp_dict['pseudo_potential']
+
+    assert pp['header']['original_upf_file'] == 'Fe.upf'
+    assert pp['header']['mesh_size'] == mesh_size
+    assert len(pp['radial_grid']) == mesh_size
+    assert len(pp['beta_projectors']) == num_proj
+    assert len(pp['D_ion']) == num_proj**2
+    assert len(pp['atomic_wave_functions']) == num_wfc
+    assert isinstance(pp['local_potential'], list)
+    assert ('augmentation' in pp) == (pseudo_type != 'NC')
+    assert ('paw_data' in pp) == (pseudo_type == 'PAW')
+    if pseudo_type == 'SO':
+        assert 'total_angular_momentum' in pp['beta_projectors'][0]
+
+
+def test_upf_index():
+    """The index returns the first element for a given path."""
+    root = ET.fromstring(synthetic_upf2(10, 2, 1, 'US').replace('&', ''))
+    index = UpfIndex.from_root(root)
+    assert index['PP_NONLOCAL/PP_BETA.2'] is root.findall('./PP_NONLOCAL/PP_BETA.2')[0]
+    assert 'PP_NONLOCAL/PP_AUGMENTATION/PP_QIJL.1.1.0' in index
+    with pytest.raises(KeyError):
+        index['PP_NONLOCAL/PP_BETA.3']  # pylint: disable=pointless-statement
+
+
+@pytest.mark.parametrize('pseudo_type', PSEUDO_TYPES)
+def test_upf2_stream(pseudo_type):
+    """The streaming parser gives the same result as the in-memory parser."""
+    upf = synthetic_upf2(57, 3, 2, pseudo_type)
+    reference = upf_to_json(upf, fname='Fe.upf')
+    # small chunks to split elements between reads
+    assert upf_stream_to_json(io.BytesIO(upf.encode()), fname='Fe.upf', chunk_size=100) == reference
+    assert upf_stream_to_json(io.StringIO(upf), fname='Fe.upf') == reference
+
+
+@pytest.mark.parametrize('pseudo_type', ['NC', 'US'])
+@pytest.mark.parametrize('num_q_coef', [0, 4])
+def test_upf1(pseudo_type, num_q_coef):
+    """Convert synthetic UPF v1 files."""
+    mesh_size, num_proj, num_wfc = 103, 3, 2
+    upf = synthetic_upf1(mesh_size, num_proj, num_wfc, pseudo_type, num_q_coef=num_q_coef)
+    pp = upf_to_json(upf, fname='Fe.upf')['pseudo_potential']
+
+    assert len(pp['radial_grid']) == mesh_size
+    assert len(pp['beta_projectors']) == num_proj
+    assert len(pp['beta_projectors'][0]['radial_function']) == (mesh_size * 3) // 4
+    assert len(pp['D_ion']) == num_proj**2
+    assert [len(wfc['radial_function']) for wfc in pp['atomic_wave_functions']] == [mesh_size] * num_wfc
+    assert len(pp['total_charge_density']) == mesh_size
+    if pseudo_type == 'US' and num_q_coef:
+        assert pp['augmentation']
+
+
+def test_upf1_truncated():
+    """A truncated file raises instead of exiting the interpreter."""
+    upf = synthetic_upf1(103, 3, 2, 'US')
+    with pytest.raises(UpfParseError):
+        upf_to_json(upf[:len(upf) // 2], fname='Fe.upf')
+
+
+@pytest.mark.parametrize('upf', [synthetic_upf1(1003, 3, 2, 'US'), synthetic_upf2(1003, 3, 2, 'PAW')])
+def test_probe_upf(upf):
+    """The probe reads the same header as the full conversion from the beginning of the file."""
+    header = upf_to_json(upf, fname='Fe.upf')['pseudo_potential']['header']
+    handle = io.BytesIO(upf.encode())
+    probed = probe_upf(handle, chunk_size=256)
+
+    assert handle.tell() < len(upf) // 10
+    assert probed.pop('upf_version') in (1, 2)
+    # PAW files add entries from other sections to the header
+    assert probed == {key: header[key] for key in probed}
+
+
+def test_probe_upf_quoting():
+    """Single quoted attributes and entities in the v2 header."""
+    upf = synthetic_upf2(57, 3, 2, 'US').replace('element="Fe"', "element='Fe'")
+    upf = upf.replace('generated="synthetic"', 'generated="&lt;synthetic&gt; &amp; \'quoted\'"')
+    header = upf_to_json(upf, fname='Fe.upf')['pseudo_potential']['header']
+    probed = probe_upf(io.BytesIO(upf.encode()))
+    probed.pop('upf_version')
+    assert probed['element'] == 'Fe'
+    assert probed == {key: header[key] for key in probed}
+
+    # not well-formed (unescaped '&'), scanned leniently
+    element = _header_element("element='Fe' generated='a & b' author=\"&quot;x&apos;\" ")
+    assert element.attrib == {'element': 'Fe', 'generated': 'a & b', 'author': '"x\''}
+
+
+@pytest.mark.parametrize('as_arrays', [False, True])
+def test_dumps_pseudo(as_arrays):
+    """The compact writer reads back to the converted dictionary."""
+    upf = synthetic_upf2(57, 3, 2, 'PAW')
+    reference = parse_upf2_from_string(upf)
+    pp_dict = parse_upf2_from_string(upf, as_arrays=as_arrays)
+
+    assert json.loads(dumps_pseudo(pp_dict)) == reference
+    handle = io.StringIO()
+    dump_pseudo_string(pp_dict, handle)
+    assert json.loads(json.loads(handle.getvalue())) == reference
+
+    rounded = json.loads(dumps_pseudo(pp_dict, precision=6))
+    grid = reference['pseudo_potential']['radial_grid']
+    assert rounded['pseudo_potential']['radial_grid'] == pytest.approx(grid, rel=1e-5)
+    assert rounded['pseudo_potential']['header'] == reference['pseudo_potential']['header']
+
+
+@pytest.mark.parametrize('upf', [synthetic_upf1(103, 3, 2, 'US')] +
+                         [synthetic_upf2(57, 3, 2, pseudo_type) for pseudo_type in PSEUDO_TYPES])
+def test_lazy_pseudo(upf):
+    """Entries are decoded on access, the full dictionary equals the conversion."""
+    reference = upf_to_json(upf, fname='Fe.upf')
+    pseudo = LazyPseudo(upf, fname='Fe.upf')
+
+    assert pseudo.header['number_of_wfc'] == 2
+    assert len(pseudo['atomic_wave_functions']) == 2
+    assert 'total_charge_density' not in pseudo._values  # pylint: disable=protected-access
+    assert list(pseudo) == list(reference['pseudo_potential'])
+    assert pseudo.to_dict() == reference
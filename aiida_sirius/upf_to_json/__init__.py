@@ -1 +1,6 @@
-from .upf_to_json import upf_to_json
+from .upf_to_json import upf_to_json, upf_stream_to_json, CONVERTER_VERSION
+from .cache import PseudoCache, get_pseudo_cache, upf_data_to_json, precompile_pseudos
+from .exceptions import UpfParseError
+from .probe import probe_upf, probe_upf_data
+from .lazy import LazyPseudo
+from .serialize import dump_pseudo, dump_pseudo_string, dumps_pseudo
@@ -0,0 +1,43 @@
+"""
+NumPy based decoding of the numerical blocks of UPF files.
+
+Radial functions are kept as float64 arrays while parsing and only converted
+to (nested) python lists for the final json serialization.
+"""
+import warnings
+
+import numpy as np
+
+
+def parse_float_array(text, scale=None):
+    """Decode a block of whitespace separated numbers into a float64 array.
+
+    :param text: string, e.g. the text of a UPF xml node
+    :param scale: optional factor applied to all values (e.g. 0.5 for Ry -> Ha)
+    :returns: 1d `numpy.ndarray`
+    """
+    if text is None:
+        values = np.empty(0)
+    else:
+        with warnings.catch_warnings():
+            # numpy only warns on trailing garbage, we want an error
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                values = np.fromstring(text, dtype=np.float64, sep=' ')
+            except (ValueError, DeprecationWarning):
+                # raises a ValueError with the offending token
+                values = np.array(text.split(), dtype=np.float64)
+    if scale is not None:
+        values *= scale
+    return values
+
+
+def arrays_to_lists(obj):
+    """Recursively replace numpy arrays in dictionaries and lists by python lists."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {key: arrays_to_lists(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [arrays_to_lists(value) for value in obj]
+    return obj
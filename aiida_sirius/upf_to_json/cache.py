@@ -0,0 +1,300 @@
+"""
+Content-addressed cache for converted pseudopotentials.
+
+Entries are keyed by the md5 checksum of the UPF file and by the converter
+version, such that a change in the converter output invalidates old entries.
+The cache has two tiers:
+
+ 1. an in-process LRU dictionary holding the converted (JSON) dictionaries
+ 2. an on-disk store shared by all processes (e.g. daemon workers) of a user
+
+Files on disk are written to a temporary file first and atomically moved into
+place, hence concurrent writers and readers never observe partial entries.
+The on-disk store can be filled ahead of time for a whole pseudopotential
+library with `precompile_pseudos` (``verdi data sirius precompile``).
+"""
+from __future__ import absolute_import
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .upf_to_json import upf_stream_to_json, CONVERTER_VERSION
+from .exceptions import UpfParseError
+from .serialize import dump_pseudo
+
+#: environment variable to override the location of the on-disk cache
+CACHE_DIR_ENV = 'AIIDA_SIRIUS_PSEUDO_CACHE'
+#: age in seconds after which an abandoned temporary file may be removed by the eviction
+TMP_GRACE_PERIOD = 3600
+
+
+def default_cache_dir():
+    """Location of the on-disk pseudopotential cache.
+
+    Uses ``$AIIDA_SIRIUS_PSEUDO_CACHE`` if set, otherwise
+    ``$XDG_CACHE_HOME/aiida-sirius/pseudos`` (``~/.cache`` by default).
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'aiida-sirius', 'pseudos')
+
+
+class PseudoCache(object):
+    """Two-tier (memory, disk) cache of converted pseudopotentials.
+
+    :param cache_dir: directory of the on-disk tier, `None` disables the disk tier
+    :param max_entries: number of pseudopotentials kept in memory (LRU eviction)
+    :param max_disk_bytes: size limit of the on-disk tier, least recently used
+        files are evicted once the limit is exceeded. The size is tracked per
+        process (scanned once, then updated on every write), the directory is
+        only scanned again when the tracked size exceeds the limit.
+    :param version: converter version, part of the cache key
+    """
+
+    def __init__(self, cache_dir=None, max_entries=64, max_disk_bytes=2 * 1024**3, version=CONVERTER_VERSION):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.version = version
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # size of the on-disk tier, `None` until scanned
+        self._disk_bytes = None
+
+    @property
+    def version_dir(self):
+        """Directory holding the entries of the current converter version."""
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, 'v{}'.format(self.version))
+
+    def path(self, md5):
+        """Path of the on-disk entry for `md5`."""
+        return os.path.join(self.version_dir, md5 + '.json')
+
+    def get(self, md5):
+        """Return the converted pseudopotential or `None` if not cached."""
+        with self._lock:
+            if md5 in self._memory:
+                self._memory.move_to_end(md5)
+                return self._memory[md5]
+
+        if self.cache_dir is None:
+            return None
+        path = self.path(md5)
+        try:
+            with open(path, 'r') as fh:
+                pp_dict = json.load(fh)
+        except (IOError, OSError, ValueError):
+            # missing, evicted by another process or corrupted
+            return None
+        try:
+            # mark as recently used for the disk eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        self._remember(md5, pp_dict)
+        return pp_dict
+
+    def put(self, md5, pp_dict):
+        """Add a converted pseudopotential to both tiers."""
+        self._remember(md5, pp_dict)
+        if self.cache_dir is None:
+            return
+        version_dir = self.version_dir
+        if not os.path.isdir(version_dir):
+            os.makedirs(version_dir, exist_ok=True)
+        path = self.path(md5)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=version_dir, prefix='.' + md5, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                dump_pseudo(pp_dict, fh)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += size - replaced
+            exceeded = self._disk_bytes > self.max_disk_bytes
+        if exceeded:
+            self.evict()
+
+    def _remember(self, md5, pp_dict):
+        with self._lock:
+            self._memory[md5] = pp_dict
+            self._memory.move_to_end(md5)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_entries(self, tmp_grace_period=TMP_GRACE_PERIOD):
+        """List of (mtime, size, path) of all files in the on-disk tier.
+
+        Temporary files (``*.tmp``) are being written by other processes and
+        are skipped, unless they are older than `tmp_grace_period` seconds
+        (left behind by a killed process).
+        """
+        entries = []
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return entries
+        abandoned = time.time() - tmp_grace_period
+        for root, _, files in os.walk(self.cache_dir):
+            for fname in files:
+                path = os.path.join(root, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if fname.endswith('.tmp') and stat.st_mtime > abandoned:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used files until the disk tier fits into `max_disk_bytes`."""
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed concurrently
+                pass
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        """Drop all entries from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+        for _, _, path in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = None
+
+
+def _with_filename(pp_dict, fname):
+    """Shallow copy of `pp_dict` with `original_upf_file` set to `fname`.
+
+    Cached dictionaries are shared, hence they must not be modified in place.
+    """
+    pseudo_potential = dict(pp_dict['pseudo_potential'])
+    header = dict(pseudo_potential['header'])
+    header['original_upf_file'] = fname
+    pseudo_potential['header'] = header
+    return {'pseudo_potential': pseudo_potential}
+
+
+_PSEUDO_CACHE = None
+
+
+def get_pseudo_cache():
+    """Return the process wide `PseudoCache`."""
+    global _PSEUDO_CACHE  # pylint: disable=global-statement
+    if _PSEUDO_CACHE is None:
+        _PSEUDO_CACHE = PseudoCache(cache_dir=default_cache_dir())
+    return _PSEUDO_CACHE
+
+
+def upf_data_to_json(upf, cache=None):
+    """Convert a `UpfData` node to the SIRIUS json format, using the pseudopotential cache.
+
+    :param upf: `aiida.orm.UpfData` node
+    :param cache: `PseudoCache` instance, defaults to `get_pseudo_cache()`
+    :returns: dictionary {'pseudo_potential': ...}
+    """
+    if cache is None:
+        cache = get_pseudo_cache()
+    pp_dict = cache.get(upf.md5sum)
+    if pp_dict is None:
+        # stream the file, large UPF v2 files are never held in memory at once
+        with upf.open(mode='rb') as fh:
+            pp_dict = upf_stream_to_json(fh, fname=upf.filename)
+        if pp_dict is None:
+            raise ValueError('{} is not a valid UPF file'.format(upf.filename))
+        cache.put(upf.md5sum, pp_dict)
+    return _with_filename(pp_dict, upf.filename)
+
+
+def _source_name(source):
+    return source[1] if isinstance(source, tuple) else os.path.basename(source)
+
+
+def _precompile_one(cache_dir, source, force):
+    """Convert a single UPF file into the on-disk store (runs in a worker process).
+
+    Errors are reported per file, a malformed file never aborts the whole run.
+
+    :param source: path of a UPF file or tuple (content as bytes, filename)
+    :returns: tuple (filename, md5, status), status is 'converted', 'cached' or an error message
+    """
+    fname, md5 = _source_name(source), None
+    try:
+        if isinstance(source, tuple):
+            content = source[0]
+        else:
+            with open(source, 'rb') as fh:
+                content = fh.read()
+        md5 = hashlib.md5(content).hexdigest()
+        # the memory tier is useless in a worker
+        cache = PseudoCache(cache_dir=cache_dir, max_entries=0)
+        if not force and os.path.isfile(cache.path(md5)):
+            return fname, md5, 'cached'
+        pp_dict = upf_stream_to_json(io.BytesIO(content), fname=fname)
+        if pp_dict is None:
+            raise UpfParseError('unknown UPF version')
+        cache.put(md5, pp_dict)
+    except (UpfParseError, ET.ParseError) as exception:
+        return fname, md5, 'failed: {}'.format(exception)
+    except Exception as exception:  # pylint: disable=broad-except
+        # e.g. IndexError or TypeError from a malformed v1 header
+        return fname, md5, 'failed: {}: {}'.format(type(exception).__name__, exception)
+    return fname, md5, 'converted'
+
+
+def precompile_pseudos(sources, cache_dir=None, processes=None, force=False):
+    """Convert many UPF files in parallel and add them to the on-disk cache.
+
+    Subsequent calls of `upf_data_to_json` (and hence all Sirius calculations)
+    find the converted files by md5 and skip the conversion.
+
+    :param sources: iterable of file paths or tuples (content as bytes, filename)
+    :param cache_dir: cache directory, defaults to `default_cache_dir()`
+    :param processes: number of worker processes (default: number of cpus)
+    :param force: convert again even if already cached
+    :returns: generator of tuples (filename, md5, status) in order of completion
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(_precompile_one, cache_dir, source, force): source for source in sources}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as exception:  # pylint: disable=broad-except
+                # the worker died (e.g. BrokenProcessPool)
+                yield _source_name(futures[future]), None, 'failed: {}: {}'.format(type(exception).__name__, exception)
@@ -0,0 +1,2 @@
+class UpfParseError(ValueError):
+    """Raised if a UPF file is truncated, malformed or not supported."""
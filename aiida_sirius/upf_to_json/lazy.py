@@ -0,0 +1,188 @@
+"""
+Pseudopotential with on-demand decoding of its sections.
+
+`LazyPseudo` scans a UPF file once for the positions of its sections and
+decodes an entry of the SIRIUS pseudopotential dictionary (e.g. 'header',
+'radial_grid' or 'beta_projectors') only when it is accessed. Entries are
+kept as numpy arrays; `to_dict` assembles the same dictionary as
+`upf_to_json`.
+"""
+import re
+import xml.etree.ElementTree as ET
+
+from .arrays import arrays_to_lists
+from .exceptions import UpfParseError
+from .upf_to_json import get_upf_version
+from . import upf1_to_json, upf2_to_json
+
+_UPF2_TAG_RE = re.compile(r'<(/?)(PP_[A-Za-z0-9_.]+)[^>]*?(/?)>')
+
+
+def _parse_upf2_non_local(upf_dict, index):
+    upf2_to_json.parse_non_local(upf_dict, index)
+    upf2_to_json.parse_SpinOrbit(upf_dict, index)
+
+
+# entry -> (parser, UPF v2 sections read by the parser, entries needed by the parser),
+# in the order of the entries in the converted dictionary
+_UPF2_ENTRIES = [
+    ('header', (upf2_to_json.parse_header, ('PP_HEADER',), ())),
+    ('radial_grid', (upf2_to_json.parse_radial_grid, ('PP_MESH',), ())),
+    ('core_charge_density', (upf2_to_json.parse_nlcc, ('PP_NLCC',), ())),
+    ('local_potential', (upf2_to_json.parse_local, ('PP_LOCAL',), ())),
+    ('beta_projectors', (_parse_upf2_non_local, ('PP_NONLOCAL', 'PP_SPIN_ORB'), ())),
+    ('D_ion', (_parse_upf2_non_local, ('PP_NONLOCAL', 'PP_SPIN_ORB'), ())),
+    ('augmentation', (_parse_upf2_non_local, ('PP_NONLOCAL', 'PP_SPIN_ORB'), ())),
+    ('paw_data', (upf2_to_json.parse_PAW, ('PP_NONLOCAL', 'PP_FULL_WFC', 'PP_PAW'), ())),
+    ('atomic_wave_functions', (upf2_to_json.parse_pswfc, ('PP_PSWFC', 'PP_SPIN_ORB'), ())),
+    ('total_charge_density', (upf2_to_json.parse_rhoatom, ('PP_RHOATOM',), ())),
+]
+
+_UPF1_ENTRIES = [
+    ('header', (upf1_to_json.parse_header, (), ())),
+    ('radial_grid', (upf1_to_json.parse_mesh, (), ())),
+    ('core_charge_density', (upf1_to_json.parse_nlcc, (), ())),
+    ('local_potential', (upf1_to_json.parse_local, (), ())),
+    ('beta_projectors', (upf1_to_json.parse_non_local, (), ('radial_grid',))),
+    ('D_ion', (upf1_to_json.parse_non_local, (), ('radial_grid',))),
+    ('augmentation', (upf1_to_json.parse_non_local, (), ('radial_grid',))),
+    ('atomic_wave_functions', (upf1_to_json.parse_pswfc, (), ())),
+    ('total_charge_density', (upf1_to_json.parse_rhoatom, (), ())),
+]
+
+
+def upf2_section_offsets(upf2_str):
+    """Return {section: (start, end)} of the top level sections of a UPF v2 string."""
+    offsets = {}
+    depth = 0
+    start = None
+    for match in _UPF2_TAG_RE.finditer(upf2_str):
+        closing, tag, empty = match.groups()
+        if closing:
+            depth -= 1
+            if depth == 0:
+                offsets.setdefault(tag, (start, match.end()))
+        elif empty:
+            if depth == 0:
+                offsets.setdefault(tag, (match.start(), match.end()))
+        else:
+            if depth == 0:
+                start = match.start()
+            depth += 1
+    return offsets
+
+
+class LazyPseudo(object):
+    """Pseudopotential from a UPF (v1 or v2) file, decoded per entry on first access.
+
+    Entries are accessed like a dictionary, e.g. ``pseudo['header']`` or
+    ``pseudo['atomic_wave_functions']``, and are numpy arrays (or lists and
+    dictionaries of numpy arrays). Only the sections of the file needed for an
+    entry are decoded. The PAW entries 'cutoff_radius_index' and
+    'paw_core_energy' are added to the header by `to_dict` only.
+
+    :param upf_str: content of the UPF file
+    :param fname: file name, stored as 'original_upf_file' by `to_dict`
+    """
+
+    def __init__(self, upf_str, fname=None):
+        self.fname = fname
+        self.version = get_upf_version(upf_str)
+        if self.version == 1:
+            self._source = upf1_to_json.UpfSections(upf_str)
+            self._entries = dict(_UPF1_ENTRIES)
+            self._order = [key for key, _ in _UPF1_ENTRIES]
+        elif self.version == 2:
+            self._upf_str = upf_str
+            self._offsets = upf2_section_offsets(upf_str)
+            self._source = upf2_to_json.UpfIndex()
+            self._loaded = set()
+            self._entries = dict(_UPF2_ENTRIES)
+            self._order = [key for key, _ in _UPF2_ENTRIES]
+        else:
+            raise UpfParseError('Unknown UPF version')
+        self._values = {}
+        # header entries written by other parsers (e.g. PAW)
+        self._header_updates = {}
+
+    @classmethod
+    def from_upf_data(cls, upf):
+        """Create from a `UpfData` node."""
+        with upf.open(mode='r') as handle:
+            return cls(handle.read(), fname=upf.filename)
+
+    @property
+    def header(self):
+        """Header dictionary, see `probe_upf` for the entries."""
+        return self['header']
+
+    def _load_sections(self, sections):
+        for section in sections:
+            if section in self._loaded or section not in self._offsets:
+                continue
+            start, end = self._offsets[section]
+            root = ET.Element('UPF')
+            root.append(ET.fromstring(self._upf_str[start:end].replace('&', '')))
+            self._source.extend(root)
+            self._loaded.add(section)
+
+    def _available(self, key):
+        """Whether the converted dictionary has the entry `key`."""
+        if key not in self._entries:
+            return False
+        if key == 'header':
+            return True
+        header = self.header
+        if key == 'core_charge_density':
+            return bool(header['core_correction'])
+        if key == 'augmentation':
+            if self.version == 1:
+                return header['pseudo_type'] == 'US'
+            return header['is_ultrasoft']
+        if key == 'paw_data':
+            return self.version == 2 and header['pseudo_type'] == 'PAW'
+        return True
+
+    def keys(self):
+        """Entries of the converted dictionary, in the same order."""
+        return [key for key in self._order if self._available(key)]
+
+    def __contains__(self, key):
+        return self._available(key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in self:
+            raise KeyError('pseudopotential has no entry {}'.format(key))
+        parser, sections, needs = self._entries[key]
+        upf_dict = {}
+        if key != 'header':
+            upf_dict['header'] = dict(self.header, **self._header_updates)
+        for need in needs:
+            upf_dict[need] = self[need]
+        if self.version == 2:
+            self._load_sections(sections)
+        parser(upf_dict, self._source)
+        for name, value in upf_dict.items():
+            if name == 'header' and key != 'header':
+                self._header_updates.update(
+                    (item, value[item]) for item in value if value[item] != self.header.get(item))
+            elif name not in needs:
+                self._values.setdefault(name, value)
+        return self._values[key]
+
+    def to_dict(self, as_arrays=False):
+        """Decode all entries and return the dictionary {'pseudo_potential': ...} of `upf_to_json`.
+
+        :param as_arrays: keep radial functions as numpy arrays instead of lists
+        """
+        upf_dict = {key: self[key] for key in self.keys()}
+        upf_dict['header'] = dict(self.header, **self._header_updates)
+        upf_dict['header']['original_upf_file'] = self.fname
+        if not as_arrays:
+            upf_dict = arrays_to_lists(upf_dict)
+        return {'pseudo_potential': upf_dict}
@@ -0,0 +1,102 @@
+"""
+Fast probe of the header of UPF files.
+
+Reads only the beginning of a file (up to the end of PP_HEADER) and returns
+the same header dictionary as the full conversion, e.g. for pseudopotential
+discovery, validation or cost estimates.
+"""
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import unescape
+
+from .exceptions import UpfParseError
+from .upf_to_json import get_upf_version
+from . import upf1_to_json, upf2_to_json
+
+_UPF2_HEADER_RE = re.compile(r'<PP_HEADER\b([^>]*)>', re.DOTALL)
+_ATTRIBUTE_RE = re.compile(r'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+
+def _header_element(attributes):
+    """PP_HEADER element from the attributes of its start tag.
+
+    The tag is parsed with ElementTree (quoting and entities as in the full
+    conversion), tags ElementTree rejects fall back to a lenient scan.
+    """
+    try:
+        return ET.fromstring('<PP_HEADER {}/>'.format(attributes.strip().rstrip('/')))
+    except ET.ParseError:
+        values = {name: unescape(double or single, _ENTITIES)
+                  for name, double, single in _ATTRIBUTE_RE.findall(attributes)}
+        return ET.Element('PP_HEADER', values)
+
+
+def _header_complete(head, version):
+    if version == 1:
+        return '</PP_HEADER>' in head
+    return _UPF2_HEADER_RE.search(head) is not None
+
+
+def probe_upf_string(head):
+    """Parse the header from the beginning of a UPF file.
+
+    :param head: string, beginning of the file including the whole PP_HEADER
+    :returns: header dictionary, with additional entry 'upf_version'
+    :raises UpfParseError: if the version is unknown or the header incomplete
+    """
+    version = get_upf_version(head)
+    if version == 0:
+        raise UpfParseError('Unknown UPF version')
+    if not _header_complete(head, version):
+        raise UpfParseError('PP_HEADER not found')
+
+    upf_dict = {}
+    if version == 1:
+        upf1_to_json.parse_header(upf_dict, upf1_to_json.UpfSections(head))
+    else:
+        attributes = _UPF2_HEADER_RE.search(head).group(1)
+        index = upf2_to_json.UpfIndex()
+        index.add('PP_HEADER', _header_element(attributes))
+        try:
+            upf2_to_json.parse_header(upf_dict, index)
+        except KeyError as exception:
+            raise UpfParseError('PP_HEADER is missing attribute {}'.format(exception))
+    header = upf_dict['header']
+    header['upf_version'] = version
+    return header
+
+
+def probe_upf(handle, chunk_size=4096, max_bytes=2**20):
+    """Read the header of a UPF file from an open file handle.
+
+    Only the beginning of the file is read, in chunks of `chunk_size`, until
+    PP_HEADER is complete (PP_INFO precedes the header and can be long).
+
+    :param handle: file handle, binary or text mode
+    :param max_bytes: give up if the header is not found within this many bytes
+    :returns: header dictionary (element, pseudo_type, z_valence, mesh_size,
+        number_of_proj, number_of_wfc, core_correction, ...) and 'upf_version'
+    """
+    head = b''
+    while len(head) < max_bytes:
+        chunk = handle.read(chunk_size)
+        if not chunk:
+            break
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        head += chunk
+        head_str = head.decode('utf-8', 'ignore')
+        version = get_upf_version(head_str)
+        if version and _header_complete(head_str, version):
+            break
+        if version == 0 and head_str.count('\n') > 1:
+            # not a UPF file
+            break
+    return probe_upf_string(head.decode('utf-8', 'ignore'))
+
+
+def probe_upf_data(upf, **kwargs):
+    """Probe the header of a `UpfData` node, see `probe_upf`."""
+    with upf.open(mode='rb') as handle:
+        return probe_upf(handle, **kwargs)
@@ -0,0 +1,133 @@
+"""
+Compact json writer for pseudopotential dictionaries.
+
+Lists of floats (radial functions) make up almost all of a converted
+pseudopotential. The output has no whitespace and numpy arrays are written
+directly. With a reduced number of digits the float lists are formatted in
+one go instead of element by element.
+"""
+import io
+import json
+
+import numpy as np
+
+
+_SEPARATORS = (',', ':')
+
+
+def _default(obj):
+    """Convert numpy types for the json encoder."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _format_numbers(values, fmt):
+    """Format a flat list or array of floats as the body of a json array, or return `None`."""
+    array = np.asarray(values)
+    if array.ndim != 1 or array.dtype.kind != 'f' or not np.isfinite(array).all():
+        # nested, integer or non-finite (NaN / Infinity) values go through the encoder
+        return None
+    if isinstance(values, np.ndarray):
+        values = values.tolist()
+    return ','.join(map(fmt.__mod__, values))
+
+
+def _write(obj, write, fmt):
+    if isinstance(obj, dict):
+        write('{')
+        for i, (key, value) in enumerate(obj.items()):
+            if i > 0:
+                write(',')
+            write(json.dumps(str(key)))
+            write(':')
+            _write(value, write, fmt)
+        write('}')
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        body = _format_numbers(obj, fmt) if len(obj) > 0 else ''
+        if body is None:
+            write('[')
+            for i, value in enumerate(obj):
+                if i > 0:
+                    write(',')
+                _write(value, write, fmt)
+            write(']')
+        else:
+            write('[' + body + ']')
+    elif isinstance(obj, (float, np.floating)) and np.isfinite(obj):
+        write(fmt % obj)
+    else:
+        write(json.dumps(obj, default=_default))
+
+
+def _iter_json(obj, encode, depth):
+    """Yield the json of `obj` in pieces, splitting dictionaries and lists of dictionaries `depth` levels deep."""
+    if depth > 0 and isinstance(obj, dict):
+        yield '{'
+        for i, (key, value) in enumerate(obj.items()):
+            yield (',' if i > 0 else '') + encode(str(key)) + ':'
+            for chunk in _iter_json(value, encode, depth - 1):
+                yield chunk
+        yield '}'
+    elif depth > 0 and isinstance(obj, (list, tuple)) and len(obj) > 0 and isinstance(obj[0], dict):
+        yield '['
+        for i, item in enumerate(obj):
+            if i > 0:
+                yield ','
+            for chunk in _iter_json(item, encode, depth - 1):
+                yield chunk
+        yield ']'
+    else:
+        yield encode(obj)
+
+
+def dump_pseudo(pp_dict, fh, precision=None):
+    """Write a converted pseudopotential as compact json to the file handle `fh`.
+
+    The output is written in pieces (one radial function at a time), the
+    complete json string is never held in memory.
+
+    :param pp_dict: dictionary as returned by `upf_to_json`, radial functions
+        may be lists or numpy arrays
+    :param precision: number of significant digits of floats, `None` writes
+        the shortest representation which reads back to the identical value
+    """
+    if precision is None:
+        # the C encoder of the json module is fastest for full precision
+        encode = json.JSONEncoder(separators=_SEPARATORS, default=_default).encode
+        for chunk in _iter_json(pp_dict, encode, depth=4):
+            fh.write(chunk)
+    else:
+        _write(pp_dict, fh.write, '%.{}g'.format(int(precision)))
+
+
+class _JsonStringWriter(object):
+    """File-like object escaping everything written for the inside of a json string."""
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def write(self, text):
+        self.fh.write(json.dumps(text)[1:-1])
+
+
+def dump_pseudo_string(pp_dict, fh, precision=None):
+    """Write a converted pseudopotential as json string literal to `fh`.
+
+    The result equals ``json.dumps(dumps_pseudo(pp_dict))`` (e.g. for the
+    `atom_files` of sirius.json) but is escaped piece by piece while writing.
+    """
+    fh.write('"')
+    dump_pseudo(pp_dict, _JsonStringWriter(fh), precision=precision)
+    fh.write('"')
+
+
+def dumps_pseudo(pp_dict, precision=None):
+    """Return a converted pseudopotential as compact json string, see `dump_pseudo`."""
+    if precision is None:
+        return json.dumps(pp_dict, separators=_SEPARATORS, default=_default)
+    buf = io.StringIO()
+    dump_pseudo(pp_dict, buf, precision=precision)
+    return buf.getvalue()
@@ -17,34 +17,122 @@
 # CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import json
+
+import bisect
 import sys
 import re
-import io
-
-def read_until(fin, tag):
-    while True:
-        line = fin.readline()
-        if not line:
-            print ("Unexpected end of file")
-            sys.exit(-1)
-        if tag in line: return
-
-def read_mesh_data(in_file, npoints):
-    out_data = []
-    while True:
-        s = in_file.readline().split()
-        for k in range(len(s)): out_data.append(float(s[k]))
-        if len(out_data) == npoints: break
-    return out_data
-
-def parse_header(upf_dict, upf_str):
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from .arrays import parse_float_array, arrays_to_lists
+from .exceptions import UpfParseError
+from .serialize import dump_pseudo
+
+_TAG_RE = re.compile(r'</?PP_[A-Za-z0-9_.]+>')
+
+
+class UpfSections(object):
+    """Single-pass scanner of a UPF v1 string.
+
+    The positions of all <PP_*> and </PP_*> tags are recorded once. Readers
+    keep a cursor (character offset) into the string, `read_until` jumps to the
+    line following the next occurrence of a tag instead of scanning line by
+    line.
+    """
+
+    def __init__(self, upf_str):
+        self.upf_str = upf_str
+        self.offsets = defaultdict(list)
+        for match in _TAG_RE.finditer(upf_str):
+            self.offsets[match.group()].append(match.start())
+
+    def cursor(self, tag=None):
+        """Return a new cursor, positioned after the line containing `tag` (if given)."""
+        cursor = UpfCursor(self)
+        if tag is not None:
+            cursor.read_until(tag)
+        return cursor
+
+
+class UpfCursor(object):
+    """Line based reader on top of `UpfSections`."""
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.upf_str = sections.upf_str
+        self.pos = 0
+
+    def readline(self):
+        """Return the next line (without newline), '' at the end of the string."""
+        if self.pos >= len(self.upf_str):
+            return ''
+        end = self.upf_str.find('\n', self.pos)
+        if end < 0:
+            end = len(self.upf_str)
+        line = self.upf_str[self.pos:end]
+        self.pos = end + 1
+        return line
+
+    def _skip_lines(self, num):
+        """Position after skipping `num` lines, -1 if the string ends before."""
+        pos = self.pos
+        for _ in range(num):
+            if pos >= len(self.upf_str):
+                return -1
+            end = self.upf_str.find('\n', pos)
+            pos = len(self.upf_str) if end < 0 else end + 1
+        return pos
+
+    def read_until(self, tag):
+        """Move to the line after the next line containing `tag`."""
+        offsets = self.sections.offsets.get(tag, [])
+        k = bisect.bisect_left(offsets, self.pos)
+        if k == len(offsets):
+            raise UpfParseError('Unexpected end of file: {} not found'.format(tag))
+        end = self.upf_str.find('\n', offsets[k])
+        self.pos = len(self.upf_str) if end < 0 else end + 1
+
+    def read_mesh_data(self, npoints):
+        """Read the next `npoints` numbers as a float64 array.
+
+        Assumes that all lines of the block have as many columns as the first
+        one and decodes the whole block at once, falls back to reading line by
+        line otherwise.
+        """
+        start = self.pos
+        first = self.readline()
+        self.pos = start
+        ncol = len(first.split())
+        if ncol > 0:
+            end = self._skip_lines(int(math.ceil(npoints / float(ncol))))
+            if end > 0:
+                try:
+                    values = parse_float_array(self.upf_str[start:end])
+                except ValueError:
+                    values = None
+                if values is not None and len(values) == npoints:
+                    self.pos = end
+                    return values
+
+        out_data = []
+        while len(out_data) < npoints:
+            line = self.readline()
+            if not line and self.pos >= len(self.upf_str):
+                raise UpfParseError('Unexpected end of file while reading {} points'.format(npoints))
+            out_data.extend(float(e) for e in line.split())
+        if len(out_data) != npoints:
+            raise UpfParseError('Expected {} points, found {}'.format(npoints, len(out_data)))
+        return np.array(out_data)
+
+
+def parse_header(upf_dict, sections):
 
     #print "parsing header"
 
     upf_dict["header"] = {}
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_HEADER>")
+    upf = sections.cursor("<PP_HEADER>")
 
     s = upf.readline().split()
     #upf_dict["header"]["version"] = int(s[0]);
@@ -81,8 +169,6 @@ def parse_header(upf_dict, upf_str):
     upf_dict["header"]["number_of_wfc"] = int(s[0])
     upf_dict['header']['number_of_proj'] = int(s[1])
 
-    upf.readline()
-
     #upf_dict["header"]["wavefunctions"] = []
     #for i in range(upf_dict["header"]["nwfc"]):
     #    upf_dict["header"]["wavefunctions"].append({})
@@ -91,87 +177,73 @@ def parse_header(upf_dict, upf_str):
     #    upf_dict["header"]["wavefunctions"][i]["lchi"] = int(s[1])
     #    upf_dict["header"]["wavefunctions"][i]["oc"] = float(s[2])
 
-    upf.close();
-
 #
 # QE subroutine read_pseudo_mesh
 #
-def parse_mesh(upf_dict, upf_str):
+def parse_mesh(upf_dict, sections):
 
     #print "parsing mesh"
 
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_R>")
+    upf = sections.cursor("<PP_R>")
 
     # =================================================================
     # call scan_begin (iunps, "R", .false.)
     # read (iunps, *, err = 100, end = 100) (upf%r(ir), ir=1,upf%mesh )
     # call scan_end (iunps, "R")
     # =================================================================
-    upf_dict['radial_grid'] = read_mesh_data(upf, upf_dict['header']['mesh_size'])
+    upf_dict['radial_grid'] = upf.read_mesh_data(upf_dict['header']['mesh_size'])
 
-    read_until(upf, "<PP_RAB>")
+    upf.read_until("<PP_RAB>")
 
     # ===================================================================
     # call scan_begin (iunps, "RAB", .false.)
     # read (iunps, *, err = 101, end = 101) (upf%rab(ir), ir=1,upf%mesh )
     # call scan_end (iunps, "RAB")
     # ===================================================================
-    #upf_dict["mesh"]["rab"] = read_mesh_data(upf, upf_dict["header"]["nmesh"])
-
-    upf.close()
+    #upf_dict["mesh"]["rab"] = upf.read_mesh_data(upf_dict["header"]["nmesh"])
 
 #
 # QE subroutine read_pseudo_nlcc
 #
-def parse_nlcc(upf_dict, upf_str):
+def parse_nlcc(upf_dict, sections):
 
     #print "parsing nlcc"
 
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_NLCC>")
+    upf = sections.cursor("<PP_NLCC>")
 
     # =======================================================================
     # ALLOCATE( upf%rho_atc( upf%mesh ) )
     # read (iunps, *, err = 100, end = 100) (upf%rho_atc(ir), ir=1,upf%mesh )
     # =======================================================================
-    upf_dict['core_charge_density'] = read_mesh_data(upf, upf_dict['header']['mesh_size'])
-
-    upf.close()
+    upf_dict['core_charge_density'] = upf.read_mesh_data(upf_dict['header']['mesh_size'])
 
 #
 # QE subroutine read_pseudo_local
 #
-def parse_local(upf_dict, upf_str):
+def parse_local(upf_dict, sections):
 
     #print "parsing local"
 
-    upf_dict['local_potential'] = []
-    upf = io.StringIO(upf_str)
-
-    read_until(upf, "<PP_LOCAL>")
+    upf = sections.cursor("<PP_LOCAL>")
 
     # =================================================================
     # ALLOCATE( upf%vloc( upf%mesh ) )
     # read (iunps, *, err=100, end=100) (upf%vloc(ir) , ir=1,upf%mesh )
     # =================================================================
-    vloc = read_mesh_data(upf, upf_dict['header']['mesh_size'])
-    upf_dict['local_potential'] = [v / 2 for v in vloc]
-
-    upf.close()
+    vloc = upf.read_mesh_data(upf_dict['header']['mesh_size'])
+    upf_dict['local_potential'] = vloc / 2
 
 #
 # QE subroutine read_pseudo_nl
 #
-def parse_non_local(upf_dict, upf_str):
+def parse_non_local(upf_dict, sections):
 
     #print "parsing non-local"
 
     upf_dict['beta_projectors'] = []
     upf_dict['D_ion'] = []
 
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_NONLOCAL>")
+    upf = sections.cursor("<PP_NONLOCAL>")
 
     # ======================================================================
     #   do nb = 1, upf%nbeta
@@ -189,7 +261,7 @@ def parse_non_local(upf_dict, upf_str):
     #   enddo
     # ======================================================================
     for i in range(upf_dict['header']['number_of_proj']):
-        read_until(upf, "<PP_BETA>")
+        upf.read_until("<PP_BETA>")
         upf_dict['beta_projectors'].append({})
         upf_dict['beta_projectors'][i]['label'] = ''
         s = upf.readline().split()
@@ -197,9 +269,9 @@ def parse_non_local(upf_dict, upf_str):
         s = upf.readline()
         #upf_dict['beta_projectors'][i]['cutoff_radius_index'] = int(s)
         nr = int(s)
-        beta = read_mesh_data(upf, nr)
+        beta = upf.read_mesh_data(nr)
 
-        upf_dict['beta_projectors'][i]['radial_function'] = beta #read_mesh_data(upf, upf_dict['beta_projectors'][i]['cutoff_radius_index'])
+        upf_dict['beta_projectors'][i]['radial_function'] = beta
 
         upf_dict['beta_projectors'][i]['cutoff_radius'] = 0.0
         upf_dict['beta_projectors'][i]['ultrasoft_cutoff_radius'] = 0.0
@@ -223,7 +295,7 @@ def parse_non_local(upf_dict, upf_str):
     # ================================================================
     nb = upf_dict['header']['number_of_proj']
     dij = [0 for i in range(nb * nb)]
-    read_until(upf, "<PP_DIJ>")
+    upf.read_until("<PP_DIJ>")
     s = upf.readline().split()
     nd = int(s[0])
     for k in range(nd):
@@ -244,7 +316,7 @@ def parse_non_local(upf_dict, upf_str):
     # read (iunps, *, err = 102, end = 102) upf%nqf
     # upf%nqlc = 2 * upf%lmax  + 1
     # =============================================
-    read_until(upf, "<PP_QIJ>")
+    upf.read_until("<PP_QIJ>")
     s = upf.readline().split()
     num_q_coef = int(s[0])
     #nqlc = upf_dict['header']['l_max'] * 2 + 1
@@ -258,11 +330,11 @@ def parse_non_local(upf_dict, upf_str):
     # =======================================================================
     if num_q_coef != 0:
         R_inner = []
-        read_until(upf, "<PP_RINNER>")
+        upf.read_until("<PP_RINNER>")
         for i in range(2 * upf_dict['header']['l_max'] + 1):
             s = upf.readline().split()
             R_inner.append(float(s[1]))
-        read_until(upf, "</PP_RINNER>")
+        upf.read_until("</PP_RINNER>")
 
     # ==================================================================================
     # do nb = 1, upf%nbeta
@@ -291,6 +363,8 @@ def parse_non_local(upf_dict, upf_str):
 
     nb = upf_dict['header']['number_of_proj']
     l_max = upf_dict['header']['l_max']
+    radial_grid = upf_dict['radial_grid']
+    radial_grid_list = radial_grid.tolist()
 
     for i in range(nb):
         li = upf_dict['beta_projectors'][i]['angular_momentum']
@@ -299,16 +373,14 @@ def parse_non_local(upf_dict, upf_str):
 
             s = upf.readline().split()
             if int(s[2]) != lj:
-                print("inconsistent angular momentum")
-                sys.exit(-1)
+                raise UpfParseError("inconsistent angular momentum")
 
             if int(s[0]) != i + 1 or int(s[1]) != j + 1:
-                print("inconsistent ij indices")
-                sys.exit(-1)
+                raise UpfParseError("inconsistent ij indices")
 
             s = upf.readline().split()
 
-            qij = read_mesh_data(upf, upf_dict['header']['mesh_size'])
+            qij = upf.read_mesh_data(upf_dict['header']['mesh_size'])
 
 
             # ======================================================================
@@ -325,26 +397,26 @@ def parse_non_local(upf_dict, upf_str):
             # end if
             #=======================================================================
             if num_q_coef > 0:
-                read_until(upf, "<PP_QFCOEF>")
+                upf.read_until("<PP_QFCOEF>")
 
-                q_coefs = read_mesh_data(upf, num_q_coef * (2 * l_max + 1))
+                q_coefs_list = upf.read_mesh_data(num_q_coef * (2 * l_max + 1)).tolist()
 
-                read_until(upf, "</PP_QFCOEF>")
+                upf.read_until("</PP_QFCOEF>")
 
             if num_q_coef > 0:
                 # constuct Qij(r) for each l
                 for l in range(abs(li-lj), li+lj+1):
                     if (li + lj + l) % 2 == 0:
-                        qij_fixed = [qij[k] for k in range(upf_dict['header']['mesh_size'])]
+                        qij_fixed = qij.copy()
 
-                        for ir in range(upf_dict['header']['mesh_size']):
-                            x = upf_dict['radial_grid'][ir]
+                        # python floats, numpy's power differs from libm in the last bit
+                        for ir in np.flatnonzero(radial_grid < R_inner[l]):
+                            x = radial_grid_list[ir]
                             x2 = x * x
-                            if x < R_inner[l]:
-                                qij_fixed[ir] = q_coefs[0 + l * num_q_coef]
-                                for n in range(1, num_q_coef):
-                                    qij_fixed[ir] += q_coefs[n + l * num_q_coef] * x2**n;
-                                qij_fixed[ir] *= x**(l + 2);
+                            q = q_coefs_list[0 + l * num_q_coef]
+                            for n in range(1, num_q_coef):
+                                q += q_coefs_list[n + l * num_q_coef] * x2**n
+                            qij_fixed[ir] = q * x**(l + 2)
 
                         qij_dict = {}
                         qij_dict['radial_function'] = qij_fixed
@@ -354,20 +426,16 @@ def parse_non_local(upf_dict, upf_str):
                         upf_dict['augmentation'].append(qij_dict)
 
 
-    upf.close()
-
-
 #
 # QE subroutine read_pseudo_pswfc
 #
-def parse_pswfc(upf_dict, upf_str):
+def parse_pswfc(upf_dict, sections):
 
     #print "parsing wfc"
 
     upf_dict['atomic_wave_functions'] = []
 
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_PSWFC>")
+    upf = sections.cursor("<PP_PSWFC>")
 
     # =======================================================================
     # ALLOCATE( upf%chi( upf%mesh, MAX( upf%nwfc, 1 ) ) )
@@ -384,38 +452,44 @@ def parse_pswfc(upf_dict, upf_str):
         wf['angular_momentum'] = int(s[1])
         wf['occupation'] = float(s[2])
 
-        wf['radial_function'] = read_mesh_data(upf, upf_dict['header']['mesh_size'])
+        wf['radial_function'] = upf.read_mesh_data(upf_dict['header']['mesh_size'])
         upf_dict['atomic_wave_functions'].append(wf)
-    upf.close()
 
 #
 # QE subroutine read_pseudo_rhoatom
 #
-def parse_rhoatom(upf_dict, upf_str):
+def parse_rhoatom(upf_dict, sections):
 
     #print "parsing rhoatm"
-    upf = io.StringIO(upf_str)
-    read_until(upf, "<PP_RHOATOM>")
+    upf = sections.cursor("<PP_RHOATOM>")
 
     # ================================================================
     # ALLOCATE( upf%rho_at( upf%mesh ) )
     # read (iunps,*,err=100,end=100) ( upf%rho_at(ir), ir=1,upf%mesh )
     # ================================================================
-    upf_dict['total_charge_density'] = read_mesh_data(upf, upf_dict['header']['mesh_size'])
+    upf_dict['total_charge_density'] = upf.read_mesh_data(upf_dict['header']['mesh_size'])
 
-    upf.close()
 
+def parse_upf1_from_string(upf1_str, as_arrays=False):
+    """Convert a UPF v1 string to the SIRIUS pseudopotential dictionary.
 
-def parse_upf1_from_string(upf1_str):
+    :param upf1_str: content of the UPF file
+    :param as_arrays: keep radial functions as numpy arrays instead of lists
+    :raises UpfParseError: if the file is truncated or inconsistent
+    """
     upf_dict = {}
+    sections = UpfSections(upf1_str)
 
-    parse_header(upf_dict, upf1_str)
-    parse_mesh(upf_dict, upf1_str)
-    if upf_dict['header']['core_correction'] == 1: parse_nlcc(upf_dict, upf1_str)
-    parse_local(upf_dict, upf1_str)
-    parse_non_local(upf_dict, upf1_str)
-    parse_pswfc(upf_dict, upf1_str)
-    parse_rhoatom(upf_dict, upf1_str)
+    parse_header(upf_dict, sections)
+    parse_mesh(upf_dict, sections)
+    if upf_dict['header']['core_correction'] == 1: parse_nlcc(upf_dict, sections)
+    parse_local(upf_dict, sections)
+    parse_non_local(upf_dict, sections)
+    parse_pswfc(upf_dict, sections)
+    parse_rhoatom(upf_dict, sections)
+
+    if not as_arrays:
+        upf_dict = arrays_to_lists(upf_dict)
 
     pp_dict = {}
     pp_dict['pseudo_potential'] = upf_dict
@@ -426,15 +500,10 @@ def main():
 
     with open(sys.argv[1], 'r') as fh:
         upf = fh.read()
-    pp_dict = parse_upf1_from_string(upf)
-
-    fout = open(sys.argv[1] + ".json", "w")
+    pp_dict = parse_upf1_from_string(upf, as_arrays=True)
 
-    # Match comma, space, newline and an arbitrary number of spaces ',\s\n\s*' with the
-    # following conditions: a digit before (?<=[0-9]) and a minus or a digit after (?=[-|0-9]).
-    # Replace found sequence with comma and space.
-    fout.write(re.sub(r"(?<=[0-9]),\s\n\s*(?=[-|0-9])", r", ", json.dumps(pp_dict, indent=2)))
-    fout.close()
+    with open(sys.argv[1] + ".json", "w") as fout:
+        dump_pseudo(pp_dict, fout)
 
 if __name__ == "__main__":
     main()
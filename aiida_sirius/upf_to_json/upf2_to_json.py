@@ -17,19 +17,84 @@
 # CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import json
 import sys
-import re
 import xml.etree.ElementTree as ET
 
+from .arrays import parse_float_array, arrays_to_lists
+from .exceptions import UpfParseError
+from .serialize import dump_pseudo
+
 
 def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
 
 
-def parse_header(upf_dict, root):
+class UpfIndex(object):
+    """Index of all elements of a UPF v2 tree by their path.
+
+    Paths are relative to the root element, e.g. 'PP_NONLOCAL/PP_BETA.1'.
+    The index is built in a single walk of the tree, the section parsers below
+    then look up elements in constant time instead of calling `findall`.
+
+    The streaming parser stores attribute-only elements together with their
+    already decoded numerical content (see `add`).
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._arrays = {}
+
+    @classmethod
+    def from_root(cls, root):
+        index = cls()
+        index.extend(root)
+        return index
+
+    def extend(self, root):
+        """Add all elements below `root`, e.g. a single section wrapped in a dummy root."""
+        self._add_children(root, '')
+
+    def _add_children(self, elem, prefix):
+        for child in elem:
+            path = prefix + child.tag
+            # keep the first occurrence (same as `findall(path)[0]`)
+            self._nodes.setdefault(path, child)
+            self._add_children(child, path + '/')
+
+    def add(self, path, node, array=None):
+        """Add `node` at `path`, `array` is its decoded text (if any)."""
+        if path in self._nodes:
+            return
+        self._nodes[path] = node
+        if array is not None:
+            self._arrays[path] = array
+
+    def __getitem__(self, path):
+        try:
+            return self._nodes[path]
+        except KeyError:
+            raise KeyError('UPF file has no element {}'.format(path))
+
+    def __contains__(self, path):
+        return path in self._nodes
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def array(self, path, scale=None):
+        """Numerical content of the element at `path` as a float64 array."""
+        if path in self._arrays:
+            values = self._arrays[path]
+            return values if scale is None else values * scale
+        return parse_float_array(self[path].text, scale=scale)
+
+
+def parse_header(upf_dict, index):
     # header
-    node = root.findall("./PP_HEADER")[0]
+    node = index["PP_HEADER"]
     upf_dict['header'] = {}
     upf_dict['header']['number_of_proj'] = int(node.attrib['number_of_proj'])
     upf_dict['header']['core_correction'] = str2bool(
@@ -43,13 +108,13 @@ def parse_header(upf_dict, root):
     upf_dict['header']['spin_orbit'] = str2bool(node.attrib['has_so'])
 
 
-def parse_radial_grid(upf_dict, root):
+def parse_radial_grid(upf_dict, index):
     # radial grid
-    node = root.findall("./PP_MESH/PP_R")[0]
-    rg = [float(e) for e in str.split(node.text)]
+    node = index["PP_MESH/PP_R"]
+    rg = index.array("PP_MESH/PP_R")
     try:
-        np = int(node.attrib['size'])
-        if np != len(rg):
+        size = int(node.attrib['size'])
+        if size != len(rg):
             print("Wrong number of radial points")
     except KeyError:
         print('Warning missing size field in attributes')
@@ -63,11 +128,37 @@ def parse_radial_grid(upf_dict, root):
     upf_dict['radial_grid'] = rg
 
 
+def parse_nlcc(upf_dict, index):
+    # non linear core correction
+    node = index["PP_NLCC"]
+    rc = index.array("PP_NLCC")
+    try:
+        size = int(node.attrib['size'])
+        if size != len(rc):
+            print("Wrong number of points")
+    except KeyError:
+        print('Warning: missing size field in attributes ' + str(node))
+    upf_dict['core_charge_density'] = rc
+
+
+def parse_local(upf_dict, index):
+    # local part of potential
+    node = index["PP_LOCAL"]
+    vloc = index.array("PP_LOCAL", scale=0.5)  # convert to Ha
+    try:
+        size = int(node.attrib['size'])
+        if size != len(vloc):
+            print("Wrong number of points")
+    except KeyError:
+        print('Warning missing size field in attributes ' + str(node))
+    upf_dict['local_potential'] = vloc
+
+
 ##########################################################################
 #### Read non-local part: basis PS and AE (for PAW) functions,
 #### beta(or p for PAW)-projectors, Qij augmentation coefs, Dij
 ##########################################################################
-def parse_non_local(upf_dict, root):
+def parse_non_local(upf_dict, index):
     # ----------------------------------------------------
     # ------ Read beta (or p for PAW) - projectors  ------
     # ----------------------------------------------------
@@ -76,10 +167,11 @@ def parse_non_local(upf_dict, root):
     proj_num = upf_dict['header']['number_of_proj']
 
     for i in range(proj_num):
-        node = root.findall("./PP_NONLOCAL/PP_BETA.%i" % (i + 1))[0]
+        path = "PP_NONLOCAL/PP_BETA.%i" % (i + 1)
+        node = index[path]
         nr = int(node.attrib['cutoff_radius_index'])
         upf_dict['beta_projectors'].append({})
-        beta = [float(e) for e in str.split(node.text)]
+        beta = index.array(path)
         upf_dict['beta_projectors'][i]['radial_function'] = beta[0:nr]
         if 'label' in node.attrib:
             upf_dict['beta_projectors'][i]['label'] = node.attrib['label']
@@ -90,17 +182,14 @@ def parse_non_local(upf_dict, root):
         # if upf_dict['header']['is_ultrasoft']:
         #  upf_dict['beta_projectors'][i]['ultrasoft_cutoff_radius'] = float(node.attrib['ultrasoft_cutoff_radius'])
         if upf_dict['header']['spin_orbit']:
-            node1 = root.findall("./PP_SPIN_ORB/PP_RELBETA.%i" % (i + 1))[0]
+            node1 = index["PP_SPIN_ORB/PP_RELBETA.%i" % (i + 1)]
             upf_dict['beta_projectors'][i]['total_angular_momentum'] = float(
                 node1.attrib['jjj'])
 
     # --------------------------
     # ------- Dij matrix -------
     # --------------------------
-    node = root.findall('./PP_NONLOCAL/PP_DIJ')[0]
-    # dij = [float(e) for e in str.split(node.text)]
-    upf_dict['D_ion'] = [float(e) / 2
-                         for e in str.split(node.text)]  # convert to hartree
+    upf_dict['D_ion'] = index.array('PP_NONLOCAL/PP_DIJ', scale=0.5)  # convert to hartree
 
     # if upf_dict['header']['pseudo_type'] == 'NC': return
 
@@ -110,11 +199,10 @@ def parse_non_local(upf_dict, root):
     # ------------------------------------
     # ------- augmentation part: Qij  ----
     # ------------------------------------
-    node = root.findall('./PP_NONLOCAL/PP_AUGMENTATION')[0]
+    node = index['PP_NONLOCAL/PP_AUGMENTATION']
 
     if node.attrib['q_with_l'] != 'T':
-        print("Don't know how to parse this 'q_with_l != T'")
-        sys.exit(0)
+        raise UpfParseError("Don't know how to parse this 'q_with_l != T'")
 
     upf_dict['augmentation'] = []
 
@@ -129,32 +217,28 @@ def parse_non_local(upf_dict, root):
             lj = upf_dict['beta_projectors'][j]['angular_momentum']
             for l in range(abs(li - lj), li + lj + 1):
                 if (li + lj + l) % 2 == 0:
-                    node = root.findall(
-                        "./PP_NONLOCAL/PP_AUGMENTATION/PP_QIJL.%i.%i.%i" %
-                        (i + 1, j + 1, l))[0]
+                    path = "PP_NONLOCAL/PP_AUGMENTATION/PP_QIJL.%i.%i.%i" % (i + 1, j + 1, l)
+                    node = index[path]
                     qij = {}
-                    qij['radial_function'] = [
-                        float(e) for e in str.split(node.text)
-                    ]
+                    qij['radial_function'] = index.array(path)
                     qij['i'] = i
                     qij['j'] = j
                     qij['angular_momentum'] = int(
                         node.attrib['angular_momentum'])
                     if l != qij['angular_momentum']:
-                        print("Wrong angular momentum for Qij")
-                        sys.exit(0)
+                        raise UpfParseError("Wrong angular momentum for Qij")
                     upf_dict['augmentation'].append(qij)
 
 
 ####################################################
 ############# Read PAW data ########################
 ####################################################
-def parse_PAW(upf_dict, root):
+def parse_PAW(upf_dict, index):
 
     if upf_dict['header']['pseudo_type'] != "PAW":
         return
 
-    node = root.findall('./PP_NONLOCAL/PP_AUGMENTATION')[0]
+    node = index['PP_NONLOCAL/PP_AUGMENTATION']
     upf_dict['header']['cutoff_radius_index'] = int(
         node.attrib['cutoff_r_index'])
 
@@ -163,15 +247,8 @@ def parse_PAW(upf_dict, root):
     # -------------------------------------
     # ---- Read PP_Q and PP_MULTIPOLES ----
     # -------------------------------------
-    node = root.findall('./PP_NONLOCAL/PP_AUGMENTATION/PP_Q')[0]
-    upf_dict['paw_data']['aug_integrals'] = [
-        float(e) for e in str.split(node.text)
-    ]
-
-    node = root.findall('./PP_NONLOCAL/PP_AUGMENTATION/PP_MULTIPOLES')[0]
-    upf_dict['paw_data']['aug_multipoles'] = [
-        float(e) for e in str.split(node.text)
-    ]
+    upf_dict['paw_data']['aug_integrals'] = index.array('PP_NONLOCAL/PP_AUGMENTATION/PP_Q')
+    upf_dict['paw_data']['aug_multipoles'] = index.array('PP_NONLOCAL/PP_AUGMENTATION/PP_MULTIPOLES')
 
     # ----------------------------------------
     # ---- Read AE and PS basis wave functions
@@ -183,8 +260,9 @@ def parse_PAW(upf_dict, root):
 
     for i in range(nb):
         wfc = {}
-        node = root.findall("./PP_FULL_WFC/PP_AEWFC.%i" % (i + 1))[0]
-        wfc['radial_function'] = [float(e) for e in str.split(node.text)]
+        path = "PP_FULL_WFC/PP_AEWFC.%i" % (i + 1)
+        node = index[path]
+        wfc['radial_function'] = index.array(path)
         wfc['angular_momentum'] = int(node.attrib['l'])
         # wfc['label'] = node.attrib['label']
         # wfc['index'] =  int(node.attrib['index']) - 1
@@ -195,66 +273,50 @@ def parse_PAW(upf_dict, root):
 
     for i in range(nb):
         wfc = {}
-        node = root.findall("./PP_FULL_WFC/PP_PSWFC.%i" % (i + 1))[0]
-        wfc['radial_function'] = [float(e) for e in str.split(node.text)]
+        path = "PP_FULL_WFC/PP_PSWFC.%i" % (i + 1)
+        node = index[path]
+        wfc['radial_function'] = index.array(path)
         wfc['angular_momentum'] = int(node.attrib['l'])
         # wfc['label'] = node.attrib['label']
         # wfc['index'] =  int(node.attrib['index']) - 1
         upf_dict['paw_data']['ps_wfc'].append(wfc)
 
     # ------ Read PP_PAW section: occupation, AE_NLCC, AE_VLOC
-    node = root.findall("./PP_PAW")[0]
+    node = index["PP_PAW"]
     try:
         upf_dict['header']["paw_core_energy"] = float(
             node.attrib['core_energy']) / 2  # convert to Ha
     except KeyError:
         print('WARNING: PP_PAW has no core_energy set!')
 
-    node = root.findall("./PP_PAW/PP_OCCUPATIONS")[0]
-    size = int(node.attrib['size'])
-
     # ---- occupation
-    for i in range(size):
-        upf_dict['paw_data']['occupations'] = [
-            float(e) for e in str.split(node.text)
-        ]
+    upf_dict['paw_data']['occupations'] = index.array("PP_PAW/PP_OCCUPATIONS")
 
     # ---- Read AE core correction (density of core charge)
-    node = root.findall("./PP_PAW/PP_AE_NLCC")[0]
-    size = int(node.attrib['size'])
-
-    for i in range(size):
-        upf_dict['paw_data']['ae_core_charge_density'] = [
-            float(e) for e in str.split(node.text)
-        ]
+    upf_dict['paw_data']['ae_core_charge_density'] = index.array("PP_PAW/PP_AE_NLCC")
 
     # ---- Read AE local potential
-    node = root.findall("./PP_PAW/PP_AE_VLOC")[0]
-    size = int(node.attrib['size'])
-
-    for i in range(size):
-        upf_dict['paw_data']['ae_local_potential'] = [
-            float(e) / 2 for e in str.split(node.text)
-        ]  # convert to Ha
+    upf_dict['paw_data']['ae_local_potential'] = index.array("PP_PAW/PP_AE_VLOC", scale=0.5)  # convert to Ha
 
 
 ####################################################
 ############# Read starting wave functions #########
 ####################################################
-def parse_pswfc(upf_dict, root):
+def parse_pswfc(upf_dict, index):
     # if upf_dict['header']['pseudo_type'] != 'NC': return
 
     upf_dict['atomic_wave_functions'] = []
 
     for i in range(upf_dict['header']['number_of_wfc']):
         wfc = {}
-        node = root.findall("./PP_PSWFC/PP_CHI.%i" % (i + 1))[0]
-        wfc['radial_function'] = [float(e) for e in str.split(node.text)]
+        path = "PP_PSWFC/PP_CHI.%i" % (i + 1)
+        node = index[path]
+        wfc['radial_function'] = index.array(path)
         wfc['angular_momentum'] = int(node.attrib['l'])
         # wfc['label'] = node.attrib['label']
         wfc['occupation'] = float(node.attrib['occupation'])
         if upf_dict['header']['spin_orbit']:
-            node = root.findall("./PP_SPIN_ORB/PP_RELWFC.%i" % (i + 1))[0]
+            node = index["PP_SPIN_ORB/PP_RELWFC.%i" % (i + 1)]
             wfc['total_angular_momentum'] = float(node.attrib['jchi'])
         upf_dict['atomic_wave_functions'].append(wfc)
 
@@ -262,14 +324,14 @@ def parse_pswfc(upf_dict, root):
 ####################################################
 ############# Spin orbit coupling #################
 ####################################################
-def parse_SpinOrbit(upf_dict, root):
+def parse_SpinOrbit(upf_dict, index):
     if not upf_dict['header']['spin_orbit']: return
 
     # Spin orbit informations for the projectors
 
     proj_num = upf_dict['header']['number_of_proj']
     for i in range(proj_num):
-        node = root.findall("./PP_SPIN_ORB/PP_RELBETA.%i" % (i + 1))[0]
+        node = index["PP_SPIN_ORB/PP_RELBETA.%i" % (i + 1)]
         upf_dict['beta_projectors'][i]['angular_momentum'] = float(
             node.attrib['lll'])
         upf_dict['beta_projectors'][i]['total_angular_momentum'] = float(
@@ -286,63 +348,54 @@ def parse_SpinOrbit(upf_dict, root):
 #      upf_dict['paw_data']['ps_wfc']['total_angular_momentum'] = float(node('jchi'))
 
 
-def parse_upf2_from_string(upf2_str):
+def parse_rhoatom(upf_dict, index):
+    # rho
+    node = index["PP_RHOATOM"]
+    rho = index.array("PP_RHOATOM")
+    try:
+        size = int(node.attrib['size'])
+        if size != len(rho):
+            print("Wrong number of points")
+    except KeyError:
+        print('Warning: missing size field in attributes ' + str(node))
+    upf_dict['total_charge_density'] = rho
 
-    # fix string
-    upf2_str = upf2_str.replace("&", "")
 
-    root = ET.fromstring(upf2_str)
+def parse_upf2_from_index(index, as_arrays=False):
+    """Convert an indexed UPF v2 tree to the SIRIUS pseudopotential dictionary.
 
+    :param index: `UpfIndex`
+    :param as_arrays: keep radial functions as numpy arrays instead of lists
+    """
     upf_dict = {}
 
-    parse_header(upf_dict, root)
-    parse_radial_grid(upf_dict, root)
+    parse_header(upf_dict, index)
+    parse_radial_grid(upf_dict, index)
 
     # non linear core correction
     if upf_dict['header']['core_correction']:
-        node = root.findall("./PP_NLCC")[0]
-        rc = [float(e) for e in str.split(node.text)]
-        try:
-            np = int(node.attrib['size'])
-            if np != len(rc):
-                print("Wrong number of points")
-        except KeyError:
-            print('Warning: missing size field in attributes ' + str(node))
-        upf_dict['core_charge_density'] = rc
+        parse_nlcc(upf_dict, index)
 
     # local part of potential
-    node = root.findall("./PP_LOCAL")[0]
-    vloc = [float(e) / 2 for e in str.split(node.text)]  # convert to Ha
-    try:
-        np = int(node.attrib['size'])
-        if np != len(vloc):
-            print("Wrong number of points")
-    except KeyError:
-        print('Warning missing size field in attributes ' + str(node))
-    upf_dict['local_potential'] = vloc
+    parse_local(upf_dict, index)
 
     # non-local part of potential
-    parse_non_local(upf_dict, root)
+    parse_non_local(upf_dict, index)
 
     # parse PAW data
-    parse_PAW(upf_dict, root)
+    parse_PAW(upf_dict, index)
 
     # parse pseudo wavefunctions
-    parse_pswfc(upf_dict, root)
+    parse_pswfc(upf_dict, index)
 
     # parse data for spin orbit coupling
-    parse_SpinOrbit(upf_dict, root)
+    parse_SpinOrbit(upf_dict, index)
 
     # rho
-    node = root.findall("./PP_RHOATOM")[0]
-    rho = [float(e) for e in str.split(node.text)]
-    try:
-        np = int(node.attrib['size'])
-        if np != len(rho):
-            print("Wrong number of points")
-    except KeyError:
-        print('Warning: missing size field in attributes ' + str(node))
-    upf_dict['total_charge_density'] = rho
+    parse_rhoatom(upf_dict, index)
+
+    if not as_arrays:
+        upf_dict = arrays_to_lists(upf_dict)
 
     pp_dict = {}
     pp_dict["pseudo_potential"] = upf_dict
@@ -350,6 +403,86 @@ def parse_upf2_from_string(upf2_str):
     return pp_dict
 
 
+def parse_upf2_from_string(upf2_str, as_arrays=False):
+    """Convert a UPF v2 string to the SIRIUS pseudopotential dictionary.
+
+    :param upf2_str: content of the UPF file
+    :param as_arrays: keep radial functions as numpy arrays instead of lists
+    """
+
+    # fix string
+    upf2_str = upf2_str.replace("&", "")
+
+    root = ET.fromstring(upf2_str)
+
+    return parse_upf2_from_index(UpfIndex.from_root(root), as_arrays=as_arrays)
+
+
+def _read_chunks(stream, chunk_size):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_upf2_from_chunks(chunks, as_arrays=False):
+    """Convert a UPF v2 file given as an iterable of chunks (bytes or str).
+
+    Elements are decoded as soon as they are complete and then dropped from
+    the tree, such that neither the full file nor the full xml tree are ever
+    held in memory. See `parse_upf2_from_string` for the arguments.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    index = UpfIndex()
+    root = None
+    tags = []
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        # fix string (see `parse_upf2_from_string`)
+        parser.feed(chunk.replace(b'&', b''))
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                else:
+                    tags.append(elem.tag)
+                continue
+            if not tags:
+                # end of the root element
+                break
+            if tags[0] != 'PP_INFO':
+                node = ET.Element(elem.tag, elem.attrib)
+                array = None
+                if len(elem) == 0:
+                    try:
+                        array = parse_float_array(elem.text)
+                    except ValueError:
+                        # not numerical, keep the text
+                        node.text = elem.text
+                index.add('/'.join(tags), node, array)
+            if len(tags) == 1:
+                # section done, free it
+                root.remove(elem)
+            else:
+                elem.clear()
+            tags.pop()
+    parser.close()
+
+    return parse_upf2_from_index(index, as_arrays=as_arrays)
+
+
+def parse_upf2_from_stream(stream, as_arrays=False, chunk_size=2**16):
+    """Convert a UPF v2 file from a file handle with bounded memory.
+
+    :param stream: file handle opened in binary (preferred) or text mode
+    :param as_arrays: keep radial functions as numpy arrays instead of lists
+    :param chunk_size: number of bytes read at once
+    """
+    return parse_upf2_from_chunks(_read_chunks(stream, chunk_size), as_arrays=as_arrays)
+
+
 def parse_upf2_from_file(upf2_fname):
     with open(upf2_fname) as inpf:
         upf2_str = inpf.read()
@@ -358,17 +491,11 @@ def parse_upf2_from_file(upf2_fname):
 
 def main():
 
-    pp_dict = parse_upf2_from_file(sys.argv[1])
-
-    fout = open(sys.argv[1] + ".json", "w")
+    with open(sys.argv[1], 'rb') as fh:
+        pp_dict = parse_upf2_from_stream(fh, as_arrays=True)
 
-    # Match comma, space, newline and an arbitrary number of spaces ',\s\n\s*' with the
-    # following conditions: a digit before (?<=[0-9]) and a minus or a digit after (?=[-|0-9]).
-    # Replace found sequence with comma and space.
-    fout.write(
-        re.sub(r"(?<=[0-9]),\s\n\s*(?=[-|0-9])", r", ",
-               json.dumps(pp_dict, indent=2)))
-    fout.close()
+    with open(sys.argv[1] + ".json", "w") as fout:
+        dump_pseudo(pp_dict, fout)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,27 @@
+import itertools
 import json
 import sys
 import re
 from .upf1_to_json import parse_upf1_from_string
-from .upf2_to_json import parse_upf2_from_string
+from .upf2_to_json import parse_upf2_from_string, parse_upf2_from_chunks, _read_chunks
+
+# bump whenever the generated json changes, invalidates cached conversions
+CONVERTER_VERSION = 1
+
+def _first_line(upf, start=0):
+    end = upf.find('\n', start)
+    return upf[start:] if end < 0 else upf[start:end]
+
 
 def get_upf_version(upf):
-    line = upf.split('\n')[0]
+    """UPF version (1 or 2, 0 if unknown) from the first line of `upf`.
+
+    Only the first line (after an optional xml declaration) is inspected,
+    hence `upf` can be the beginning of a file.
+    """
+    line = _first_line(upf)
+    if line.lstrip().startswith('<?xml'):
+        line = _first_line(upf, len(line) + 1)
     if "<PP_INFO>" in line:
         return 1
     elif "UPF version" in line:
@@ -23,3 +39,27 @@ def upf_to_json(upf_str, fname):
 
     pp_dict['pseudo_potential']['header']['original_upf_file'] = fname
     return pp_dict
+
+
+def upf_stream_to_json(stream, fname, chunk_size=2**16):
+    """Convert a UPF file from an open file handle (binary or text mode).
+
+    UPF v2 files are parsed incrementally with bounded memory, UPF v1 files
+    are read completely.
+    """
+    head = stream.read(chunk_size)
+    head_str = head.decode('utf-8', 'ignore') if isinstance(head, bytes) else head
+    version = get_upf_version(head_str)
+    if version == 0:
+        return None
+    if version == 1:
+        upf_str = head + stream.read()
+        if isinstance(upf_str, bytes):
+            upf_str = upf_str.decode('utf-8')
+        pp_dict = parse_upf1_from_string(upf_str)
+    if version == 2:
+        chunks = itertools.chain([head], _read_chunks(stream, chunk_size))
+        pp_dict = parse_upf2_from_chunks(chunks)
+
+    pp_dict['pseudo_potential']['header']['original_upf_file'] = fname
+    return pp_dict
@@ -0,0 +1,86 @@
+"""
+Benchmark `add_cell_kpoints_mag_to_sirius` against the number of atoms.
+
+The per-kind filtering of the sites (previous implementation) is timed for
+comparison. Structures are random supercells with `--kinds` species, half of
+them magnetic.
+
+Usage: python benchmarks/bench_unit_cell.py [--kinds 20] [--repeat 3]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+# run from a checkout without installing the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from aiida_sirius.calculations.scf_base import add_cell_kpoints_mag_to_sirius
+
+
+class FakeStructure(object):
+    """Minimal stand-in for `StructureData` (only `attributes` is used)."""
+
+    def __init__(self, num_atoms, num_kinds, seed=0):
+        rng = np.random.RandomState(seed)
+        kinds = rng.randint(num_kinds, size=num_atoms)
+        positions = rng.uniform(0, 50, size=(num_atoms, 3))
+        self.attributes = {
+            'cell': (50 * np.eye(3)).tolist(),
+            'sites': [{'kind_name': 'X{}'.format(kind), 'position': position.tolist()}
+                      for kind, position in zip(kinds, positions)],
+        }
+
+
+class FakeKpoints(object):
+    attributes = {'mesh': [2, 2, 2], 'offset': [0, 0, 0]}
+
+
+def magnetization_of(structure, num_kinds):
+    """Per-site moments for the first half of the kinds."""
+    counts = {}
+    for site in structure.attributes['sites']:
+        counts[site['kind_name']] = counts.get(site['kind_name'], 0) + 1
+    return {'X{}'.format(kind): np.ones((counts.get('X{}'.format(kind), 0), 3)).tolist()
+            for kind in range(num_kinds // 2)}
+
+
+def atoms_filter_per_kind(structure, magnetization):
+    """Previous implementation of the atoms block: filter all sites for every kind."""
+    sites = structure.attributes['sites']
+    atoms = {}
+    for atom_type in set(site['kind_name'] for site in sites):
+        coords = [site['position'] for site in filter(lambda x: x['kind_name'] == atom_type, sites)]  # pylint: disable=cell-var-from-loop
+        if atom_type in magnetization:
+            coords = np.hstack((np.array(coords), np.array(magnetization[atom_type])))
+        atoms[atom_type] = [list(x) for x in coords]
+    return atoms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--kinds', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    params = {'parameters': {}, 'control': {}}
+    kpoints = FakeKpoints()
+    print('{:>8} {:>12} {:>14} {:>8}'.format('atoms', 'new [ms]', 'per kind [ms]', 'speedup'))
+    for num_atoms in (100, 1000, 10000, 50000):
+        structure = FakeStructure(num_atoms, args.kinds)
+        magnetization = magnetization_of(structure, args.kinds)
+        t_new = min(timeit.repeat(lambda: add_cell_kpoints_mag_to_sirius(params, structure, magnetization, kpoints),
+                                  number=1, repeat=args.repeat))
+        t_old = min(timeit.repeat(lambda: atoms_filter_per_kind(structure, magnetization),
+                                  number=1, repeat=args.repeat))
+        print('{:>8} {:>12.2f} {:>14.2f} {:>7.1f}x'.format(num_atoms, 1e3 * t_new, 1e3 * t_old, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
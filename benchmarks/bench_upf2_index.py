@@ -0,0 +1,58 @@
+"""
+Benchmark element lookups in UPF v2 files: `findall` per element vs. `UpfIndex`.
+
+Usage: python benchmarks/bench_upf2_index.py [--mesh-size 1500] [--repeat 5]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+import xml.etree.ElementTree as ET
+
+# run from a checkout without installing the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from aiida_sirius.tests.synthetic_upf import synthetic_upf2
+from aiida_sirius.upf_to_json.upf2_to_json import UpfIndex, parse_upf2_from_string
+
+
+def lookup_findall(root, paths):
+    for path in paths:
+        root.findall('./' + path)[0]
+
+
+def lookup_index(root, paths):
+    index = UpfIndex.from_root(root)
+    for path in paths:
+        index[path]  # pylint: disable=pointless-statement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--mesh-size', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>4} {:>6} {:>7} {:>12} {:>12} {:>8} {:>12}'.format(
+        'type', 'nproj', 'lookups', 'findall [ms]', 'index [ms]', 'speedup', 'parse [ms]'))
+    for pseudo_type in ('US', 'PAW'):
+        for num_proj in (4, 8, 16, 24):
+            upf = synthetic_upf2(mesh_size=args.mesh_size, num_proj=num_proj, num_wfc=4, pseudo_type=pseudo_type)
+            root = ET.fromstring(upf.replace('&', ''))
+            # every element the section parsers access
+            paths = [path for path in UpfIndex.from_root(root) if not path.startswith('PP_INFO')]
+
+            t_findall = min(timeit.repeat(lambda: lookup_findall(root, paths), number=1, repeat=args.repeat))
+            t_index = min(timeit.repeat(lambda: lookup_index(root, paths), number=1, repeat=args.repeat))
+            t_parse = min(timeit.repeat(lambda: parse_upf2_from_string(upf), number=1, repeat=args.repeat))
+            print('{:>4} {:>6} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x {:>12.3f}'.format(
+                pseudo_type, num_proj, len(paths), 1e3 * t_findall, 1e3 * t_index, t_findall / t_index,
+                1e3 * t_parse))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark the UPF converters stage by stage on synthetic files.
+
+For every combination of UPF version, pseudopotential type, mesh size and
+number of projectors the time (best of `--repeat`) and the peak memory
+(tracemalloc) of each parser stage are reported:
+
+  v1: scan (tag offsets), sections (decode to arrays), lists, json
+  v2: xml (ElementTree), index, sections (decode to arrays), lists, json, stream
+
+Results can be stored with `--save` and compared against a stored baseline
+with `--check`, which exits with status 1 if a stage is slower or needs more
+memory than `--threshold` times the baseline. Timings depend on the machine,
+create the baseline on the machine doing the comparison.
+
+Usage: python benchmarks/bench_upf_parsers.py [--quick] [--save FILE | --check FILE]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+# run from a checkout without installing the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from aiida_sirius.tests.synthetic_upf import synthetic_upf1, synthetic_upf2
+from aiida_sirius.upf_to_json import upf_stream_to_json, dumps_pseudo
+from aiida_sirius.upf_to_json.arrays import arrays_to_lists
+from aiida_sirius.upf_to_json.upf1_to_json import UpfSections, parse_upf1_from_string
+from aiida_sirius.upf_to_json.upf2_to_json import UpfIndex, parse_upf2_from_index
+
+MESH_SIZES = (1000, 4000, 16000)
+NUM_PROJS = (2, 8, 16)
+QUICK_MESH_SIZES = (1000,)
+QUICK_NUM_PROJS = (2, 8)
+#: UPF version -> pseudopotential types
+PSEUDO_TYPES = {1: ('NC', 'US'), 2: ('NC', 'US', 'PAW', 'SO')}
+
+
+def stages_upf1(upf):
+    """List of (name, function) of the UPF v1 converter, each function takes the previous result."""
+    return [
+        ('scan', lambda _: UpfSections(upf)),
+        ('sections', lambda _: parse_upf1_from_string(upf, as_arrays=True)),
+        ('lists', arrays_to_lists),
+        ('json', dumps_pseudo),
+    ]
+
+
+def stages_upf2(upf):
+    """List of (name, function) of the UPF v2 converter, each function takes the previous result."""
+    return [
+        ('xml', lambda _: ET.fromstring(upf.replace('&', ''))),
+        ('index', UpfIndex.from_root),
+        ('sections', lambda index: parse_upf2_from_index(index, as_arrays=True)),
+        ('lists', arrays_to_lists),
+        ('json', dumps_pseudo),
+        ('stream', lambda _: upf_stream_to_json(io.BytesIO(upf.encode()), fname='bench.upf')),
+    ]
+
+
+def measure(stages, repeat):
+    """Run the stages in order, return {stage: (time [s], peak memory [bytes])}."""
+    results = {}
+    data = None
+    for name, func in stages:
+        args = data
+        seconds = min(timeit.repeat(lambda: func(args), number=1, repeat=repeat))  # pylint: disable=cell-var-from-loop
+        tracemalloc.start()
+        data = func(args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = (seconds, peak)
+    return results
+
+
+def run(mesh_sizes, num_projs, repeat):
+    """Benchmark all cases, return {case: {stage: (time, peak)}}."""
+    results = {}
+    for version, pseudo_types in sorted(PSEUDO_TYPES.items()):
+        for pseudo_type in pseudo_types:
+            for mesh_size in mesh_sizes:
+                for num_proj in num_projs:
+                    if version == 1:
+                        upf = synthetic_upf1(mesh_size, num_proj, num_wfc=4, pseudo_type=pseudo_type)
+                        stages = stages_upf1(upf)
+                    else:
+                        upf = synthetic_upf2(mesh_size, num_proj, num_wfc=4, pseudo_type=pseudo_type)
+                        stages = stages_upf2(upf)
+                    case = 'v{}-{}-mesh{}-proj{}'.format(version, pseudo_type, mesh_size, num_proj)
+                    results[case] = measure(stages, repeat)
+                    print_case(case, len(upf), results[case])
+    return results
+
+
+def print_case(case, size, result):
+    print('{} ({:.1f} MB)'.format(case, size / 1e6))
+    for stage, (seconds, peak) in result.items():
+        print('    {:<10} {:>10.2f} ms {:>10.2f} MB'.format(stage, 1e3 * seconds, peak / 1e6))
+
+
+def check(results, baseline, threshold):
+    """Return the list of regressions with respect to the baseline."""
+    regressions = []
+    for case, stages in sorted(results.items()):
+        for stage, values in stages.items():
+            if stage not in baseline.get(case, {}):
+                continue
+            for label, value, reference in zip(('time', 'memory'), values, baseline[case][stage]):
+                if reference > 0 and value > threshold * reference:
+                    regressions.append('{} {} {}: {:.3g} > {} x {:.3g}'.format(
+                        case, stage, label, value, threshold, reference))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='small meshes only')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='FILE', help='store results as baseline')
+    parser.add_argument('--check', metavar='FILE', help='compare against a stored baseline')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='allowed ratio to the baseline (default: 1.5)')
+    args = parser.parse_args()
+
+    if args.quick:
+        results = run(QUICK_MESH_SIZES, QUICK_NUM_PROJS, args.repeat)
+    else:
+        results = run(MESH_SIZES, NUM_PROJS, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    if args.check:
+        with open(args.check, 'r') as fh:
+            baseline = json.load(fh)
+        regressions = check(results, baseline, args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+        print('no regressions with respect to {}'.format(args.check))
+
+
+if __name__ == '__main__':
+    main()